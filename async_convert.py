@@ -0,0 +1,202 @@
+import os, sys, time, asyncio, argparse
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Pipe
+
+from batch import Job, JobResult, convert_job, load_manifest, read_input, \
+    write_output, output_files
+from ktf_modules import update_makefile
+
+
+
+# The number of threads used for file I/O when none is given.
+DEFAULT_IO_THREADS = 4
+
+
+def _async_child(job, text, conn, quiet):
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    start = time.perf_counter()
+    try:
+        text, _, source_map, stats = convert_job(job, text)
+        conn.send(("ok", text, time.perf_counter() - start, source_map, stats))
+    except Exception as e:
+        conn.send(("error", repr(e), time.perf_counter() - start, None, None))
+    finally:
+        conn.close()
+
+
+class AsyncConverter(object):
+    """
+    Runs conversions for asyncio code without blocking the event loop. The
+    input and output files are read and written by a pool of threads, and
+    every conversion runs in a process of its own, at most "processes" at a
+    time. When the task awaiting a conversion is cancelled, its process is
+    killed at once, so no work goes on in the background.
+
+    Can be used as an async context manager, which calls "close" at the end.
+    """
+
+    def __init__(self, processes=None, io_threads=None, quiet=True):
+        self._process_count = processes or os.cpu_count()
+        self._processes = asyncio.Semaphore(self._process_count)
+        self._threads = ThreadPoolExecutor(io_threads or DEFAULT_IO_THREADS)
+        self._makefile_lock = asyncio.Lock()
+        self._quiet = quiet
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._threads.shutdown(wait=True)
+
+    async def _in_thread(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._threads, function, *args)
+
+    async def _run(self, job, text):
+        """
+        Converts the text in a child process, and returns the converted text,
+        the time it took, the source map and the stats (see JobResult).
+        """
+        loop = asyncio.get_running_loop()
+        parent_conn, child_conn = Pipe(duplex=False)
+        process = Process(target=_async_child,
+            args=(job, text, child_conn, self._quiet))
+        process.start()
+        child_conn.close()
+        readable = loop.create_future()
+        fd = parent_conn.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+            loop.remove_reader(fd)
+            try:
+                status, payload, seconds, source_map, stats = \
+                    await self._in_thread(parent_conn.recv)
+            except EOFError:
+                await self._in_thread(process.join)
+                raise RuntimeError("Conversion of {} crashed (exit code {})".format(
+                    job.input_file, process.exitcode))
+        finally:
+            loop.remove_reader(fd)
+            if process.is_alive():
+                process.kill()
+            process.join()
+            parent_conn.close()
+        if status != "ok":
+            raise RuntimeError("Conversion of {} failed: {}".format(
+                job.input_file, payload))
+        return payload, seconds, source_map, stats
+
+    async def write(self, results):
+        """
+        Writes the files of the results like "batch.write_results", in the
+        I/O threads. Returns the number of files actually written.
+        """
+        files, makefile_updates = output_files(results)
+        written = 0
+        for path, text in files:
+            written += await self._in_thread(write_output, path, text)
+        # Jobs in the same directory share a Makefile.in.
+        async with self._makefile_lock:
+            for update in makefile_updates:
+                await self._in_thread(update_makefile, *update)
+        return written
+
+    async def convert(self, job, write=True):
+        """
+        Converts one job and returns its JobResult. With write, the result
+        is written as well, unless the job is part of a bundle (bundles are
+        only written by "as_completed", once all their jobs are done).
+        """
+        text = await self._in_thread(read_input, job)
+        async with self._processes:
+            text, seconds, source_map, stats = await self._run(job, text)
+        result = JobResult(job, text, seconds, source_map, stats)
+        if write and not job.rules.get("bundle"):
+            await self.write([result])
+        return result
+
+    async def as_completed(self, jobs, write=True, window=None):
+        """
+        Converts the jobs and yields their JobResults in the order they
+        complete. No more than "window" jobs (by default twice the number
+        of processes) are started ahead of the results, so the files held
+        in memory do not grow with the number of jobs. If a job fails, or
+        the iteration is stopped early, the jobs still running are
+        cancelled.
+        """
+        window = window or 2 * self._process_count
+        jobs = iter(jobs)
+        running = set()
+        bundled = []
+        try:
+            while True:
+                for job in jobs:
+                    running.add(asyncio.ensure_future(self.convert(job, write)))
+                    if len(running) >= window:
+                        break
+                if not running:
+                    break
+                done, running = await asyncio.wait(running,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result.job.rules.get("bundle"):
+                        bundled.append(result)
+                    yield result
+            if write and bundled:
+                await self.write(bundled)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+
+async def convert_async(input_file, output_file, rules, steps, write=True,
+        converter=None):
+    """
+    Converts one file without blocking the event loop (see AsyncConverter)
+    and returns its JobResult. The file is written unless write is False.
+    """
+    job = Job(input_file, output_file, rules, steps)
+    if converter is not None:
+        return await converter.convert(job, write)
+    async with AsyncConverter(processes=1) as converter:
+        return await converter.convert(job, write)
+
+async def convert_batch_async(jobs, processes=None, io_threads=None, write=True):
+    """
+    Converts the jobs with an AsyncConverter of their own, and yields their
+    JobResults as they complete.
+    """
+    async with AsyncConverter(processes, io_threads) as converter:
+        async for result in converter.as_completed(jobs, write):
+            yield result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Converts all the files listed in a JSON manifest (see '
+                    'batch.py) from an asyncio event loop.')
+    parser.add_argument('manifest')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of conversions to run at a time (default: one per CPU)')
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS)
+    args = parser.parse_args()
+
+    async def main():
+        start = time.perf_counter()
+        count = 0
+        async for result in convert_batch_async(load_manifest(args.manifest),
+                args.jobs, args.io_threads):
+            count += 1
+            print("{:.3f}s {}".format(result.seconds, result.job.output_file))
+        print("Converted {} files in {:.3f}s".format(count,
+            time.perf_counter() - start))
+
+    asyncio.run(main())
@@ -0,0 +1,611 @@
+import os, sys, ast, json, time, pickle, argparse, threading
+from collections import namedtuple
+from multiprocessing import Pool, shared_memory, resource_tracker
+
+from convert import Converter
+from conversion_cache import ConversionCache, IndexCache
+from ktf_modules import shard_suite, shard_paths, update_makefile, bundle_suites
+from source_map import map_path
+
+
+
+# A single conversion. "rules" is a rules dictionary like the ones in the
+# convert_wrapper_*.py files, and "steps" is the list of Converter method
+# names to call on it, in order (for example "add_include_code").
+Job = namedtuple('Job', 'input_file output_file rules steps')
+
+# The outcome of a single conversion. "source_map" is the source map of the
+# text as JSON, if the rules ask for one, and "stats" a dict with the
+# suite name, the size of the input, the time of every step and counts of
+# the regex passes (see "convert_job"), if known. "error" is set if the
+# conversion raised an exception, to the name of the step that was running
+# and the exception, as (step, message); "text" is None then.
+JobResult = namedtuple('JobResult', 'job text seconds source_map stats error',
+    defaults=(None, None, None))
+
+# Statistics for a whole batch. "ipc_bytes" is the number of bytes that had
+# to be pickled and sent through the pool pipes (tasks and results). See
+# "makespans" for the makespan fields. "index_hits" is the number of files
+# whose analysis was found in the IndexCache.
+BatchStats = namedtuple('BatchStats',
+    'transfer jobs seconds ipc_bytes makespan ideal_makespan index_hits',
+    defaults=(0,))
+
+# Extra room given to each output slot in shared memory, on top of twice the
+# size of the input. Outputs that still don't fit are sent back pickled.
+OUTPUT_SLOT_PADDING = 4096
+
+# The Converter each thread reuses for all its conversions (see "convert_job").
+_converters = threading.local()
+
+
+# Running the steps.
+# -------------------------------------------------------------------
+
+def run_steps(converter, steps, on_step=None, timings=None):
+    """
+    Calls the Converter methods named in "steps" on the converter, in order.
+    If given, on_step is called with the name of every step before it runs,
+    and (step, seconds) is appended to timings after it has run.
+    """
+    for step in steps:
+        if on_step:
+            on_step(step)
+        start = time.perf_counter()
+        getattr(converter, step)()
+        if timings is not None:
+            timings.append((step, time.perf_counter() - start))
+    return converter
+
+def convert_text(job, text, on_step=None, index=None):
+    """
+    Converts the text of one job and returns the converted text. If given,
+    index is the result of an earlier analysis of the same text (see
+    "Converter.get_index").
+    """
+    return convert_job(job, text, on_step, index)[0]
+
+def convert_job(job, text, on_step=None, index=None):
+    """
+    Same as "convert_text", but returns the index of the text, its source
+    map (if the rules ask for one) and the stats of the conversion (see
+    JobResult) as well.
+    """
+    if on_step:
+        on_step("__init__")
+    start = time.perf_counter()
+    converter = getattr(_converters, "converter", None)
+    if converter is None:
+        converter = _converters.converter = Converter(job.input_file,
+            job.output_file, job.rules, text=text, index=index)
+    else:
+        converter.reset(text, job.output_file, job.input_file, job.rules, index)
+    converter.prepare()
+    timings = [("__init__", time.perf_counter() - start)]
+    run_steps(converter, job.steps, on_step, timings)
+    source_map = converter.get_source_map().to_json() \
+        if job.rules.get("source_map") else None
+    passes = converter.get_passes()
+    stats = {
+        "suite": converter.get_suite_name(),
+        "input_bytes": len(text),
+        "steps": timings,
+        "passes": len(passes),
+        "skipped_passes": sum(1 for p in passes if p.skipped),
+        "matches": sum(p.matches for p in passes),
+        "reused_dummies": converter.get_reused_dummy_functions(),
+    }
+    text, index = converter.get_text(), converter.get_index()
+    # Not kept alive until the next conversion.
+    converter.reset(None, None)
+    return text, index, source_map, stats
+
+def read_input(job):
+    with open(job.input_file, 'r') as f:
+        return f.read()
+
+def write_output(path, text):
+    """
+    Writes text to path, unless the file already has exactly that content.
+    The write goes through a temporary file that is renamed into place, so
+    a file is never left half written. Returns True if the file was written.
+    """
+    try:
+        with open(path, 'r') as f:
+            if f.read() == text:
+                return False
+    except (IOError, UnicodeDecodeError):
+        pass
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+# Pool workers.
+# -------------------------------------------------------------------
+
+# Shared memory blocks attached by this worker process, by name.
+_attached_blocks = {}
+
+def init_worker(quiet):
+    """
+    The initializer of every pool that converts files. If quiet is set,
+    the output of the Converter is thrown away: it prints a lot of
+    progress chatter, which is only noise when many files are converted
+    at once.
+    """
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+def _attach(name):
+    block = _attached_blocks.get(name)
+    if block is None:
+        block = shared_memory.SharedMemory(name=name)
+        _attached_blocks[name] = block
+    return block
+
+def _convert_catching(job, text, text_index):
+    """
+    Same as "convert_job", but an exception only fails this job instead of
+    the whole batch: it is returned as the error of the job (see
+    JobResult), after the converted text, index, source map and stats,
+    which are all None then.
+    """
+    steps = []
+    try:
+        return convert_job(job, text, steps.append, text_index) + (None,)
+    except Exception as e:
+        return None, None, None, None, (steps[-1] if steps else None, repr(e))
+
+def pickle_worker(indexed_task):
+    """
+    Converts a job whose text (and index, if known) is sent along with it,
+    as (index, (job, text, text index)). Returns (index, pid, reply), with
+    the converted text, the time taken, the source map, the stats, the
+    error and the index of the text as the reply (see JobResult).
+    """
+    index, (job, text, text_index) = indexed_task
+    start = time.perf_counter()
+    result, text_index, source_map, stats, error = _convert_catching(job, text,
+        text_index)
+    return index, os.getpid(), (result, time.perf_counter() - start, source_map,
+        stats, error, text_index)
+
+def _shm_worker(indexed_task):
+    """
+    Converts the input found at [in_offset, in_offset + in_length) in the
+    input block and writes the result to the output slot starting at
+    out_offset. Only the length of the result is sent back, unless it does
+    not fit in the slot.
+    """
+    index, task = indexed_task
+    job, in_name, in_offset, in_length, out_name, out_offset, out_capacity, \
+        text_index = task
+    start = time.perf_counter()
+    in_block = _attach(in_name)
+    text = bytes(in_block.buf[in_offset:in_offset + in_length]).decode('utf-8')
+    data, text_index, source_map, stats, error = _convert_catching(job, text,
+        text_index)
+    if error:
+        return index, os.getpid(), (-1, None, time.perf_counter() - start,
+            None, None, error, None)
+    data = data.encode('utf-8')
+    seconds = time.perf_counter() - start
+    if len(data) > out_capacity:
+        return index, os.getpid(), (-1, data, seconds, source_map, stats,
+            None, text_index)
+    _attach(out_name).buf[out_offset:out_offset + len(data)] = data
+    return index, os.getpid(), (len(data), None, seconds, source_map, stats,
+        None, text_index)
+
+
+# Scheduling.
+# -------------------------------------------------------------------
+
+def estimate_costs(jobs, texts, cache=None):
+    """
+    Estimates how long every job will take. A file that has been converted
+    before is assumed to take the same time per byte as the last time;
+    other files use the median time per byte of all the conversions in the
+    cache. Without any recorded timings, the cost is simply the file size.
+    """
+    rates = sorted(s / max(1, n) for n, s in cache.timings()) if cache else []
+    default_rate = rates[len(rates) // 2] if rates else 1.0
+    costs = []
+    for job, text in zip(jobs, texts):
+        past = cache.timing(job.input_file) if cache else None
+        rate = past[1] / max(1, past[0]) if past else default_rate
+        costs.append(rate * len(text))
+    return costs
+
+def schedule_order(costs, schedule="lpt"):
+    """
+    Returns the job indexes in the order they should be handed out:
+        "lpt"  : longest (estimated) processing time first.
+        "fifo" : the order of the manifest.
+    """
+    if schedule == "lpt":
+        return sorted(range(len(costs)), key=lambda i: -costs[i])
+    elif schedule == "fifo":
+        return list(range(len(costs)))
+    raise ValueError("Unknown schedule: " + str(schedule))
+
+def makespans(seconds, pids, processes):
+    """
+    Returns the achieved makespan (the busy time of the most loaded worker)
+    and the ideal one: the total work spread evenly over all the workers,
+    but never less than the longest single job.
+    """
+    if not seconds:
+        return 0.0, 0.0
+    busy = {}
+    for s, pid in zip(seconds, pids):
+        busy[pid] = busy.get(pid, 0.0) + s
+    ideal = max(sum(seconds) / processes, max(seconds))
+    return max(busy.values()), ideal
+
+def _dispatch(pool, worker, tasks, order):
+    """
+    Hands the tasks to the pool one at a time, in the given order. A worker
+    takes the next task from the shared queue as soon as it is done with
+    the previous one, so no task ever waits behind a busy worker while
+    another one sits idle. Returns the replies in the order of the tasks,
+    and the worker pid that handled each task.
+    """
+    replies = [None] * len(tasks)
+    pids = [None] * len(tasks)
+    indexed_tasks = [(i, tasks[i]) for i in order]
+    for index, pid, reply in pool.imap_unordered(worker, indexed_tasks, chunksize=1):
+        replies[index] = reply
+        pids[index] = pid
+    return replies, pids
+
+
+# Batch conversion.
+# -------------------------------------------------------------------
+
+def _convert_pickle(pool, jobs, texts, indexes, order):
+    tasks = list(zip(jobs, texts, indexes))
+    replies, pids = _dispatch(pool, pickle_worker, tasks, order)
+    results = [JobResult(job, text, seconds, source_map, stats, error)
+        for job, (text, seconds, source_map, stats, error, _) in zip(jobs, replies)]
+    return results, tasks, replies, pids
+
+def _convert_shm(pool, jobs, texts, indexes, order):
+    inputs = [t.encode('utf-8') for t in texts]
+    in_block = shared_memory.SharedMemory(
+        create=True, size=max(1, sum(len(d) for d in inputs)))
+    out_block = shared_memory.SharedMemory(
+        create=True,
+        size=sum(2 * len(d) + OUTPUT_SLOT_PADDING for d in inputs))
+    try:
+        tasks = []
+        in_offset = out_offset = 0
+        for job, data, text_index in zip(jobs, inputs, indexes):
+            in_block.buf[in_offset:in_offset + len(data)] = data
+            capacity = 2 * len(data) + OUTPUT_SLOT_PADDING
+            tasks.append((job, in_block.name, in_offset, len(data),
+                out_block.name, out_offset, capacity, text_index))
+            in_offset += len(data)
+            out_offset += capacity
+
+        replies, pids = _dispatch(pool, _shm_worker, tasks, order)
+
+        results = []
+        for task, (length, data, seconds, source_map, stats, error, _) in \
+                zip(tasks, replies):
+            if length >= 0:
+                offset = task[5]
+                data = bytes(out_block.buf[offset:offset + length])
+            results.append(JobResult(task[0],
+                data.decode('utf-8') if data is not None else None, seconds,
+                source_map, stats, error))
+        return results, tasks, replies, pids
+    finally:
+        in_block.close()
+        in_block.unlink()
+        out_block.close()
+        out_block.unlink()
+
+def convert_batch(jobs, processes=None, transfer="shm", quiet=True,
+        schedule="lpt", cache=None, index_cache=None):
+    """
+    Converts all the jobs with a pool of worker processes and returns a
+    list of JobResult (in the same order as the jobs) together with a
+    BatchStats. Nothing is written to disk; see "write_results".
+
+    The "transfer" argument selects how the file contents travel between
+    this process and the workers:
+        "pickle" : the texts are pickled and sent through the pool pipes.
+        "shm"    : the inputs and outputs are placed in shared memory
+                   blocks, and the workers only get the block names and
+                   offsets.
+
+    The "schedule" argument is passed on to "schedule_order". If a
+    ConversionCache is given, its timings are used to estimate the cost
+    of every job, and the new timings are recorded in it (the caller is
+    responsible for saving it).
+
+    If an IndexCache is given, the workers skip the analysis of the files
+    it already knows, and the analysis of the other files is recorded in
+    it (again, the caller saves it).
+
+    A job whose conversion raises an exception does not stop the others;
+    its JobResult has the error instead of a text.
+    """
+    jobs = list(jobs)
+    texts = [read_input(job) for job in jobs]
+    indexes = [index_cache.index(text) if index_cache else None for text in texts]
+    processes = processes or os.cpu_count()
+    order = schedule_order(estimate_costs(jobs, texts, cache), schedule)
+    start = time.perf_counter()
+    # The workers must share the resource tracker of this process, or they
+    # would each try to clean up the shared memory blocks they attach to.
+    resource_tracker.ensure_running()
+    with Pool(processes, initializer=init_worker, initargs=(quiet,)) as pool:
+        if transfer == "shm":
+            results, tasks, replies, pids = _convert_shm(pool, jobs, texts,
+                indexes, order)
+        elif transfer == "pickle":
+            results, tasks, replies, pids = _convert_pickle(pool, jobs, texts,
+                indexes, order)
+        else:
+            raise ValueError("Unknown transfer method: " + str(transfer))
+    seconds = time.perf_counter() - start
+    # Measured after the clock has stopped, so the accounting itself does
+    # not count against either transfer method.
+    ipc_bytes = sum(len(pickle.dumps(t)) for t in tasks) + \
+        sum(len(pickle.dumps(r)) for r in replies)
+    makespan, ideal_makespan = makespans(
+        [r.seconds for r in results], pids, processes)
+    if cache is not None:
+        for result, text in zip(results, texts):
+            if result.error:
+                continue
+            cache.record_timing(result.job.input_file, len(text), result.seconds)
+    if index_cache is not None:
+        for text, index, reply in zip(texts, indexes, replies):
+            if index is None and reply[-1] is not None:
+                index_cache.record_index(text, reply[-1])
+    return results, BatchStats(transfer, len(jobs), seconds, ipc_bytes,
+        makespan, ideal_makespan, sum(1 for i in indexes if i is not None))
+
+def output_files(results):
+    """
+    Returns the files to write for the results, as a list of (path, text)
+    and a list of makefile updates, as (output_file, new_files,
+    replaced_files) arguments for "ktf_modules.update_makefile". A result
+    goes to its output file, to its shard files if the rules ask for
+    shards, or to a shared module if its rules name a bundle. A result with
+    a source map gets the map next to its output file (shards and bundles
+    get none). Results with an error are left out.
+    """
+    files, makefile_updates = [], []
+    bundles = {}
+    for r in results:
+        if r.error:
+            continue
+        if r.job.rules.get("bundle"):
+            bundles.setdefault(r.job.rules["bundle"], []).append(r)
+            continue
+        shards = r.job.rules.get("shards")
+        if not shards or shards < 2:
+            files.append((r.job.output_file, r.text))
+            if r.source_map:
+                files.append((map_path(r.job.output_file), r.source_map))
+            continue
+        sources = shard_suite(r.text, shards)
+        paths = shard_paths(r.job.output_file, len(sources))
+        files.extend(zip(paths, sources))
+        makefile_updates.append((r.job.output_file, paths, None))
+    for bundle, members in bundles.items():
+        sources = [(os.path.splitext(os.path.basename(r.job.output_file))[0], r.text)
+            for r in members]
+        name = os.path.splitext(os.path.basename(bundle))[0]
+        files.append((bundle, bundle_suites(sources, name)))
+        makefile_updates.append((bundle, [bundle], [r.job.output_file for r in members]))
+    return files, makefile_updates
+
+def write_results(results):
+    """
+    Writes the files of the results (see "output_files") and updates the
+    makefiles. Returns the number of files actually written (unchanged
+    files are skipped).
+    """
+    files, makefile_updates = output_files(results)
+    written = sum(write_output(path, text) for path, text in files)
+    for update in makefile_updates:
+        update_makefile(*update)
+    return written
+
+# Manifest handling.
+# -------------------------------------------------------------------
+
+def load_manifest(path):
+    """
+    Reads a JSON manifest: a list of objects with the keys "input",
+    "output", "rules" and "steps". Relative paths are relative to the
+    manifest itself. For example:
+
+        [{"input": "test_sort_rewrite/kernel/test_sort_backup.c",
+          "output": "test_sort_rewrite/kernel/test_sort_rewrite.c",
+          "rules": {"test_functions": ["test_sort_init"], ...},
+          "steps": ["add_include_code", "add_init_code_to_main", ...]}]
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    return [Job(os.path.join(base, e["input"]), os.path.join(base, e["output"]),
+        e["rules"], e["steps"]) for e in entries]
+
+
+def load_wrapper(path):
+    """
+    Reads the rules dictionary and the chain of steps from a
+    convert_wrapper_*.py file, without running it (the wrappers convert a
+    file as soon as they are imported). Returns (rules, steps).
+    """
+    with open(path, 'r') as f:
+        tree = ast.parse(f.read(), path)
+    rules = steps = None
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict):
+            rules = ast.literal_eval(node.value)
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+            # state.add_include_code().(...).result()
+            chain = []
+            call = node.value
+            while isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute):
+                chain.append(call.func.attr)
+                call = call.func.value
+            if chain and chain[0] == "result":
+                steps = list(reversed(chain[1:]))
+    return rules, steps
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Converts all the files listed in a JSON manifest.')
+    parser.add_argument('manifest')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--transfer', choices=['shm', 'pickle'], default='shm')
+    parser.add_argument('--schedule', choices=['lpt', 'fifo'], default='lpt')
+    parser.add_argument('--cache', action='store',
+        help='conversion cache file used for timings and compile checks')
+    parser.add_argument('--index-cache', action='store',
+        help='file used to remember the analysis of the input files, which '
+             'does not depend on the rules')
+    parser.add_argument('--timeout', type=float, default=None,
+        help='wall-clock limit per file in seconds (runs every file in a '
+             'process of its own; files over a limit are not retried, but '
+             'reported as failed)')
+    parser.add_argument('--max-memory', type=int, default=None,
+        help='memory limit per file in MB, on top of what the process uses '
+             'when it starts (runs every file in a process of its own)')
+    parser.add_argument('--check', action='store_true',
+        help='check that the converted files compile against the stub '
+             'headers (see compile_check.py)')
+    parser.add_argument('--run', action='store_true',
+        help='build the converted files with the userspace runtime and run '
+             'their tests (see run_native.py)')
+    parser.add_argument('--metrics', action='store',
+        help='file to write metrics about the run to, in the Prometheus text '
+             'format (see metrics.py)')
+    parser.add_argument('--openmetrics', action='store_true',
+        help='write the metrics as OpenMetrics instead')
+    parser.add_argument('--changed', action='store_true',
+        help='only convert the files whose input (according to git), rules '
+             'or converter changed since their last recorded conversion '
+             '(needs --cache; see incremental.py)')
+    parser.add_argument('--since', action='store', metavar='REVISION',
+        help='compare the inputs and the manifest with this git revision '
+             'instead (implies --changed)')
+    args = parser.parse_args()
+    if (args.changed or args.since) and not args.cache:
+        parser.error("--changed needs --cache, to record the conversions in")
+
+    cache = ConversionCache(args.cache) if args.cache else None
+    index_cache = IndexCache(args.index_cache) if args.index_cache else None
+    jobs = load_manifest(args.manifest)
+    if args.changed or args.since:
+        from incremental import plan_changes, record_conversions, format_plan
+        try:
+            plan = plan_changes(jobs, cache, args.since, [args.manifest])
+        except ValueError as e:
+            parser.error(str(e))
+        print(format_plan(plan))
+        jobs = plan.convert
+    failures = []
+    timing_hits = sum(1 for job in jobs if cache and cache.timing(job.input_file))
+    start = time.perf_counter()
+    stats = None
+    if not jobs:
+        results = []
+    elif args.timeout or args.max_memory:
+        from governor import convert_governed, format_failures
+        results, failures = convert_governed(jobs,
+            args.jobs, args.timeout,
+            args.max_memory * 1024 * 1024 if args.max_memory else None)
+        written = write_results(results)
+        print("Converted {} files ({} files written, {} failed)".format(
+            len(results), written, len(failures)))
+        if failures:
+            print(format_failures(failures))
+    else:
+        results, stats = convert_batch(jobs,
+            args.jobs, args.transfer, schedule=args.schedule, cache=cache,
+            index_cache=index_cache)
+        written = write_results(results)
+        if any(r.error for r in results):
+            from governor import JobFailure, format_failures
+            failures = [JobFailure(r.job, "convert_text", "error", r.error[0],
+                r.error[1]) for r in results if r.error]
+            results = [r for r in results if not r.error]
+        print("Converted {} files in {:.3f}s ({} files written, {} failed, "
+            "{} IPC bytes)".format(stats.jobs, stats.seconds, written,
+            len(failures), stats.ipc_bytes))
+        if failures:
+            print(format_failures(failures))
+        print("Makespan {:.3f}s, ideal {:.3f}s ({:.1%} of ideal)".format(
+            stats.makespan, stats.ideal_makespan,
+            stats.makespan / stats.ideal_makespan if stats.ideal_makespan else 1.0))
+
+    checks_ok = True
+    if args.check:
+        from compile_check import check_files, format_results
+        checks = check_files([path for path, text in output_files(results)[0]
+            if path.endswith(".c")],
+            cache, args.jobs)
+        print(format_results(checks))
+        checks_ok = all(c.ok for c in checks)
+
+    runs_ok = True
+    if args.run:
+        from run_native import run_files, format_runs
+        runs = run_files([path for path, text in output_files(results)[0]
+            if path.endswith(".c")], args.jobs)
+        print(format_runs(runs))
+        runs_ok = all(run.ok for run in runs)
+
+    if args.metrics:
+        from metrics import ConversionMetrics
+        metrics = ConversionMetrics()
+        for result in results:
+            metrics.add_result(result)
+        for failure in failures:
+            metrics.add_failure(failure.job.rules.get("test_suite_name"),
+                failure.reason)
+        if cache is not None:
+            metrics.add_cache_requests("timings", timing_hits,
+                len(jobs) - timing_hits)
+        # The governed runs do not use the index cache.
+        if index_cache is not None and stats is not None:
+            metrics.add_cache_requests("index", stats.index_hits,
+                len(jobs) - stats.index_hits)
+        if args.check:
+            suites = dict((r.job.output_file, (r.stats or {}).get("suite"))
+                for r in results)
+            cached = sum(1 for c in checks if c.cached)
+            metrics.add_cache_requests("compile_checks", cached,
+                len(checks) - cached)
+            for check in checks:
+                if not check.ok:
+                    metrics.add_failure(suites.get(check.path), "compile")
+        if args.run:
+            suites = dict((r.job.output_file, (r.stats or {}).get("suite"))
+                for r in results)
+            for run in runs:
+                if not run.ok:
+                    metrics.add_failure(suites.get(run.path), "run")
+        metrics.set_run(time.perf_counter() - start)
+        metrics.write_textfile(args.metrics, args.openmetrics)
+
+    if args.changed or args.since:
+        record_conversions(cache, results)
+    if cache is not None:
+        cache.save()
+    if index_cache is not None:
+        index_cache.save()
+    sys.exit(0 if checks_ok and runs_ok and not failures else 1)
@@ -0,0 +1,139 @@
+import os, sys, argparse, tempfile
+
+from batch import Job, convert_batch
+from memory_profile import profile_memory, MemoryBudgetExceeded
+
+
+
+# Rules and steps for the synthetic inputs, based on convert_wrapper_sort.py.
+benchmark_rules = {
+    "test_functions": ["test_sort_init"],
+    "test_suite_name": "test_sort_rewrite",
+    "blacklist": ["cmpint"],
+    "replacements": [
+        ("return err;", "ASSERT_INT_EQ(err, 0);")
+    ],
+    "should_add_new_main": True
+}
+
+benchmark_steps = ["add_include_code", "add_init_code_to_main", "add_exit_code",
+    "convert_to_test_common_args", "use_replacements"]
+
+sort_source = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "test_sort_rewrite", "kernel", "test_sort_backup.c")
+
+# Filler placed between the includes and the test code to grow the input.
+filler_block = """
+/*
+ * Padding block {n}. Large kernel test files are mostly long comment
+ * blocks, tables and macro invocations that the conversion passes have
+ * to scan but never touch.
+ */
+#define PADDING_{n} {{ {values} }}
+"""
+
+
+def make_input(path, size):
+    """
+    Writes a copy of test_sort_backup.c that has been padded to roughly
+    "size" bytes.
+    """
+    with open(sort_source, 'r') as f:
+        text = f.read()
+    head, sep, tail = text.partition("/* a simple boot-time regression test */")
+    blocks = []
+    n = 0
+    total = len(text)
+    while total < size:
+        block = filler_block.format(n=n, values=", ".join(
+            str(i * 7919 % 65521) for i in range(32)))
+        blocks.append(block)
+        total += len(block)
+        n += 1
+    with open(path, 'w') as f:
+        f.write(head + "".join(blocks) + sep + tail)
+
+def check_memory(jobs, budget):
+    """
+    Profiles the memory of the biggest job (see memory_profile.py), and
+    returns None, or the MemoryBudgetExceeded if it allocates more than
+    budget times the size of its input.
+    """
+    job = max(jobs, key=lambda job: os.path.getsize(job.input_file))
+    try:
+        profile = profile_memory(job, top=0, budget=budget)
+    except MemoryBudgetExceeded as e:
+        return e
+    print("Peak memory {:,} bytes for {:,} bytes of input ({:.1f}x, budget {}x)".format(
+        profile.peak, profile.input_bytes, profile.peak / float(profile.input_bytes),
+        budget))
+    return None
+
+def make_jobs(directory, count, size, mixed=False):
+    """
+    Creates "count" inputs of about "size" bytes each. With "mixed", the
+    sizes instead grow from size / count to size, so the biggest file comes
+    last in the manifest (the worst case for naive scheduling).
+    """
+    jobs = []
+    for i in range(count):
+        input_file = os.path.join(directory, "input_{}.c".format(i))
+        make_input(input_file, size * (i + 1) // count if mixed else size)
+        jobs.append(Job(input_file, os.path.join(directory, "output_{}.c".format(i)),
+            benchmark_rules, benchmark_steps))
+    return jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compares the transfer methods or schedules of the batch converter.')
+    parser.add_argument('-n', '--files', type=int, default=16)
+    parser.add_argument('-s', '--size', type=int, default=4 * 1024 * 1024,
+        help='approximate size of every input file in bytes')
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--schedules', action='store_true',
+        help='compare the fifo and lpt schedules on inputs of mixed sizes '
+             'instead of comparing the transfer methods')
+    parser.add_argument('--memory-budget', type=float, default=None,
+        help='fail if converting the biggest input allocates more than this '
+             'many times its size (checked before the timings)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = make_jobs(directory, args.files, args.size, mixed=args.schedules)
+        if args.memory_budget:
+            error = check_memory(jobs, args.memory_budget)
+            if error is not None:
+                print(error)
+                sys.exit(1)
+        best = {}
+        if args.schedules:
+            for schedule in ["fifo", "lpt"] * args.repeat:
+                results, stats = convert_batch(jobs, args.jobs, schedule=schedule)
+                if schedule not in best or stats.seconds < best[schedule].seconds:
+                    best[schedule] = stats
+        else:
+            for transfer in ["pickle", "shm"] * args.repeat:
+                results, stats = convert_batch(jobs, args.jobs, transfer)
+                if transfer not in best or stats.seconds < best[transfer].seconds:
+                    best[transfer] = stats
+
+    if args.schedules:
+        print("{} files of ~{} to ~{} bytes, best of {}".format(
+            args.files, args.size // args.files, args.size, args.repeat))
+        for schedule in ["fifo", "lpt"]:
+            stats = best[schedule]
+            print("  {:<5} {:8.3f}s makespan {:.3f}s, ideal {:.3f}s".format(
+                schedule, stats.seconds, stats.makespan, stats.ideal_makespan))
+        sys.exit(0)
+
+    print("{} files of ~{} bytes, best of {}".format(
+        args.files, args.size, args.repeat))
+    for transfer in ["pickle", "shm"]:
+        stats = best[transfer]
+        print("  {:<7} {:8.3f}s {:>14,} IPC bytes".format(
+            transfer, stats.seconds, stats.ipc_bytes))
+    print("  shm/pickle: {:.2f}x time, {:.4f}x IPC bytes".format(
+        best["shm"].seconds / best["pickle"].seconds,
+        best["shm"].ipc_bytes / best["pickle"].ipc_bytes))
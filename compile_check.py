@@ -0,0 +1,134 @@
+import os, sys, glob, hashlib, argparse, subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from conversion_cache import ConversionCache
+
+
+
+# The stand-in KTF and kernel headers the files are checked against.
+STUB_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ktf_stub")
+
+DEFAULT_COMPILER = "cc"
+DEFAULT_FLAGS = ["-fsyntax-only", "-std=gnu11", "-Wall",
+    "-Werror=implicit-function-declaration"]
+
+# The outcome of checking one file.
+CheckResult = namedtuple('CheckResult', 'path ok output cached')
+
+
+def find_generated_sources(paths):
+    """
+    Returns the converted files ("*_rewrite.c") found in the given paths.
+    Paths that are files are used as they are; directories are searched
+    recursively.
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(glob.glob(
+                os.path.join(path, "**", "*_rewrite.c"), recursive=True)))
+        else:
+            sources.append(path)
+    return sources
+
+def _stub_digest():
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(STUB_DIRECTORY, "**", "*.h"),
+            recursive=True)):
+        with open(path, 'rb') as f:
+            digest.update(path.encode('utf-8') + b"\0" + f.read())
+    return digest.hexdigest()
+
+def check_key(data, command, stub_digest):
+    """
+    The cache key for one check: the contents of the file, the compiler
+    command and the stub headers all affect the result.
+    """
+    digest = hashlib.sha1(data)
+    digest.update("\0".join(command).encode('utf-8'))
+    digest.update(stub_digest.encode('utf-8'))
+    return digest.hexdigest()
+
+def check_file(path, command):
+    """
+    Runs the compiler on one file and returns (ok, output).
+    """
+    proc = subprocess.run(command + [path], stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.returncode == 0, proc.stdout
+
+def check_files(paths, cache=None, processes=None, compiler=DEFAULT_COMPILER,
+        include_dirs=()):
+    """
+    Checks all the files in parallel with "<compiler> -fsyntax-only",
+    against the stub headers in ktf_stub/ (and any extra include_dirs,
+    which are searched before them). Files whose check is already in the
+    cache are not compiled again. Returns a list of CheckResult, in the
+    order of the paths.
+    """
+    command = [compiler] + DEFAULT_FLAGS + \
+        ["-I" + d for d in include_dirs] + ["-I" + STUB_DIRECTORY]
+    stub_digest = _stub_digest()
+    results = [None] * len(paths)
+    todo = []
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            key = check_key(f.read(), command, stub_digest)
+        cached = cache.compile_check(key) if cache else None
+        if cached is not None:
+            results[i] = CheckResult(path, cached[0], cached[1], True)
+        else:
+            todo.append((i, path, key))
+
+    # The work is done by the compiler processes, so threads are enough.
+    with ThreadPoolExecutor(processes or os.cpu_count()) as executor:
+        outcomes = executor.map(lambda t: check_file(t[1], command), todo)
+        for (i, path, key), (ok, output) in zip(todo, outcomes):
+            results[i] = CheckResult(path, ok, output, False)
+            if cache is not None:
+                cache.record_compile_check(key, ok, output)
+    return results
+
+def format_results(results, verbose=False):
+    """
+    Returns a report with one line per failed file (followed by the
+    compiler output), and a summary line. With verbose, files that passed
+    are listed too.
+    """
+    lines = []
+    for result in results:
+        if not result.ok:
+            lines.append("FAILED " + result.path)
+            lines.append(result.output.rstrip())
+        elif verbose:
+            lines.append("ok     " + result.path + (" (cached)" if result.cached else ""))
+    failed = sum(1 for r in results if not r.ok)
+    cached = sum(1 for r in results if r.cached)
+    lines.append("{} files checked, {} failed, {} from cache".format(
+        len(results), failed, cached))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Checks that converted files compile against stub KTF '
+                    'and kernel headers.')
+    parser.add_argument('paths', nargs='+',
+        help='files to check, or directories to search for *_rewrite.c files')
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--cc', default=DEFAULT_COMPILER)
+    parser.add_argument('-I', dest='include_dirs', action='append', default=[],
+        help='extra include directory, searched before the stub headers')
+    parser.add_argument('--cache', action='store',
+        help='conversion cache file used to remember earlier checks')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    cache = ConversionCache(args.cache) if args.cache else None
+    results = check_files(find_generated_sources(args.paths), cache, args.jobs,
+        args.cc, args.include_dirs)
+    if cache is not None:
+        cache.save()
+    print(format_results(results, args.verbose))
+    sys.exit(0 if all(r.ok for r in results) else 1)
@@ -0,0 +1,117 @@
+import os, json, hashlib
+
+
+
+class ConversionCache(object):
+    """
+    A small JSON file that remembers facts about earlier conversions, so
+    that the next batch run can make use of them. Currently it stores, for
+    every input file, the size of the file and how long the conversion
+    took the last time, the outcome of the compile checks of converted
+    files (keyed on a hash of the checked file and of everything else that
+    can change the outcome), and for every output file, what it was
+    converted from (see "incremental.record_conversions").
+
+    The cache is only written back to disk when "save" is called.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._data = {"timings": {}, "compile_checks": {}, "conversions": {}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._data.update(json.load(f))
+
+    def timing(self, input_file):
+        """
+        Returns (size, seconds) from the last conversion of input_file, or
+        None if it has not been converted before.
+        """
+        entry = self._data["timings"].get(os.path.abspath(input_file))
+        if entry is None:
+            return None
+        return entry["size"], entry["seconds"]
+
+    def timings(self):
+        """
+        Returns a list of (size, seconds) for all the recorded conversions.
+        """
+        return [(e["size"], e["seconds"]) for e in self._data["timings"].values()]
+
+    def record_timing(self, input_file, size, seconds):
+        self._data["timings"][os.path.abspath(input_file)] = {
+            "size": size, "seconds": seconds }
+
+    def compile_check(self, key):
+        """
+        Returns (ok, output) of an earlier compile check, or None.
+        """
+        entry = self._data["compile_checks"].get(key)
+        if entry is None:
+            return None
+        return entry["ok"], entry["output"]
+
+    def record_compile_check(self, key, ok, output):
+        self._data["compile_checks"][key] = { "ok": ok, "output": output }
+
+    def conversion(self, output_file):
+        """
+        Returns the dict recorded for the last conversion to output_file, or
+        None.
+        """
+        return self._data["conversions"].get(os.path.abspath(output_file))
+
+    def record_conversion(self, output_file, entry):
+        self._data["conversions"][os.path.abspath(output_file)] = entry
+
+    def save(self):
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._path)
+
+
+class IndexCache(object):
+    """
+    A JSON file with the analysis of input files that does not depend on 
+    the rules (see "Converter.get_index"), keyed on a hash of the contents 
+    of the file. While the rules of a file are being worked on, the file 
+    itself stays the same, so it only has to be scanned once.
+
+    The file is separate from the ConversionCache, as the entries are only 
+    valid for as long as the analysis done by the Converter stays the same; 
+    bump VERSION when it changes, and the old entries are dropped.
+
+    The cache is only written back to disk when "save" is called.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._data = {"version": self.VERSION, "indexes": {}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self._data = data
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def index(self, text):
+        """
+        Returns the index recorded for a file with the given contents, or 
+        None.
+        """
+        return self._data["indexes"].get(self.key(text))
+
+    def record_index(self, text, index):
+        self._data["indexes"][self.key(text)] = index
+
+    def save(self):
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._path)
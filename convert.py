@@ -1,8 +1,87 @@
-import re, os, argparse, sys
+import re, os, argparse, sys, functools
 from pprint import pprint
 from collections import namedtuple
+from types import MappingProxyType
 from string import whitespace
 
+from ktf_modules import matching_brace, shard_suite, shard_paths, update_makefile, \
+    bundle_suites, module_functions, call_arguments
+from source_map import OffsetMap, SourceMap, map_path
+from plugins import load_plugin, traverse
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+
+# A regex substitution done by a Converter. "missing" is the literal text 
+# the pattern requires that was not found in the file, if the substitution 
+# was skipped because of it (see "required_literals"), and "matches" the 
+# number of matches that were replaced.
+Pass = namedtuple('Pass', 'pattern skipped missing matches')
+
+# The number of patterns whose literals are kept. The patterns built from 
+# the rules of every job go through here too, so the cache must not grow 
+# without bound in workers that convert many files.
+REQUIRED_LITERALS_CACHE_SIZE = 1024
+
+@functools.lru_cache(maxsize=REQUIRED_LITERALS_CACHE_SIZE)
+def required_literals(pattern):
+    """
+    Returns the strings that every match of the regex pattern must contain, 
+    taken from the runs of plain characters in the parts of the pattern 
+    that are not optional. If none of the strings is in a text, the pattern 
+    cannot match anywhere in it, so there is no need to run it. Returns an 
+    empty tuple if nothing can be derived (or if the pattern ignores case).
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return ()
+    if parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return ()
+    literals = []
+    run = []
+    _collect_literals(parsed, literals, run)
+    _end_run(literals, run)
+    return tuple(literals)
+
+def _collect_literals(items, literals, run):
+    """
+    Adds the runs of required characters in the parsed items to literals. 
+    "run" holds the characters of the run still in progress, which may go on 
+    past the end of a group.
+    """
+    for op, value in items:
+        if op == sre_constants.LITERAL:
+            run.append(chr(value))
+        elif op == sre_constants.AT:
+            # Zero width, like ^ or \b.
+            continue
+        elif op == sre_constants.SUBPATTERN and not value[1] & sre_constants.SRE_FLAG_IGNORECASE:
+            _collect_literals(value[3], literals, run)
+        else:
+            _end_run(literals, run)
+            if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and value[0] >= 1:
+                _collect_literals(value[2], literals, run)
+                _end_run(literals, run)
+
+def _end_run(literals, run):
+    if run:
+        literals.append("".join(run))
+        del run[:]
+
+
+def _prepared(method):
+    """
+    Makes a Converter method call "prepare" first, so that the file is 
+    only read and analysed once something is asked of the converter.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.prepare()
+        return method(self, *args, **kwargs)
+    return wrapper
 
 
 class Converter(object):
@@ -137,23 +216,235 @@ class Converter(object):
             function call. 
             See the "convert_wrapper_xarray.py" file for an example.
         ->  Skip this field unless dummy functions are going to be used.
+
+        ["repeat_identical_calls"] : boolean
+        ->  Identical calls to a test function with extra arguments normally 
+            share one dummy function, which is registered once, since 
+            registering the same TEST again would not run it again. Set this 
+            field to True if the repeated calls must really run again (for 
+            example because the calls in between change the state they 
+            check); every call then gets a dummy function of its own.
+        ->  Skip this field unless the suite depends on repeated calls.
+        ["test_timing"] : string
+        ->  Makes "add_test_timing" measure the run time of every TEST 
+            function with ktime_get_ns(). With "log", each test reports its 
+            own time through tlog() when it finishes. With "stats", every run 
+            of a test (in each context and loop iteration) is added to the 
+            run count, total, minimum and maximum kept for the test in a 
+            generated per-suite array, and the exit function of the module 
+            prints the count and the min/avg/max time of each test that ran.
+        ->  Skip this field unless the converted suite should double as a 
+            microbenchmark.
+
+        ["context_count"] : int or string
+        ->  Makes "add_context_array" register this many contexts: a number, 
+            or a C expression evaluated when the module is loaded, such as 
+            "num_online_cpus()". They are added to any context set up in 
+            ["init_code"], so leave a single context out of ["init_code"] 
+            and ["exit_code"] when the array replaces it. KTF runs every test once per context, so 
+            the test instances can be run concurrently, each with its own 
+            data, as a scalability test. The other fields used are:
+            ["context_type"] : the type of the contexts, defined in 
+                ["new_types"], whose struct ktf_context member must be "k" 
+                (for example "struct array_context").
+            ["context_name"] : the contexts are called "<name>_0", 
+                "<name>_1", ... (default "ctx").
+            ["context_init_code"], ["context_exit_code"] : code that sets up 
+                and tears down one context, in which "ctx" points to the 
+                context and "i" is its index. For example:
+                    "context_init_code": 
+                        "xa_init(&ctx->storage); ctx->xa = &ctx->storage;",
+                    "context_exit_code": "xa_destroy(ctx->xa);",
+            A TEST function gets its own context through the "ctx" 
+            parameter of the TEST macro, for example in the 
+            ["boilerplate_code"]:
+                struct array_context *actx = 
+                    container_of(ctx, struct array_context, k);
+        ->  Skip this field unless the tests should run once per CPU (or 
+            once per some other number of contexts).
+
+        ["shards"] : int
+        ->  Splits the converted suite into this many kernel modules when the 
+            result is written, so the shards can be loaded and run in 
+            parallel. The TEST functions are spread over the shards, and each 
+            shard gets its own init/exit code and the helper functions its 
+            tests use. The shards are written next to the output file as 
+            "<name>_shard1.c", "<name>_shard2.c", ..., and the obj-m line of 
+            the Makefile.in in the same directory is updated to match.
+        ->  Skip this field unless the suite is large enough to be worth 
+            splitting.
+
+        ["bundle"] : string
+        ->  Only used by batch.py. All the files of a batch with the same 
+            value for this field are merged into a single module, written to 
+            the file named by the value (see "bundle_results").
+        ->  Skip this field unless many small suites should share one module.
+
+        ["source_map"] : boolean
+        ->  Makes "result" write a source map next to the output file, as 
+            "<output>.map", which maps every line of the output back to the 
+            line of the input file it came from (see "source_map.py", which 
+            can rewrite the locations in compiler and KTF messages with it). 
+            Not written for sharded output.
+        ->  Skip this field unless the locations are needed.
+
+        ["plugins"] : list
+        ->  Plugins that make site-specific changes, run by the 
+            "run_plugins" step: ConverterPlugin instances, or "module:Class" 
+            strings (see "plugins.py"). They are all run in one traversal 
+            of the file, instead of one regex pass per change.
+        ->  Skip this field unless the changes can't be made by the rules.
     """
 
-    def __init__(self, input_file_name, outfile_name, rules, debug=False):
+    # The state of a conversion, set up by "reset". The templates and the 
+    # regexes below are shared by all the instances, so a converter that 
+    # is reset for every file (see "batch.convert_job") allocates little 
+    # more than the text itself.
+    __slots__ = ("_blacklist", "_boilerplate_code", "_common_call_args",
+        "_common_call_multi_arg_replace", "_context_args", "_context_count",
+        "_context_exit_code", "_context_init_code", "_context_name",
+        "_context_type", "_debug", "_dummy_function_counter",
+        "_dummy_function_names_by_call", "_dummy_functions_to_add",
+        "_duplicate_dummy_functions", "_exit_code", "_given_index",
+        "_include_code", "_index", "_init_code", "_input_file_name",
+        "_local_function_names", "_local_helper_function_names",
+        "_loop_variables",
+        "_module_exit_name", "_module_init_name", "_new_types", "_offset_map",
+        "_original_text", "_outfile_name", "_passes", "_plugin_timings",
+        "_plugins", "_prepared", "_repeat_identical_calls", "_replacements",
+        "_rules", "_shards",
+        "_should_add_new_main", "_source_map", "_test_function_names",
+        "_test_prefix_numbers", "_test_suite_name", "_test_timing", "_text")
+
+    # Default KTF snippets
+    # --------------------
+    _default_init_code = "KTF_INIT();\n\n\g<1>"
+    _default_exit_code = '\g<1>\n\tKTF_CLEANUP();'
+    _default_include_code = '\g<1>\n#include "ktf.h"\n'
+    _default_common_call_args = ""
+    _default_context_args = "void|''"
+
+    # Templates of the generated code
+    # -------------------------------
+    _extra_parameters = "struct ktf_test *self"
+    _extra_parameters_calls = "self"
+    _extra_parameters_calls_comma = "self, "
+    _test_macro_result = "TEST({suite_name}, {test_name}) {{\n"
+    _dummy_function_name = "{func_name}_{counter}_"
+    _dummy_function_body = "TEST({suite_name}, {dummy_name}) {{\n\t{call}\n}}"
+    _dummy_function_result = "{dummy_body}\n\n{orig_func}"
+    _add_test_call = "ADD_TEST({func_name});"
+    _add_loop_test_call = "ADD_LOOP_TEST({func_name}, {start}, {end});"
+    _loop_end_inclusive = "({end}) + 1"
+    _loop_index = "_i"
+    _dummy_function_internal_call = "{func_name}({alt_args}, {rest_args});" # common_call_multi_arg_replace
+    _extra_parameters_result = "{sig}{ext_params}{opt_comma}{args}{end}\n{{"
+    _extra_ktf_args_calls = "{func_name}({new_args}{old_arg_char}"
+    _extra_ktf_args_calls_no_args = "{func_name}({new_args})"
+    _wrapped_multi_arg_function_calls = "{func_name}({common_args}{extra_args});"
+    _new_main_name = "{old_name}_1"
+    _new_module_init = "module_init({new_main_name});\n"
+    _new_main_and_module_init = "KTF_INIT();\n\nint {new_main_name}(void)\n{{\n\tADD_TEST({old_main});\n\n\treturn 0;\n}}\n\nmodule_init({new_main_name});"
+    _single_space = " "
+    _timing_include = r"\g<1>#include <linux/timekeeping.h>\n"
+    _timing_stats_include = r"\g<1>#include <linux/timekeeping.h>\n#include <linux/atomic.h>\n#include <linux/math64.h>\n"
+    _timing_start = "\n\tu64 __ktf_start_ns = ktime_get_ns();"
+    _timing_log = 'tlog(T_INFO, "{suite_name}.{test_name}: %llu ns", (unsigned long long)(ktime_get_ns() - __ktf_start_ns));'
+    _timing_record = "{suite_name}_record_test_time({index}, ktime_get_ns() - __ktf_start_ns);"
+    _timing_end = "\t{report}\n"
+    _timing_return = "do {{ {report} return; }} while (0);"
+    _timing_stats = "struct {suite_name}_test_time {{\n\tatomic64_t runs;\n\tatomic64_t total_ns;\n\tatomic64_t min_ns;\n\tatomic64_t max_ns;\n}};\n\nstatic struct {suite_name}_test_time {suite_name}_test_times[{count}] = {{\n\t[0 ... {count} - 1] = {{ .min_ns = ATOMIC64_INIT(S64_MAX) }},\n}};\nstatic const char *{suite_name}_test_names[{count}] = {{\n{names}}};\n\nstatic void {suite_name}_record_test_time(int index, s64 ns)\n{{\n\tstruct {suite_name}_test_time *t = &{suite_name}_test_times[index];\n\ts64 old, prev;\n\n\tatomic64_inc(&t->runs);\n\tatomic64_add(ns, &t->total_ns);\n\tfor (old = atomic64_read(&t->min_ns); ns < old; old = prev)\n\t\tif ((prev = atomic64_cmpxchg(&t->min_ns, old, ns)) == old)\n\t\t\tbreak;\n\tfor (old = atomic64_read(&t->max_ns); ns > old; old = prev)\n\t\tif ((prev = atomic64_cmpxchg(&t->max_ns, old, ns)) == old)\n\t\t\tbreak;\n}}\n\nstatic void {suite_name}_dump_test_timing(void)\n{{\n\tint i;\n\n\tfor (i = 0; i < {count}; i++) {{\n\t\tstruct {suite_name}_test_time *t = &{suite_name}_test_times[i];\n\t\ts64 runs = atomic64_read(&t->runs);\n\n\t\tif (!runs)\n\t\t\tcontinue;\n\t\tprintk(KERN_INFO \"{suite_name}.%s: %lld runs, min/avg/max %lld/%lld/%lld ns\\n\",\n\t\t       {suite_name}_test_names[i], runs, atomic64_read(&t->min_ns),\n\t\t       div64_s64(atomic64_read(&t->total_ns), runs), atomic64_read(&t->max_ns));\n\t}}\n}}\n\n"
+    _timing_stats_name = '\t"{test_name}",\n'
+    _timing_dump_call = r"\g<1>\n\t{suite_name}_dump_test_timing();"
+    _context_include = r"\g<1>#include <linux/slab.h>\n#include <linux/cpumask.h>\n"
+    _context_array = "{exit_declaration}static {type} *{prefix}_contexts;\nstatic char (*{prefix}_context_names)[32];\nstatic int {prefix}_context_count;\n\nstatic int {prefix}_add_contexts(void)\n{{\n\tint i;\n\n\t{prefix}_context_count = {count};\n\t{prefix}_contexts = kcalloc({prefix}_context_count, sizeof(*{prefix}_contexts), GFP_KERNEL);\n\t{prefix}_context_names = kcalloc({prefix}_context_count, sizeof(*{prefix}_context_names), GFP_KERNEL);\n\tif (!{prefix}_contexts || !{prefix}_context_names) {{\n\t\tkfree({prefix}_contexts);\n\t\tkfree({prefix}_context_names);\n\t\t{prefix}_contexts = NULL;\n\t\t{prefix}_context_names = NULL;\n\t\t{prefix}_context_count = 0;\n\t\treturn -ENOMEM;\n\t}}\n\tfor (i = 0; i < {prefix}_context_count; i++) {{\n\t\t{type} *ctx = &{prefix}_contexts[i];\n\n{init_code}\t\tsnprintf({prefix}_context_names[i], sizeof({prefix}_context_names[i]), \"{name}_%d\", i);\n\t\tKTF_CONTEXT_ADD(&ctx->k, {prefix}_context_names[i]);\n\t}}\n\treturn 0;\n}}\n\nstatic void {prefix}_remove_contexts(void)\n{{\n\tint i;\n\n\tfor (i = 0; i < {prefix}_context_count; i++) {{\n\t\t{type} *ctx = &{prefix}_contexts[i];\n\n\t\tKTF_CONTEXT_REMOVE(&ctx->k);\n{exit_code}\t}}\n\tkfree({prefix}_contexts);\n\tkfree({prefix}_context_names);\n}}\n\n"
+    _context_add_call = "\tif ({prefix}_add_contexts())\n\t\treturn -ENOMEM;\n"
+    # Undoes what the init function did before the contexts were added (the 
+    # ["init_code"]) by calling the exit function, in which removing the 
+    # contexts does nothing after a failed "_add_contexts".
+    _context_add_call_with_exit = "\tif ({prefix}_add_contexts()) {{\n\t\t{exit}();\n\t\treturn -ENOMEM;\n\t}}\n"
+    _context_remove_call = "\t{prefix}_remove_contexts();\n"
+
+    # Regexes used in this class
+    _regexes = MappingProxyType({
+        # Captures all static function definitions. Return types must be in all lowercase, and { on next line!
+        'all_static_functions': r"((static *(noinline)*? *([a-z_*0-9 ]+?) *([a-zA-Z_0-9]*)\()([a-z_*0-9,\n\t ]*)(\))\s*{)",
+        'specific_static_function': "((static *(noinline)*? *([a-z_*0-9 ]+?) *({func_name})\()([a-z_*0-9,\n\t ]*)(\))\s*{{)",
+        'find_module_init': r"module_init\((.*)\);",
+        'find_module_exit': r"module_exit\((.*)\);",
+        'main_function': "((static *(noinline)*? *([a-z_*0-9 ]+?) *({main})\()([a-z_*0-9,\n\t ]*)(\))\s*{{)",
+        'exit_function': "((static *(noinline)*? *([a-z_*0-9 ]+?) *({exit})\()([a-z_*0-9,\n\t ]*)(\))\s*{{)",
+        'includes_end': "(#include [<\"].*?[>\"].*)(\s*\n\s*\n)",
+        'statics_with_context_args': "((static *(noinline)*? *([a-z_*0-9 ]+?) *([a-zA-Z_0-9]*)\()({ctx_args})(\))\s*{{)",
+        'statics_with_context_and_extra_args': "((static *(noinline)*? *([a-z_*0-9 ]+?) *([a-zA-Z_0-9]*)\()({ctx_args})(.*)(\))\s*{{)",
+        'test_macro_function': "(TEST(.*?), *(.*?) *{)",
+        'function_calls_common_args': "(([a-zA-Z0-9_]*)\(({common_args})*\);)",
+        # We exploit the fact that this should be used AFTER the KTF specific
+        # arguments have been added.
+        'function_calls_with_args': "(((\w)+)(\()((?!struct)(?!\))))",
+        'find_exact_match': "({pattern})",
+        'function_calls_without_args': "(((\w)+)(\(\)))",
+        'multi_arg_test_function_calls': "(([a-zA-Z0-9_]*)\(({common_args}), *(.*?)\));",
+        # A for loop counting up by one, whose body is nothing but a call
+        # matched by 'multi_arg_test_function_calls' (with or without braces).
+        'loop_multi_arg_test_function_calls': r"for *\( *(\w+) *= *([^;]+?) *; *\1 *(<=?) *([^;]+?) *; *(?:\1\+\+|\+\+\1|\1 *\+= *1) *\)\s*({{\s*)?(([a-zA-Z0-9_]*)\(({common_args}), *(.*?)\));(?(5)\s*}})",
+        'find__init_and_exit': "\s(__init|__exit)\s",
+        'test_macro_definition': r"TEST\(\s*(\w+)\s*,\s*(\w+)\s*\)\s*{",
+        'return_statement': r"\breturn\s*;",
+        'function_definition': r"^\w[^;{{}}()\n]*\b{name}\s*\([^)]*\)\s*{{",
+        'add_test_line': r"^[ \t]*ADD_(?:LOOP_)?TEST\(",
+        'add_loop_test_call': r"\bADD_LOOP_TEST\(",
+        # A line with nothing but an ADD_TEST or ADD_LOOP_TEST call.
+        'registration_line': r"^[ \t]*(ADD_(?:LOOP_)?TEST\((\w+)\b[^;\n]*\);)[ \t]*\n",
+        # The { that opens a function body, at the start of a line.
+        'function_body': r"^{",
+        # A declaration of integer variables without initializers, like 
+        # "int i;" or "unsigned long i, j;", on a line of its own.
+        'integer_declaration': r"^[ \t]*(?:(?:unsigned|signed|long|short|int|char|size_t|[us](?:8|16|32|64))[ \t]+)+(\w+(?:[ \t]*,[ \t]*\w+)*)[ \t]*;[ \t]*\n",
+        'ktf_cleanup_line': r"^[ \t]*KTF_CLEANUP\(\);",
+        'first_include': r"(#include [<\"].*?[>\"].*\n)",
+        'function_call': r"\b(\w+)\s*\(",
+        # Assertion macros from the kernel and from KTF, like BUG_ON, 
+        # XA_BUG_ON, WARN_ON_ONCE, ASSERT_INT_EQ or EXPECT_FALSE.
+        'assertion_macro_calls': r"\b((?:[A-Z][A-Z0-9]*_)*(?:BUG|WARN|ASSERT|EXPECT)(?:_[A-Z0-9_]+)?|assert)\s*\(",
+    })
+
+    def __init__(self, input_file_name, outfile_name, rules, debug=False, text=None,
+            index=None):
+        self._debug = debug
+        self._input_file_name = input_file_name
+        self._rules = rules
+        self.reset(text, outfile_name, index=index)
 
-        # Default KTF snippets
-        # --------------------
-        self._default_init_code = "KTF_INIT();\n\n\g<1>"
-        self._default_exit_code = '\g<1>\n\tKTF_CLEANUP();'
-        self._default_include_code = '\g<1>\n#include "ktf.h"\n'
-        self._default_common_call_args = ""
-        self._default_context_args = "void|''"
+    def reset(self, text, outfile_name, input_file_name=None, rules=None, 
+            index=None):
+        """
+        Makes the converter start over with another text (or, if text is 
+        None, with the contents of the input file, read when needed), 
+        written to outfile_name by "result". The input file and the rules 
+        stay the same unless new ones are given, and index works as in 
+        the constructor. Returns the converter, so one instance can 
+        convert any number of files: 
+
+            converter.reset(text, outfile_name).prepare()
+        """
+        if input_file_name is not None:
+            self._input_file_name = input_file_name
+        if rules is not None:
+            self._rules = rules
+        rules = self._rules
 
         # Argument handling:
         # ------------------
-        # All the contents of the source file.
-        with open(input_file_name, 'r') as f:
-            self._text = f.read()
+        # All the contents of the source file, read when first needed (see 
+        # "_load"). Callers that already hold the contents (like the batch 
+        # workers) can pass them as "text" instead.
+        self._text = text
+        self._original_text = None
+
+        # Keeps track of where every part of the text came from, as the 
+        # text is edited (see "get_source_map").
+        self._offset_map = None
 
         # The name of the file to write output to.
         self._outfile_name = outfile_name
@@ -197,17 +488,40 @@ class Converter(object):
         # The names of functions to be ignored.
         self._blacklist = rules.get("blacklist")
 
+        # Whether identical calls get a dummy function each instead of 
+        # sharing one. See "_dummy_function_for_call".
+        self._repeat_identical_calls = rules.get("repeat_identical_calls", False)
+
         # Specifies which assertions to convert to which KTF assertions.
         self._replacements = rules.get("replacements")
 
+        # How TEST functions should report their run time, if at all. See
+        # "add_test_timing".
+        self._test_timing = rules.get("test_timing")
+
+        # The number of contexts "add_context_array" registers, if any, and 
+        # what they look like.
+        self._context_count = rules.get("context_count")
+        self._context_type = rules.get("context_type")
+        self._context_name = rules.get("context_name") or "ctx"
+        self._context_init_code = rules.get("context_init_code") or ""
+        self._context_exit_code = rules.get("context_exit_code") or ""
+
+        # Number of modules to split the converted suite into, if any.
+        self._shards = rules.get("shards")
+
+        # Whether "result" should write a source map next to the output.
+        self._source_map = rules.get("source_map")
+
+        # Plugins run by "run_plugins", loaded when the step runs.
+        self._plugins = rules.get("plugins") or []
+
         # Adds a new main function if set to True. The name of this new main 
         # function will be the function name argument in the call 'module_init' 
         # with "_1" appended to the end (specified by self._new_main_name). 
         # For example "test_xarray_init" -> "test_xarray_init_1"
         self._should_add_new_main = rules.get("should_add_new_main")
 
-        self._debug = debug
-
 
         # Other object variables used:
         # ----------------------------
@@ -224,6 +538,19 @@ class Converter(object):
         # function to (hopefully) ensure unique names.
         self._dummy_function_counter = 1
 
+        # The name of the dummy function created for each generated call, 
+        # used to reuse the dummy function when the same call is converted 
+        # again, and the number of times that has happened.
+        self._dummy_function_names_by_call = {}
+        self._duplicate_dummy_functions = 0
+
+        # Every regex substitution done so far, as Pass records, including 
+        # the ones skipped because they could not match.
+        self._passes = []
+
+        # The PluginTiming of every plugin run so far, in order.
+        self._plugin_timings = []
+
         # A dict of prefix numbers to make sure that the tests are
         # run in the same order as they are added with ADD_TEST.
         self._test_prefix_numbers = { "counter" : 1 }
@@ -231,53 +558,34 @@ class Converter(object):
         self._module_init_name = ""
         self._module_exit_name = ""
 
-        self._extra_parameters = "struct ktf_test *self"
-        self._extra_parameters_calls = "self"
-        self._extra_parameters_calls_comma = "self, "
-        self._test_macro_result = "TEST({suite_name}, {test_name}) {{\n"
-        self._dummy_function_name = "{func_name}_{counter}_"
-        self._dummy_function_body = "TEST({suite_name}, {dummy_name}) {{\n\t{call}\n}}"
-        self._dummy_function_result = "{dummy_body}\n\n{orig_func}"
-        self._add_test_call = "ADD_TEST({func_name});"
-        self._dummy_function_internal_call = "{func_name}({alt_args}, {rest_args});" # common_call_multi_arg_replace
-        self._extra_parameters_result = "{sig}{ext_params}{opt_comma}{args}{end}\n{{"
-        self._extra_ktf_args_calls = "{func_name}({new_args}{old_arg_char}"
-        self._extra_ktf_args_calls_no_args = "{func_name}({new_args})"
-        self._wrapped_multi_arg_function_calls = "{func_name}({common_args}{extra_args});"
-        self._new_main_name = "{old_name}_1"
-        self._new_module_init = "module_init({new_main_name});\n"
-        self._new_main_and_module_init = "KTF_INIT();\n\nint {new_main_name}(void)\n{{\n\tADD_TEST({old_main});\n\n\treturn 0;\n}}\n\nmodule_init({new_main_name});"
-        self._single_space = " "
-
-        # Regexes used in this class
-        self._regexes = {
-            # Captures all static function definitions. Return types must be in all lowercase, and { on next line!
-            'all_static_functions': r"((static *(noinline)*? *([a-z_*0-9 ]+?) *([a-zA-Z_0-9]*)\()([a-z_*0-9,\n\t ]*)(\))\s*{)",
-            'specific_static_function': "((static *(noinline)*? *([a-z_*0-9 ]+?) *({func_name})\()([a-z_*0-9,\n\t ]*)(\))\s*{{)",
-            'find_module_init': r"module_init\((.*)\);",
-            'find_module_exit': r"module_exit\((.*)\);",
-            'main_function': "((static *(noinline)*? *([a-z_*0-9 ]+?) *({main})\()([a-z_*0-9,\n\t ]*)(\))\s*{{)",
-            'exit_function': "((static *(noinline)*? *([a-z_*0-9 ]+?) *({exit})\()([a-z_*0-9,\n\t ]*)(\))\s*{{)",
-            'includes_end': "(#include [<\"].*?[>\"].*)(\s*\n\s*\n)",
-            'statics_with_context_args': "((static *(noinline)*? *([a-z_*0-9 ]+?) *([a-zA-Z_0-9]*)\()({ctx_args})(\))\s*{{)",
-            'statics_with_context_and_extra_args': "((static *(noinline)*? *([a-z_*0-9 ]+?) *([a-zA-Z_0-9]*)\()({ctx_args})(.*)(\))\s*{{)",
-            'test_macro_function': "(TEST(.*?), *(.*?) *{)",
-            'function_calls_common_args': "(([a-zA-Z0-9_]*)\(({common_args})*\);)",
-            # We exploit the fact that this should be used AFTER the KTF specific
-            # arguments have been added.
-            'function_calls_with_args': "(((\w)+)(\()((?!struct)(?!\))))",
-            'find_exact_match': "({pattern})",
-            'function_calls_without_args': "(((\w)+)(\(\)))",
-            'multi_arg_test_function_calls': "(([a-zA-Z0-9_]*)\(({common_args}), *(.*?)\));",
-            'find__init_and_exit': "\s(__init|__exit)\s",
-        }
-            
+        # The dummy functions "convert_to_test_extra_args" adds, and the 
+        # variables of the loops it replaces with ADD_LOOP_TEST.
+        self._dummy_functions_to_add = []
+        self._loop_variables = set()
+
+        # Nothing is read or analysed until it is needed: the file is 
+        # analysed by "_analyse", and prepared for the conversion steps by 
+        # "prepare". The analysis of the file does not depend on the rules, 
+        # so callers that convert the same file again can pass the result 
+        # of an earlier "get_index" instead of having the file scanned again.
+        self._given_index = index
+        self._index = None
+        self._prepared = False
+        return self
 
-        # Calls to initialization methods:
-        # --------------------------------
-        self._register_init_and_exit()
-        self._register_local_functions()
-        self._register_helper_functions()
+    def prepare(self):
+        """
+        Reads and analyses the file, and makes the changes every conversion 
+        needs (a new main function if ["should_add_new_main"] is set, and 
+        the removal of __init and __exit). Called by the first conversion 
+        step or getter used, so there is normally no need to call it; 
+        callers that time the steps can call it first to keep that work 
+        apart. Does nothing if the converter is prepared already.
+        """
+        if self._prepared:
+            return self
+        self._prepared = True
+        self._analyse()
 
         # Calls to conversion methods:
         # --------------------------------
@@ -297,6 +605,7 @@ class Converter(object):
         self.dprintwl("self._new_types", self._new_types)
         self.dprintwl("self._boilerplate_code", self._boilerplate_code)
         self.dprintwl("self._context_args", self._context_args)
+        return self
 
 
     # Debug functions.
@@ -347,6 +656,40 @@ class Converter(object):
 
     # Private methods for registering info for later use.
 
+    def _load(self):
+        """
+        Reads the input file, unless its contents were given or have been 
+        read already.
+        """
+        if self._original_text is not None:
+            return
+        if self._text is None:
+            with open(self._input_file_name, 'r') as f:
+                self._text = f.read()
+        self._original_text = self._text
+        self._offset_map = OffsetMap(len(self._text))
+
+    def _analyse(self):
+        """
+        Registers the init and exit function, the local functions and the 
+        helper functions, unless that has been done already. Does not 
+        change the text.
+        """
+        if self._index is not None:
+            return
+        self._load()
+        if self._given_index is None:
+            self._register_init_and_exit()
+            self._register_local_functions()
+        else:
+            self._load_index(self._given_index)
+        self._index = {
+            "module_init": self._module_init_name,
+            "module_exit": self._module_exit_name,
+            "local_functions": list(self._local_function_names),
+        }
+        self._register_helper_functions()
+
     def _register_init_and_exit(self):
         """
         Registers the init and exit function in the file.
@@ -378,6 +721,18 @@ class Converter(object):
         
         self.dprintwl("self._local_function_names:", self._local_function_names)
 
+    def _load_index(self, index):
+        """
+        Registers the init and exit function and the local functions from 
+        an index returned by "get_index", instead of scanning the text.
+        """
+        self._module_init_name = index["module_init"]
+        self._module_exit_name = index["module_exit"]
+        if not self._test_suite_name:
+            self._test_suite_name = self._module_init_name
+        for func_name in index["local_functions"]:
+            self._local_function_names[func_name] = True
+
     def _register_helper_functions(self):
         """
         Registers all local functions that have not been 
@@ -424,6 +779,38 @@ class Converter(object):
             return matches.group(1)
 
 
+    def _dummy_function_for_call(self, test_name, extra_args):
+        """
+        Returns the name of the dummy TEST function that makes the call to 
+        the test function with the extra arguments. A new dummy function is 
+        only created (and added to the list the caller inserts into the 
+        code) if no identical call has been wrapped already, or if 
+        ["repeat_identical_calls"] is set; otherwise the existing one is 
+        reused, and "convert_to_test_extra_args" drops the repeated 
+        registration of it.
+        """
+        modified_call = self._dummy_function_internal_call.format(
+            func_name=test_name, alt_args=self._common_call_multi_arg_replace,
+            rest_args=extra_args)
+        if modified_call in self._dummy_function_names_by_call and \
+                not self._repeat_identical_calls:
+            self._duplicate_dummy_functions += 1
+            return self._dummy_function_names_by_call[modified_call]
+
+        dummy_func_name = self._dummy_function_name.format(
+            func_name=test_name, counter=self._dummy_function_counter)
+        dummy_func_body = self._dummy_function_body.format(
+            suite_name=self._test_suite_name, dummy_name=dummy_func_name, 
+            call=modified_call)
+
+        self._dummy_function_counter += 1
+        self._dummy_function_names_by_call[modified_call] = dummy_func_name
+
+        # Add dummy functions to a list of tuples that will be added to the
+        # code by the caller.
+        self._dummy_functions_to_add.append((test_name, dummy_func_body))
+        return dummy_func_name
+
     def _replace_if_valid_multi_arg_test_function(self, matches):
         """
         Replaces a match if the function is a test function
@@ -436,26 +823,40 @@ class Converter(object):
 
         pprint(matches.group(1))
         if test_name in self._test_function_names:
-            dummy_func_name = self._dummy_function_name.format(
-                func_name=test_name, counter=self._dummy_function_counter)
-            modified_call = self._dummy_function_internal_call.format(
-                func_name=test_name, alt_args=self._common_call_multi_arg_replace,
-                rest_args=extra_args)
-            dummy_func_body = self._dummy_function_body.format(
-                suite_name=self._test_suite_name, dummy_name=dummy_func_name, 
-                call=modified_call)
+            dummy_func_name = self._dummy_function_for_call(test_name, extra_args)
             add_test_call = self._add_test_call.format(func_name=dummy_func_name)
-
-            self._dummy_function_counter += 1
-
-            # Add dummy functions to a list of tuples that will be added to the
-            # code by the caller.
-            self._dummy_functions_to_add.append((test_name, dummy_func_body))
             
             return add_test_call
         else: 
             return matches.group(1)
 
+    def _replace_if_valid_loop_multi_arg_test_function(self, matches):
+        """
+        Replaces a for loop around a call to a test function "marked" for 
+        conversion, that has extra arguments. The call is moved into a 
+        dummy TEST function where the loop variable is replaced by the KTF 
+        loop index, and the loop becomes a single ADD_LOOP_TEST that lets 
+        KTF run the iterations.
+        """
+        loop_var = matches.group(1)
+        start = matches.group(2)
+        end = matches.group(4)
+        test_name = matches.group(7)
+        extra_args = matches.group(9)
+
+        if test_name not in self._test_function_names:
+            return matches.group(0)
+        if matches.group(3) == "<=":
+            end = self._loop_end_inclusive.format(end=end)
+        extra_args = re.sub(r"\b{}\b".format(re.escape(loop_var)), 
+            self._loop_index, extra_args)
+
+        dummy_func_name = self._dummy_function_for_call(test_name, extra_args)
+        self._loop_variables.add(loop_var)
+
+        return self._add_loop_test_call.format(
+            func_name=dummy_func_name, start=start, end=end)
+
     def _is_helper_or_multi_arg_test_function(self, test_name):
         """
         Returns True if the test name refers to a helper function
@@ -531,16 +932,65 @@ class Converter(object):
                 return item[1]+"("
         return matches.group(1)
 
-    def _sub(self, reg, result):
+    def _can_match(self, reg):
+        """
+        Returns True unless the text lacks a string that every match of the 
+        regex must contain, in which case the substitution is skipped. Every 
+        substitution is recorded as a Pass (see "get_passes").
+        """
+        for literal in required_literals(reg):
+            if literal not in self._text:
+                self._passes.append(Pass(reg, True, literal, 0))
+                return False
+        self._passes.append(Pass(reg, False, None, 0))
+        return True
+
+    def _sub(self, reg, result, flags=0, count=0):
         """
         Performs the actual substitution with the regexes.
         """
-        self._text = re.sub(reg, result, self._text)
+        if not self._can_match(reg):
+            return self
+        edits = []
+        def replace(match):
+            replacement = result(match) if callable(result) else match.expand(result)
+            # Only the part of the match that actually changes is recorded as 
+            # an edit, so that the rest still maps back to where it came from.
+            matched = match.group(0)
+            prefix = len(os.path.commonprefix([matched, replacement]))
+            suffix = len(os.path.commonprefix([matched[prefix:][::-1], 
+                replacement[prefix:][::-1]]))
+            if prefix + suffix < max(len(matched), len(replacement)):
+                edits.append((match.start() + prefix, match.end() - suffix, 
+                    len(replacement) - prefix - suffix))
+            return replacement
+        self._text, matches = re.subn(reg, replace, self._text, count=count, 
+            flags=flags)
+        self._passes[-1] = self._passes[-1]._replace(matches=matches)
+        self._offset_map.apply_edits(edits)
+        return self
+
+    def _edit(self, edits):
+        """
+        Replaces parts of the text. The edits are a list of (start, end, 
+        replacement), sorted by start and not overlapping.
+        """
+        pieces = []
+        position = 0
+        for start, end, replacement in edits:
+            pieces.append(self._text[position:start])
+            pieces.append(replacement)
+            position = end
+        pieces.append(self._text[position:])
+        self._text = "".join(pieces)
+        self._offset_map.apply_edits(
+            [(start, end, len(replacement)) for start, end, replacement in edits])
         return self
 
 
     # Public methods for adding and/or replacing text.
 
+    @_prepared
     def add_init_code_to_main(self):
         """
         Adds initialization code to the main function of the file.
@@ -549,6 +999,7 @@ class Converter(object):
             self._regexes['main_function'].format(main=self._module_init_name),
             self._init_code)
 
+    @_prepared
     def add_exit_code(self):
         """
         Adds cleanup code to the exit function of the file.
@@ -557,6 +1008,7 @@ class Converter(object):
             self._regexes['exit_function'].format(exit=self._module_exit_name),
             self._exit_code)
 
+    @_prepared
     def add_include_code(self):
         """
         Adds additional code to include necessary headers.
@@ -565,6 +1017,7 @@ class Converter(object):
             self._regexes['includes_end'],
             self._include_code)
 
+    @_prepared
     def add_type_definitions(self):
         """
         Adds type definitions such as structs and typedefs.
@@ -573,6 +1026,7 @@ class Converter(object):
             self._regexes['includes_end'],
             self._new_types)
 
+    @_prepared
     def convert_to_test_common_args(self):
         """
         Converts all specified test functions to TEST functions,
@@ -588,13 +1042,25 @@ class Converter(object):
                 ctx_args=self._context_args),
             self._replace_if_valid_test_function_def)
 
+    @_prepared
     def convert_to_test_extra_args(self):
         """
         Converts the rest of the specified test functions to TEST 
         functions, mainly those with additional arguments which are
-        not converted by 'convert_to_test_common_args'.
+        not converted by 'convert_to_test_common_args'. A call that is the 
+        only statement of a for loop counting up by one is registered with 
+        ADD_LOOP_TEST instead, with the loop variable replaced by the KTF 
+        loop index. Identical calls share one dummy function, which is then 
+        registered once.
         """
         self._dummy_functions_to_add = []
+        self._loop_variables = set()
+        # Calls inside simple for loops become loop tests; this must happen 
+        # before the calls themselves are replaced below.
+        self._sub(
+            self._regexes['loop_multi_arg_test_function_calls'].format(
+                common_args=self._common_call_args),
+            self._replace_if_valid_loop_multi_arg_test_function)
         self._sub(
             self._regexes['multi_arg_test_function_calls'].format(
                 common_args=self._common_call_args),
@@ -610,8 +1076,75 @@ class Converter(object):
                         dummy_body=dummy_tuple[1], orig_func="\g<1>"))
         else:
             print("No dummy functions to add!")
-        return self
+        if self._duplicate_dummy_functions:
+            print("# Duplicate dummy functions reused: " + 
+                str(self._duplicate_dummy_functions))
+            self._remove_repeated_registrations()
+        return self._remove_unused_loop_variables()
 
+    def _remove_repeated_registrations(self):
+        """
+        Removes the lines that register a dummy function again in exactly 
+        the same way as an earlier line, which is what a reused dummy 
+        function leaves behind.
+        """
+        dummy_names = set(self._dummy_function_names_by_call.values())
+        seen = set()
+        edits = []
+        for line in re.finditer(self._regexes['registration_line'], self._text, 
+                re.MULTILINE):
+            if line.group(2) not in dummy_names:
+                continue
+            if line.group(1) in seen:
+                edits.append((line.start(), line.end(), ""))
+            seen.add(line.group(1))
+        return self._edit(edits)
+
+    def _remove_unused_loop_variables(self):
+        """
+        Removes the declarations of the variables of the loops replaced by 
+        ADD_LOOP_TEST from the functions that no longer use them, as they 
+        would be reported by -Wunused-variable (and fail with -Werror). 
+        Only integer declarations without initializers are changed.
+        """
+        if not self._loop_variables:
+            return self
+        edits = []
+        for body in re.finditer(self._regexes['function_body'], self._text, 
+                re.MULTILINE):
+            end = matching_brace(self._text, body.start())
+            text = self._text[body.start():end]
+            if end < 0 or not re.search(self._regexes['add_loop_test_call'], text):
+                continue
+            # The declaration lines removed as a whole, start to end.
+            removed_lines = {}
+            for declaration in re.finditer(self._regexes['integer_declaration'], 
+                    text, re.MULTILINE):
+                names = [name.strip() for name in declaration.group(1).split(",")]
+                # The declaration itself is the only use left.
+                unused = [name for name in names if name in self._loop_variables 
+                    and len(re.findall(r"\b{}\b".format(name), text)) == 1]
+                if not unused:
+                    continue
+                kept = [name for name in names if name not in unused]
+                if kept:
+                    start, stop = declaration.span(1)
+                    replacement = ", ".join(kept)
+                else:
+                    start, stop = declaration.span()
+                    replacement = ""
+                    removed_lines[start] = stop
+                edits.append((body.start() + start, body.start() + stop, replacement))
+            # The blank line after the declarations goes as well if all the 
+            # lines between it and the { have been removed.
+            position = len("{\n") if text.startswith("{\n") else None
+            while position in removed_lines:
+                position = removed_lines[position]
+            if position and position > len("{\n") and text.startswith("\n", position):
+                edits.append((body.start() + position, body.start() + position + 1, ""))
+        return self._edit(sorted(edits))
+
+    @_prepared
     def convert_calls_to_add_test(self):
         """
         Converts all calls to the ordinary single/none argument
@@ -622,6 +1155,7 @@ class Converter(object):
                 common_args=self._common_call_args),
             self._replace_if_valid_test_function_call)
 
+    @_prepared
     def add_extra_parameters_to_helpers_and_multi_arg_defs(self):
         """
         Adds a KTF self argument to all helper functions.
@@ -630,6 +1164,7 @@ class Converter(object):
             self._regexes['all_static_functions'],
             self._add_extra_args_if_valid_definition)
 
+    @_prepared
     def add_self_argument_to_helper_calls(self):
         """
         Adds an extra self argument to calls on helper functions.
@@ -643,14 +1178,16 @@ class Converter(object):
             self._regexes['function_calls_without_args'],
             self._add_extra_args_if_valid_call_no_args)
 
+    @_prepared
     def use_replacements(self):
         """
         Converts assertions calls to KTF assertions.
         """
         for pattern in self._replacements:
-            self._text = re.sub(pattern[0], pattern[1], self._text, flags=re.MULTILINE)
+            self._sub(pattern[0], pattern[1], flags=re.MULTILINE)
         return self
 
+    @_prepared
     def add_boilerplate_code(self):
         """
         Adds boilerplate test code to all test functions defined 
@@ -660,6 +1197,156 @@ class Converter(object):
             self._regexes['test_macro_function'],
             self._boilerplate_code)
 
+    @_prepared
+    def add_test_timing(self):
+        """
+        Measures the run time of every TEST function with ktime_get_ns(), 
+        as selected by the ["test_timing"] rule (does nothing if the rule 
+        is not set). Should be called after all the TEST functions have 
+        been defined. The time is taken at every "return;" in the body as 
+        well, but not when an ASSERT macro ends the test early.
+        """
+        if not self._test_timing:
+            return self
+        if self._test_timing not in ("log", "stats"):
+            raise ValueError("Unknown test_timing rule: " + str(self._test_timing))
+
+        tests = list(re.finditer(self._regexes['test_macro_definition'], self._text))
+        if not tests:
+            return self
+
+        edits = []
+        if self._test_timing == "stats":
+            names = "".join(self._timing_stats_name.format(test_name=t.group(2))
+                for t in tests)
+            edits.append((tests[0].start(), tests[0].start(), 
+                self._timing_stats.format(suite_name=self._test_suite_name, 
+                    count=len(tests), names=names)))
+        for index, match in enumerate(tests):
+            if self._test_timing == "log":
+                report = self._timing_log.format(
+                    suite_name=match.group(1), test_name=match.group(2))
+            else:
+                report = self._timing_record.format(
+                    suite_name=self._test_suite_name, index=index)
+            open_index = match.end() - 1
+            close_index = matching_brace(self._text, open_index)
+            if close_index < 0:
+                continue
+            timed_return = self._timing_return.format(report=report)
+            edits.append((open_index + 1, open_index + 1, self._timing_start))
+            for ret in re.finditer(self._regexes['return_statement'], 
+                    self._text[open_index + 1:close_index]):
+                edits.append((open_index + 1 + ret.start(), 
+                    open_index + 1 + ret.end(), timed_return))
+            edits.append((close_index, close_index, 
+                self._timing_end.format(report=report)))
+        self._edit(edits)
+
+        if self._test_timing == "stats":
+            self._sub(
+                self._regexes['exit_function'].format(exit=self._module_exit_name),
+                self._timing_dump_call.format(suite_name=self._test_suite_name))
+
+        return self._sub(self._regexes['first_include'],
+            self._timing_stats_include if self._test_timing == "stats" else 
+            self._timing_include, count=1)
+
+    @_prepared
+    def add_context_array(self):
+        """
+        Registers ["context_count"] contexts of the ["context_type"] 
+        (does nothing if the rule is not set): generates the functions 
+        that allocate, set up and add the contexts, and that remove them 
+        again, and calls them from the init function (before the first 
+        ADD_TEST) and the exit function (before KTF_CLEANUP). If the 
+        contexts can't be allocated, the init function calls the exit 
+        function before it fails, so what the ["init_code"] registered is 
+        removed again. Should be called after the init and exit code and 
+        the ADD_TEST calls have been added.
+        """
+        if self._context_count is None:
+            return self
+        count = self._context_count
+        if isinstance(count, bool) or not (
+                isinstance(count, int) and count > 0 or
+                isinstance(count, str) and count.strip()):
+            raise ValueError("The context_count rule must be a positive int "
+                "or a C expression, not " + repr(count))
+        if not self._context_type:
+            raise ValueError("The context_count rule needs a context_type")
+
+        init_match = re.search(self._regexes['function_definition'].format(
+            name=self._module_init_name), self._text, re.MULTILINE)
+        if init_match is None:
+            raise ValueError("No init function to add the contexts to")
+        exit_match = re.search(self._regexes['function_definition'].format(
+            name=self._module_exit_name), self._text, re.MULTILINE) \
+            if self._module_exit_name else None
+
+        # The functions go before the init and exit functions, whichever 
+        # comes first.
+        position = min(m.start() for m in (init_match, exit_match) if m)
+        prefix = self._test_suite_name or self._module_init_name
+        # The exit function may come after the init function that calls it.
+        exit_declaration = exit_match.group(0)[:exit_match.group(0).rindex(")") + 1] \
+            + ";\n\n" if exit_match else ""
+        edits = [(position, position, self._context_array.format(
+            exit_declaration=exit_declaration,
+            type=self._context_type, prefix=prefix, name=self._context_name,
+            count=self._context_count,
+            init_code=self._indent_lines(self._context_init_code, "\t\t"),
+            exit_code=self._indent_lines(self._context_exit_code, "\t\t")))]
+
+        body_end = matching_brace(self._text, init_match.end() - 1)
+        first_test = re.search(self._regexes['add_test_line'],
+            self._text[init_match.end():body_end], re.MULTILINE)
+        position = init_match.end() + first_test.start() if first_test else \
+            self._text.index("\n", init_match.end()) + 1
+        add_call = self._context_add_call_with_exit.format(prefix=prefix,
+            exit=self._module_exit_name) if exit_match else \
+            self._context_add_call.format(prefix=prefix)
+        edits.append((position, position, add_call))
+
+        if exit_match is not None:
+            body_end = matching_brace(self._text, exit_match.end() - 1)
+            cleanup = re.search(self._regexes['ktf_cleanup_line'],
+                self._text[exit_match.end():body_end], re.MULTILINE)
+            position = exit_match.end() + cleanup.start() if cleanup else body_end
+            edits.append((position, position,
+                self._context_remove_call.format(prefix=prefix)))
+        self._edit(sorted(edits))
+
+        return self._sub(self._regexes['first_include'],
+            self._context_include, count=1)
+
+    @staticmethod
+    def _indent_lines(code, indent):
+        """
+        Returns the lines of code, each indented and ending with a newline.
+        """
+        return "".join(indent + line.strip() + "\n" 
+            for line in code.splitlines() if line.strip())
+
+    @_prepared
+    def run_plugins(self):
+        """
+        Runs the ["plugins"] (does nothing if there are none): every event 
+        in the file is given to the plugins that handle it, and all their 
+        edits are made at once (see "plugins.traverse").
+        """
+        if not self._plugins:
+            return self
+        plugins = [load_plugin(spec) for spec in self._plugins]
+        for plugin in plugins:
+            plugin.begin(self)
+        edits, timings = traverse(self._text, plugins)
+        self._edit(edits)
+        self._plugin_timings.extend(timings)
+        for plugin in plugins:
+            plugin.end(self)
+        return self
+
     def _add_new_main(self):
         """
         Adds a new main function if the previous main was converted to a TEST
@@ -687,9 +1374,199 @@ class Converter(object):
     
     # Other methods.
 
+    @_prepared
+    def get_text(self):
+        """
+        Returns the converted text without writing it anywhere.
+        """
+        return self._text
+
+    def get_index(self):
+        """
+        Returns the analysis of the input file that does not depend on the 
+        rules (the init and exit functions and the local functions), as a 
+        JSON-friendly dict that can be given back to the constructor.
+        """
+        self._analyse()
+        return self._index
+
+    def get_suite_name(self):
+        """
+        Returns the name of the test suite (see ["test_suite_name"]).
+        """
+        self._analyse()
+        return self._test_suite_name
+
+    def inspect(self):
+        """
+        Returns what the converter would work with in the input file, as a 
+        JSON-friendly dict, without converting anything (nor changing the 
+        text). The keys are:
+            "file", "bytes"
+            "module_init", "module_exit" : the function names, or None
+            "functions"       : the local functions (see "get_index")
+            "test_functions"  : the ["test_functions"] found in the file, or 
+                                if there are none, the local functions 
+                                called by the init function (or the init 
+                                function itself if it calls none): the 
+                                likely candidates
+            "helpers"         : the other local functions, except the 
+                                ["blacklist"]
+            "common_args"     : the arguments most calls to test functions 
+                                pass (see ["common_call_args"]; by default, 
+                                the first argument most of the calls pass, 
+                                if any)
+            "multi_arg_calls" : the calls to test functions that pass more 
+                                arguments than the common ones, as dicts of 
+                                "function", "line" and "args"
+            "assertions"      : the number of uses of every assertion macro
+            "replacements"    : the number of matches of every 
+                                ["replacements"] pattern
+        Works on files that could not be converted, too.
+        """
+        self._load()
+        text = self._original_text
+        init_name, exit_name = module_functions(text)
+        functions = []
+        for match in re.finditer(self._regexes['all_static_functions'], text):
+            if match.group(5) not in functions:
+                functions.append(match.group(5))
+
+        # The calls to local functions made by the init function.
+        calls = []
+        init = init_name and re.search(self._regexes['specific_static_function']
+            .format(func_name=re.escape(init_name)), text)
+        if init:
+            end = matching_brace(text, init.end() - 1)
+            body_end = end if end >= 0 else len(text)
+            for match in re.compile(self._regexes['function_call']).finditer(
+                    text, init.end(), body_end):
+                args = call_arguments(text, match.end() - 1)
+                if match.group(1) in functions and args is not None:
+                    calls.append((match.group(1), match.start(), args))
+
+        if self._test_function_names:
+            tests = [name for name in self._test_function_names if name in functions]
+        else:
+            tests = []
+            for name, _, _ in calls:
+                if name not in tests and name != exit_name:
+                    tests.append(name)
+            if not tests and init_name in functions:
+                tests = [init_name]
+        blacklist = self._blacklist or []
+        helpers = [name for name in functions if name not in tests and
+            name not in (init_name, exit_name) and name not in blacklist]
+
+        if self._common_call_args:
+            common_args = call_arguments("(" + self._common_call_args + ")", 0)
+        else:
+            firsts = [args[0] for name, _, args in calls if args and name in tests]
+            first = max(firsts, key=firsts.count) if firsts else None
+            common_args = [first] if first and firsts.count(first) * 2 > \
+                len(firsts) else []
+        multi_arg_calls = [{"function": name,
+            "line": text.count("\n", 0, start) + 1, "args": args}
+            for name, start, args in calls
+            if name in tests and len(args) > len(common_args)]
+
+        assertions = {}
+        for match in re.finditer(self._regexes['assertion_macro_calls'], text):
+            assertions[match.group(1)] = assertions.get(match.group(1), 0) + 1
+        replacements = dict((pattern[0],
+            len(re.findall(pattern[0], text, flags=re.MULTILINE)))
+            for pattern in self._replacements or [])
+
+        return {
+            "file": self._input_file_name,
+            "bytes": len(text),
+            "module_init": init_name,
+            "module_exit": exit_name,
+            "functions": functions,
+            "test_functions": tests,
+            "helpers": helpers,
+            "common_args": common_args,
+            "multi_arg_calls": multi_arg_calls,
+            "assertions": assertions,
+            "replacements": replacements,
+        }
+
+    @_prepared
+    def get_source_map(self):
+        """
+        Returns a SourceMap from the lines of the converted text to the 
+        lines of the input file.
+        """
+        return SourceMap.from_offsets(self._input_file_name, self._outfile_name,
+            self._offset_map, self._original_text, self._text)
+
+    @_prepared
+    def get_reused_dummy_functions(self):
+        """
+        Returns the number of calls that reused the dummy function of an 
+        identical call instead of getting one of their own (see 
+        "_dummy_function_for_call").
+        """
+        return self._duplicate_dummy_functions
+
+    @_prepared
+    def get_passes(self):
+        """
+        Returns the list of Pass records for the substitutions done so far, 
+        in order. Substitutions whose pattern requires text that is not in 
+        the file are not run, and are marked as skipped.
+        """
+        return self._passes
+
+    @_prepared
+    def get_plugin_timings(self):
+        """
+        Returns the list of PluginTiming records of the plugins run so far 
+        (see "run_plugins"), in order.
+        """
+        return self._plugin_timings
+
+    @_prepared
+    def get_shards(self):
+        """
+        Returns a list of (file name, text) for the modules to write: the 
+        output file itself, or one entry per shard if ["shards"] is set.
+        """
+        if not self._shards or self._shards < 2:
+            return [(self._outfile_name, self._text)]
+        sources = shard_suite(self._text, self._shards)
+        return list(zip(shard_paths(self._outfile_name, len(sources)), sources))
+
+    @_prepared
     def result(self):
         """
-        Prints the result to the earlier specified output stream.
+        Prints the result to the earlier specified output stream (or to the 
+        shard files, see ["shards"]).
         """
-        with open(self._outfile_name, 'w') as f:
-            f.write(self._text)
\ No newline at end of file
+        shards = self.get_shards()
+        for file_name, text in shards:
+            with open(file_name, 'w') as f:
+                f.write(text)
+        if len(shards) > 1:
+            update_makefile(self._outfile_name, [name for name, _ in shards])
+        elif self._source_map:
+            with open(map_path(self._outfile_name), 'w') as f:
+                f.write(self.get_source_map().to_json())
+
+
+def bundle_results(converters, outfile_name):
+    """
+    Writes the converted text of several Converters as one KTF module, 
+    instead of one module per file. Names defined by more than one file 
+    are renamed, and the module gets a combined init and exit function 
+    that calls those of every suite (see "ktf_modules.bundle_suites"). 
+    The obj-m line of the Makefile.in next to outfile_name is updated to 
+    build the bundle instead of the separate files.
+    """
+    sources = [(os.path.splitext(os.path.basename(c._outfile_name))[0], c.get_text())
+        for c in converters]
+    module_name = os.path.splitext(os.path.basename(outfile_name))[0]
+    with open(outfile_name, 'w') as f:
+        f.write(bundle_suites(sources, module_name))
+    update_makefile(outfile_name, [outfile_name], 
+        [c._outfile_name for c in converters])
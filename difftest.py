@@ -0,0 +1,305 @@
+import os, re, sys, glob, time, random, argparse, importlib
+from collections import namedtuple
+from multiprocessing import Pool
+
+from batch import Job, convert_text, load_wrapper, init_worker
+
+
+
+repo_directory = os.path.dirname(os.path.abspath(__file__))
+
+# One input for the harness: a name for the report, the job (rules and
+# steps) and the text to convert.
+Case = namedtuple('Case', 'name job text')
+
+# The outcome of running both engines on one case. "legacy" and
+# "candidate" are the best times in seconds. "minimized" is the smallest
+# input found that still makes the engines disagree (None if they agree).
+CaseResult = namedtuple('CaseResult',
+    'name equal legacy candidate first_difference minimized')
+
+# Bundled inputs that have a wrapper with hand written rules. All the other
+# bundled sources are converted with rules derived by "generic_rules".
+WRAPPER_CASES = [
+    ("test_sort_rewrite/kernel/test_sort_backup.c", "convert_wrapper_sort.py"),
+    ("test_xarray_rewrite/kernel/test_xarray_backup.c", "convert_wrapper_xarray.py"),
+]
+
+# Every conversion step, in the order used by convert_wrapper_xarray.py.
+ALL_STEPS = ["add_include_code", "add_init_code_to_main", "add_exit_code",
+    "add_type_definitions", "convert_to_test_common_args",
+    "convert_to_test_extra_args", "convert_calls_to_add_test",
+    "add_boilerplate_code", "add_extra_parameters_to_helpers_and_multi_arg_defs",
+    "add_self_argument_to_helper_calls", "use_replacements"]
+
+
+# Building the corpus.
+# -------------------------------------------------------------------
+
+def generic_rules(text, suite_name):
+    """
+    Rules for a file without a wrapper: every static function that takes
+    no arguments is treated as a test function, and the BUG_ON style
+    assertions are converted.
+    """
+    names = re.findall(r"static\s+(?:noinline\s+)?[a-z_0-9 *]*?\b(\w+)\((?:void)?\)\s*{", text)
+    return {
+        "test_functions": names,
+        "test_suite_name": suite_name,
+        "blacklist": [],
+        "new_types": "\\g<1>\n",
+        "boilerplate_code": "\\g<1>\n",
+        "extra_dummy_args_call": "",
+        "replacements": [
+            (r"(^\s*)(BUG_ON[(])", "\\g<1>EXPECT_FALSE("),
+            (r"(^\s*)(WARN_ON[(])", "\\g<1>EXPECT_FALSE("),
+        ],
+    }
+
+def bundled_cases():
+    """
+    Returns the cases for the *_backup.c and *_rewrite*.c files in the
+    repository: each file with generic rules, plus the files that have a
+    wrapper with the wrapper's rules.
+    """
+    cases = []
+    for input_file, wrapper in WRAPPER_CASES:
+        rules, steps = load_wrapper(os.path.join(repo_directory, wrapper))
+        path = os.path.join(repo_directory, input_file)
+        with open(path, 'r') as f:
+            cases.append(Case(input_file + " (" + wrapper + ")",
+                Job(path, None, rules, steps), f.read()))
+
+    patterns = ["*/kernel/*_backup.c", "*/kernel/*_rewrite*.c", "*/kernel/*-test.c"]
+    paths = sorted(set(p for pattern in patterns
+        for p in glob.glob(os.path.join(repo_directory, pattern))))
+    for path in paths:
+        with open(path, 'r') as f:
+            text = f.read()
+        name = os.path.relpath(path, repo_directory)
+        suite_name = os.path.splitext(os.path.basename(path))[0]
+        cases.append(Case(name, Job(path, None, generic_rules(text, suite_name),
+            ALL_STEPS), text))
+    return cases
+
+synthetic_rules = {
+    "context_args": "struct xarray [*]xa|void",
+    "common_call_args": "&array",
+    "extra_dummy_args_call": "xa",
+    "new_types": "\\g<1>\nstruct array_context {\n\tstruct ktf_context k;\n\tstruct xarray *xa;\n};\n\n",
+    "boilerplate_code": "\\g<1>\n\tstruct xarray *xa = KTF_CONTEXT_GET(\"array\", struct array_context)->xa;\n",
+    "replacements": [
+        (r"(^\s*)(XA_BUG_ON[(]xa, *)", "\\g<1>EXPECT_FALSE("),
+    ],
+}
+
+def synthetic_case(seed, functions=40):
+    """
+    Generates a C file in the style of test_xarray.c: helpers, test
+    functions with and without extra arguments, and an init function that
+    calls the tests. The same seed always gives the same file.
+    """
+    rng = random.Random(seed)
+    suite = "synthetic_{}".format(seed)
+    helpers, tests, calls = [], [], []
+    parts = ["#include <linux/module.h>\n#include <linux/xarray.h>\n\n"
+        "static DEFINE_XARRAY(array);\n\n"]
+    for i in range(functions):
+        kind = rng.choice(["helper", "test", "multi_arg_test", "void_test"])
+        body = "".join("\tXA_BUG_ON(xa, xa_load(xa, {}) != NULL);\n".format(
+            rng.randint(0, 1000)) for _ in range(rng.randint(1, 6)))
+        if helpers and rng.random() < 0.5:
+            body += "\t{}(xa, {});\n".format(rng.choice(helpers), rng.randint(0, 64))
+        if kind == "helper":
+            name = "helper_{}".format(i)
+            helpers.append(name)
+            parts.append("static void {}(struct xarray *xa, unsigned long index)\n"
+                "{{\n{}}}\n\n".format(name, body))
+        elif kind == "test":
+            name = "check_{}".format(i)
+            tests.append(name)
+            calls.append("\t{}(&array);\n".format(name))
+            parts.append("static noinline void {}(struct xarray *xa)\n"
+                "{{\n{}}}\n\n".format(name, body))
+        elif kind == "multi_arg_test":
+            name = "check_range_{}".format(i)
+            tests.append(name)
+            for _ in range(rng.randint(1, 3)):
+                calls.append("\t{}(&array, {}, {});\n".format(
+                    name, rng.randint(0, 9), rng.randint(0, 99)))
+            parts.append("static noinline void {}(struct xarray *xa, "
+                "unsigned int order, unsigned long index)\n{{\n{}}}\n\n".format(
+                    name, body))
+        else:
+            name = "check_void_{}".format(i)
+            tests.append(name)
+            calls.append("\t{}();\n".format(name))
+            parts.append("static void {}(void)\n{{\n\tpr_info(\"{}\\n\");\n}}\n\n"
+                .format(name, name))
+    parts.append("static int {0}_init(void)\n{{\n{1}\n\treturn 0;\n}}\n\n"
+        "static void {0}_exit(void)\n{{\n}}\n\n"
+        "module_init({0}_init);\nmodule_exit({0}_exit);\n".format(
+            suite, "".join(calls)))
+    rules = dict(synthetic_rules, test_functions=tests, test_suite_name=suite,
+        blacklist=[])
+    return Case("<synthetic {}>".format(seed),
+        Job("synthetic_{}.c".format(seed), None, rules, ALL_STEPS), "".join(parts))
+
+
+# Running and comparing the engines.
+# -------------------------------------------------------------------
+
+def load_engine(spec):
+    """
+    Loads an engine from a "module:function" string. An engine has the
+    signature of "batch.convert_text".
+    """
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def run_engine(engine, job, text):
+    """
+    Returns the output of the engine, or a description of the exception
+    it raised (two engines failing the same way count as agreeing).
+    """
+    try:
+        return engine(job, text)
+    except Exception as e:
+        return "<error: {}>".format(type(e).__name__)
+
+def timed(engine, job, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = run_engine(engine, job, text)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return output, best
+
+def first_difference(a, b):
+    a_lines, b_lines = a.splitlines(), b.splitlines()
+    for i, (x, y) in enumerate(zip(a_lines, b_lines)):
+        if x != y:
+            return "line {}: {!r} != {!r}".format(i + 1, x, y)
+    return "line {}: lengths differ ({} != {} lines)".format(
+        min(len(a_lines), len(b_lines)) + 1, len(a_lines), len(b_lines))
+
+def minimize(lines, differs, max_tests=2000):
+    """
+    Delta debugging (ddmin) over lines: returns a subset of the lines for
+    which differs(lines) is still true, and from which no single chunk of
+    the final granularity can be removed. Stops early after max_tests calls
+    to differs.
+    """
+    chunks = 2
+    tests = 0
+    while len(lines) >= 2 and tests < max_tests:
+        size = max(1, len(lines) // chunks)
+        reduced = False
+        for start in range(0, len(lines), size):
+            complement = lines[:start] + lines[start + size:]
+            tests += 1
+            if complement and differs(complement):
+                lines = complement
+                chunks = max(chunks - 1, 2)
+                reduced = True
+                break
+            if tests >= max_tests:
+                break
+        if not reduced:
+            if size == 1:
+                break
+            chunks = min(len(lines), chunks * 2)
+    return lines
+
+def _run_case(task):
+    case, legacy, candidate, repeat, should_minimize = task
+    expected, legacy_seconds = timed(legacy, case.job, case.text, repeat)
+    actual, candidate_seconds = timed(candidate, case.job, case.text, repeat)
+    if expected == actual:
+        return CaseResult(case.name, True, legacy_seconds, candidate_seconds,
+            None, None)
+
+    minimized = None
+    if should_minimize:
+        def differs(lines):
+            text = "".join(lines)
+            return run_engine(legacy, case.job, text) != \
+                run_engine(candidate, case.job, text)
+        minimized = "".join(minimize(case.text.splitlines(True), differs))
+    return CaseResult(case.name, False, legacy_seconds, candidate_seconds,
+        first_difference(expected, actual), minimized)
+
+def compare_engines(cases, candidate, legacy=convert_text, processes=None,
+        repeat=1, should_minimize=True, quiet=True):
+    """
+    Runs both engines on every case, on a pool of worker processes, and
+    returns a list of CaseResult. The engines must be importable functions
+    (they are pickled by name).
+    """
+    tasks = [(case, legacy, candidate, repeat, should_minimize) for case in cases]
+    with Pool(processes, initializer=init_worker, initargs=(quiet,)) as pool:
+        return pool.map(_run_case, tasks, chunksize=1)
+
+def save_minimized(results, directory):
+    """
+    Writes the minimized inputs of the failing cases to the directory, and
+    returns their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i, result in enumerate(r for r in results if r.minimized is not None):
+        path = os.path.join(directory, "difference_{}.c".format(i))
+        with open(path, 'w') as f:
+            f.write("/* Minimized from: {} */\n".format(result.name))
+            f.write(result.minimized)
+        paths.append(path)
+    return paths
+
+def format_report(results):
+    lines = ["{:<60} {:>6} {:>10} {:>10} {:>8}".format(
+        "input", "same", "legacy ms", "cand. ms", "speedup")]
+    for r in results:
+        lines.append("{:<60} {:>6} {:>10.2f} {:>10.2f} {:>7.2f}x".format(
+            r.name[-60:], "yes" if r.equal else "NO", r.legacy * 1000,
+            r.candidate * 1000, r.legacy / r.candidate if r.candidate else 0.0))
+        if not r.equal:
+            lines.append("    first difference at " + r.first_difference)
+    legacy = sum(r.legacy for r in results)
+    candidate = sum(r.candidate for r in results)
+    lines.append("{} inputs, {} differ, total {:.1f}ms vs {:.1f}ms ({:.2f}x)".format(
+        len(results), sum(1 for r in results if not r.equal), legacy * 1000,
+        candidate * 1000, legacy / candidate if candidate else 0.0))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Checks that a candidate conversion engine gives exactly '
+                    'the same output as the Converter, and compares their speed.')
+    parser.add_argument('--candidate', default='batch:convert_text',
+        help='the engine to test, as "module:function" (default: the legacy '
+             'engine itself, which checks the harness)')
+    parser.add_argument('--synthetic', type=int, default=50,
+        help='number of synthetic inputs to generate')
+    parser.add_argument('--functions', type=int, default=40,
+        help='number of functions in every synthetic input')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='number of timed runs per engine and input (the best is kept)')
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--no-minimize', action='store_true')
+    parser.add_argument('--save-dir', default='difftest_failures',
+        help='where the minimized inputs of failing cases are written')
+    args = parser.parse_args()
+
+    cases = bundled_cases() + [synthetic_case(args.seed + i, args.functions)
+        for i in range(args.synthetic)]
+    results = compare_engines(cases, load_engine(args.candidate),
+        processes=args.jobs, repeat=args.repeat,
+        should_minimize=not args.no_minimize)
+    print(format_report(results))
+    for path in save_minimized(results, args.save_dir) if \
+            any(not r.equal for r in results) else []:
+        print("Minimized input written to " + path)
+    sys.exit(0 if all(r.equal for r in results) else 1)
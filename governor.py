@@ -0,0 +1,217 @@
+import os, sys, time, resource
+from collections import namedtuple, deque
+from multiprocessing import Process, Pipe, Array, Value
+from multiprocessing.connection import wait
+
+from batch import JobResult, convert_text, read_input, convert_job
+
+
+
+# A job that could not be converted by any of the engines. "reason" is one
+# of "timeout", "memory", "error" or "crashed", "step" is the name of the
+# step that was running when the job was stopped, and "detail" holds the
+# error message or exit code, if any.
+JobFailure = namedtuple('JobFailure', 'job engine reason step detail')
+
+# How often (in seconds) the watchdog checks the running jobs.
+WATCHDOG_INTERVAL = 0.05
+
+# Room for the name of the running step, shared with the parent process.
+STEP_BUFFER_SIZE = 128
+
+
+# Memory usage helpers (Linux only, they return None elsewhere).
+# -------------------------------------------------------------------
+
+def _proc_status_kb(pid, field):
+    try:
+        with open("/proc/{}/status".format(pid), 'r') as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
+def rss_bytes(pid):
+    kb = _proc_status_kb(pid, "VmRSS")
+    return kb * 1024 if kb is not None else None
+
+def vm_size_bytes(pid):
+    kb = _proc_status_kb(pid, "VmSize")
+    return kb * 1024 if kb is not None else None
+
+
+# The governed child process.
+# -------------------------------------------------------------------
+
+def _limit_address_space(max_memory):
+    """
+    Caps the address space of this process at its current size plus
+    max_memory bytes, so a runaway allocation fails with a MemoryError
+    instead of taking the machine down. The watchdog in the parent checks
+    the resident size on top of this.
+    """
+    current = vm_size_bytes(os.getpid())
+    if current is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + max_memory
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _governed_child(job, engine, max_memory, step_buffer, start_rss, conn,
+        quiet):
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    # What the job uses is counted from here, as with the RLIMIT_AS cap.
+    start_rss.value = rss_bytes(os.getpid()) or 0
+    if max_memory:
+        _limit_address_space(max_memory)
+
+    def on_step(step):
+        step_buffer.value = step.encode('utf-8')[:STEP_BUFFER_SIZE - 1]
+
+    start = time.perf_counter()
+    try:
+        # The default engine also gives the source map and the stats.
+        if engine is convert_text:
+            text, _, source_map, stats = convert_job(job, read_input(job), on_step)
+        else:
+            text, source_map, stats = engine(job, read_input(job), on_step), \
+                None, None
+        conn.send(("ok", text, time.perf_counter() - start, source_map, stats))
+    except MemoryError:
+        conn.send(("memory", None, time.perf_counter() - start, None, None))
+    except Exception as e:
+        conn.send(("error", repr(e), time.perf_counter() - start, None, None))
+    finally:
+        conn.close()
+
+
+# The governor itself.
+# -------------------------------------------------------------------
+
+class _RunningJob(object):
+
+    def __init__(self, job, engine_index, process, conn, step_buffer, start_rss,
+            deadline):
+        self.job = job
+        self.engine_index = engine_index
+        self.process = process
+        self.conn = conn
+        self.step_buffer = step_buffer
+        self.start_rss = start_rss
+        self.deadline = deadline
+
+    def step(self):
+        return self.step_buffer.value.decode('utf-8', 'replace')
+
+def engine_name(engine):
+    return getattr(engine, "__name__", repr(engine))
+
+def convert_governed(jobs, processes=None, timeout=None, max_memory=None,
+        engines=(convert_text,), quiet=True):
+    """
+    Converts the jobs like "batch.convert_batch", but every job runs in a
+    process of its own, with a wall-clock limit of "timeout" seconds and a
+    memory limit of "max_memory" bytes (both optional). The memory limit is
+    enforced twice: with an RLIMIT_AS cap inside the job, and by a watchdog
+    in this process that kills jobs whose resident size grows by more than
+    it. Both count from the size of the job process when it starts, so the
+    interpreter and the converter code are not counted.
+
+    "engines" is a list of functions with the signature of
+    "batch.convert_text". A job that runs out of time or memory, raises an
+    exception or crashes is retried with the next engine in the list, and
+    reported as a JobFailure when there are no engines left. There is no
+    fallback engine by default: a partial conversion (with the slow step
+    left out, say) would be written out as if it had succeeded, so with
+    the default engines a job that fails is only reported, and has to be
+    fixed or given an engine of its own by the caller.
+
+    Returns a list of JobResult for the converted jobs (in the order of the
+    jobs) and a list of JobFailure. Only jobs converted by "convert_text"
+    have a source map and stats.
+    """
+    jobs = list(jobs)
+    processes = processes or os.cpu_count()
+    pending = deque((index, 0) for index in range(len(jobs)))
+    running = {}
+    results = {}
+    failures = []
+
+    def finish(entry, index, reason, detail):
+        if entry.engine_index + 1 < len(engines):
+            pending.append((index, entry.engine_index + 1))
+        else:
+            failures.append(JobFailure(entry.job,
+                engine_name(engines[entry.engine_index]), reason,
+                entry.step(), detail))
+
+    while pending or running:
+        while pending and len(running) < processes:
+            index, engine_index = pending.popleft()
+            step_buffer = Array('c', STEP_BUFFER_SIZE, lock=False)
+            start_rss = Value('q', 0, lock=False)
+            parent_conn, child_conn = Pipe(duplex=False)
+            process = Process(target=_governed_child,
+                args=(jobs[index], engines[engine_index], max_memory,
+                    step_buffer, start_rss, child_conn, quiet))
+            process.start()
+            child_conn.close()
+            deadline = time.monotonic() + timeout if timeout else None
+            running[parent_conn] = (index, _RunningJob(jobs[index],
+                engine_index, process, parent_conn, step_buffer, start_rss,
+                deadline))
+
+        for conn in wait(list(running), timeout=WATCHDOG_INTERVAL):
+            index, entry = running.pop(conn)
+            try:
+                status, payload, seconds, source_map, stats = conn.recv()
+            except EOFError:
+                status, payload = "crashed", None
+            entry.process.join()
+            conn.close()
+            if status == "ok":
+                results[index] = JobResult(entry.job, payload, seconds,
+                    source_map, stats)
+            elif status == "crashed":
+                finish(entry, index, status,
+                    "exit code {}".format(entry.process.exitcode))
+            else:
+                finish(entry, index, status, payload)
+
+        # The watchdog: stop jobs that are over their limits.
+        now = time.monotonic()
+        for conn, (index, entry) in list(running.items()):
+            reason = detail = None
+            if entry.deadline is not None and now > entry.deadline:
+                reason, detail = "timeout", "over {}s".format(timeout)
+            elif max_memory and entry.start_rss.value:
+                rss = rss_bytes(entry.process.pid)
+                if rss is not None and rss - entry.start_rss.value > max_memory:
+                    reason, detail = "memory", "{} bytes resident, {} at start" \
+                        .format(rss, entry.start_rss.value)
+            if reason:
+                entry.process.kill()
+                entry.process.join()
+                conn.close()
+                del running[conn]
+                finish(entry, index, reason, detail)
+
+    return [results[i] for i in sorted(results)], failures
+
+def format_failures(failures):
+    """
+    Returns a human readable report of the failed jobs.
+    """
+    lines = []
+    for failure in failures:
+        line = "FAILED {}: {} during step '{}' (engine {})".format(
+            failure.job.input_file, failure.reason, failure.step, failure.engine)
+        if failure.detail:
+            line += ": " + str(failure.detail)
+        lines.append(line)
+    return "\n".join(lines)
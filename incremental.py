@@ -0,0 +1,196 @@
+import os, json, hashlib, subprocess
+from collections import namedtuple
+
+
+
+# The modules whose code decides what a conversion produces. When one of
+# them changes, all the outputs are out of date.
+CONVERTER_MODULES = ["convert.py", "ktf_modules.py", "plugins.py",
+    "source_map.py"]
+
+# What "plan_changes" decided about the jobs of a manifest: the jobs to
+# convert, the reason each of them has to be converted (in the same order),
+# and the jobs whose outputs are up to date.
+ChangePlan = namedtuple('ChangePlan', 'convert reasons skipped')
+
+# The repository of every directory asked about, so git is run once per
+# directory rather than once per file.
+_toplevels = {}
+
+
+# Asking git.
+# -------------------------------------------------------------------
+
+def _git(directory, *args):
+    """
+    Runs git in directory and returns its output, or None if git fails (or
+    is not installed).
+    """
+    try:
+        process = subprocess.run(["git", "-C", directory] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return process.stdout.decode('utf-8', errors='replace')
+
+def git_toplevel(path):
+    """
+    Returns the top directory of the git repository holding path, or None.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in _toplevels:
+        output = _git(directory, "rev-parse", "--show-toplevel")
+        _toplevels[directory] = os.path.normpath(output.strip()) if output \
+            else None
+    return _toplevels[directory]
+
+def git_revision(repository, revision="HEAD"):
+    """
+    Returns the commit hash of revision in the repository, or None if there
+    is no such revision.
+    """
+    output = _git(repository, "rev-parse", "--verify", "--quiet",
+        revision + "^{commit}")
+    return output.strip() if output else None
+
+def changed_files(repository, revision):
+    """
+    Returns the set of the (absolute) paths of the files that differ from
+    revision in the working tree of the repository: changes committed
+    since, staged or not, and files git does not track yet. Renamed files
+    count under both names. Raises a ValueError if there is no such
+    revision.
+    """
+    if git_revision(repository, revision) is None:
+        raise ValueError("Unknown revision {} in {}".format(revision,
+            repository))
+    diff = _git(repository, "diff", "--name-only", "--no-renames", "-z",
+        revision, "--") or ""
+    untracked = _git(repository, "ls-files", "--others", "--exclude-standard",
+        "-z") or ""
+    return set(os.path.normpath(os.path.join(repository, name))
+        for name in (diff + untracked).split("\0") if name)
+
+
+# Deciding what to convert.
+# -------------------------------------------------------------------
+
+def rules_key(job):
+    """
+    A hash of the rules and the steps of a job. Plugins named in the rules
+    are hashed by name only.
+    """
+    data = json.dumps([job.rules, job.steps], sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def converter_key():
+    """
+    A hash of the code of the CONVERTER_MODULES.
+    """
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in CONVERTER_MODULES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def _read_key(path):
+    with open(path, 'r') as f:
+        return _text_key(f.read())
+
+def plan_changes(jobs, cache, since=None, rule_files=()):
+    """
+    Returns a ChangePlan with the jobs that have to be converted again.
+    A job is converted when its output is missing, its rules or the
+    converter changed since its conversion was last recorded in the
+    ConversionCache (see "record_conversions"), or git lists its input as
+    changed since the revision recorded then. Inputs that git lists but
+    whose contents are still those that were converted are skipped.
+
+    With since, inputs are compared with that revision instead (in the
+    repository of each input), and jobs without a record are only
+    converted if their input or one of the rule_files (the manifest, for
+    example) changed since. Jobs of a bundle are converted together, as
+    the bundle is written from all of them.
+    """
+    converter = converter_key()
+    changes = {}
+    reasons = [None] * len(jobs)
+
+    def changed(path, revision):
+        repository = git_toplevel(path)
+        if repository is None:
+            return None
+        key = (repository, revision)
+        if key not in changes:
+            changes[key] = changed_files(repository, revision)
+        return os.path.normpath(os.path.abspath(path)) in changes[key]
+
+    rules_changed = since is not None and any(changed(path, since) is not False
+        for path in rule_files)
+
+    for i, job in enumerate(jobs):
+        record = cache.conversion(job.output_file)
+        if not os.path.exists(job.output_file):
+            reasons[i] = "no output"
+        elif record is None and since is None:
+            reasons[i] = "not recorded"
+        elif record is not None and record["rules"] != rules_key(job):
+            reasons[i] = "rules changed"
+        elif record is not None and record["converter"] != converter:
+            reasons[i] = "converter changed"
+        elif record is None and rules_changed:
+            reasons[i] = "rules changed"
+        else:
+            revision = since or record["revision"]
+            input_changed = changed(job.input_file, revision) if revision else None
+            if input_changed is None:
+                reasons[i] = "not in git"
+            elif input_changed and (record is None or
+                    record["input"] != _read_key(job.input_file)):
+                reasons[i] = "input changed"
+
+    bundles = set(job.rules.get("bundle") for job, reason in zip(jobs, reasons)
+        if reason) - set([None])
+    for i, job in enumerate(jobs):
+        if reasons[i] is None and job.rules.get("bundle") in bundles:
+            reasons[i] = "bundle changed"
+    return ChangePlan([job for job, reason in zip(jobs, reasons) if reason],
+        [reason for reason in reasons if reason],
+        [job for job, reason in zip(jobs, reasons) if not reason])
+
+def record_conversions(cache, results):
+    """
+    Records in the ConversionCache what the results were converted from:
+    the revision of the repository of the input, the contents of the
+    input, the rules and the converter.
+    """
+    converter = converter_key()
+    revisions = {}
+    for result in results:
+        repository = git_toplevel(result.job.input_file)
+        if repository not in revisions:
+            revisions[repository] = git_revision(repository) if repository \
+                else None
+        cache.record_conversion(result.job.output_file, {
+            "revision": revisions[repository],
+            "input": _read_key(result.job.input_file),
+            "rules": rules_key(result.job),
+            "converter": converter })
+
+def format_plan(plan):
+    """
+    Returns a summary of the files converted and skipped.
+    """
+    lines = ["Converting {} of {} files ({} unchanged, skipped)".format(
+        len(plan.convert), len(plan.convert) + len(plan.skipped),
+        len(plan.skipped))]
+    for job, reason in zip(plan.convert, plan.reasons):
+        lines.append("  {:<18} {}".format(reason,
+            os.path.relpath(job.input_file)))
+    return "\n".join(lines)
@@ -0,0 +1,348 @@
+import os, re, sys, json, time, fnmatch, argparse
+from collections import namedtuple
+from multiprocessing import Pool
+
+from convert import Converter
+
+
+
+# The names of the files that look like self-tests.
+DEFAULT_PATTERNS = ["test_*.c", "*_test.c", "*-test.c", "*selftest*.c"]
+
+# Directories of a kernel tree that hold no test modules.
+SKIPPED_DIRECTORIES = set([".git", "Documentation", "scripts", "tools", "usr"])
+
+# How a file runs its tests, from the hardest to convert to the easiest:
+#     "ktf"           : the file uses KTF already (a converted file, for
+#                       example), so there is nothing to convert
+#     "unconvertible" : no init function the converter can find
+#     "inline"        : the init function is the test (see test_sort.c)
+#     "multi_arg"     : the init function calls the tests, some of them
+#                       with extra arguments (see test_xarray.c)
+#     "shared_args"   : the tests all take the same arguments
+#     "void"          : the tests take no arguments
+KINDS = ["ktf", "unconvertible", "inline", "multi_arg", "shared_args", "void"]
+
+# The scan of one file. "traits" are extra findings that matter for the
+# conversion ("custom_assertions": assertion macros defined by the file;
+# "needs_context": the tests share an argument that has to come from a KTF
+# context). "report" is the result of "Converter.inspect", and "rules" and
+# "steps" the drafted rules dictionary and chain of steps (None for the
+# "ktf" and "unconvertible" kinds).
+FileScan = namedtuple('FileScan', 'path kind traits report rules steps')
+
+# Assertion macros that fail when their last argument is true, and so
+# become EXPECT_FALSE.
+_bug_on_macro = re.compile(r"(?:\w+_)?(?:BUG_ON|WARN_ON|WARN_ON_ONCE)$")
+_macro_definition = r"^[ \t]*#[ \t]*define[ \t]+{name}\(([^)]*)\)"
+
+
+# Finding the files.
+# -------------------------------------------------------------------
+
+def find_candidates(root, patterns=DEFAULT_PATTERNS):
+    """
+    Returns the paths of the files under root whose names match one of the
+    patterns, leaving out the directories that hold no test modules.
+    """
+    paths = []
+    for directory, directories, files in os.walk(root):
+        directories[:] = sorted(d for d in directories
+            if d not in SKIPPED_DIRECTORIES)
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                paths.append(os.path.join(directory, name))
+    return paths
+
+
+# Classifying the files and drafting their rules.
+# -------------------------------------------------------------------
+
+def _parameters(text, name):
+    match = re.search(r"\b{}\s*\(([^)]*)\)\s*{{".format(re.escape(name)), text)
+    if not match:
+        return []
+    return [p.strip() for p in match.group(1).split(",") if p.strip()]
+
+def _escape(text):
+    """
+    Escapes the regex characters in text the way the wrappers do: "*" as
+    "[*]", and nothing that has no special meaning (unlike re.escape).
+    """
+    return "".join("[*]" if c == "*" else "\\" + c if c in ".^$+?()[]{}|\\"
+        else c for c in text)
+
+def _parameter_pattern(parameter):
+    """
+    The regex for a parameter in the "context_args" rule, for example
+    "struct xarray *xa" -> "struct xarray [*]xa".
+    """
+    return _escape(re.sub(r"\s+", " ", parameter))
+
+def classify(report, text):
+    """
+    Returns the kind of a file (see KINDS) and its traits, from its
+    "Converter.inspect" report.
+    """
+    traits = []
+    if "ktf.h" in text or "KTF_INIT" in text:
+        return "ktf", traits
+    if any(re.search(_macro_definition.format(name=re.escape(name)), text,
+            re.MULTILINE) for name in report["assertions"]):
+        traits.append("custom_assertions")
+    init = report["module_init"]
+    if not init or init not in report["functions"]:
+        return "unconvertible", traits
+    if report["test_functions"] == [init]:
+        return "inline", traits
+    if report["common_args"]:
+        traits.append("needs_context")
+    if report["multi_arg_calls"]:
+        return "multi_arg", traits
+    if report["common_args"]:
+        return "shared_args", traits
+    return "void", traits
+
+def _replacements(report, text):
+    """
+    Replacements turning the BUG_ON style macros into EXPECT_FALSE. For the
+    macros the file defines, the arguments before the condition are dropped.
+    """
+    replacements = []
+    for name in sorted(report["assertions"]):
+        if not _bug_on_macro.match(name):
+            continue
+        definition = re.search(_macro_definition.format(name=re.escape(name)),
+            text, re.MULTILINE)
+        leading = len(definition.group(1).split(",")) - 1 if definition else 0
+        replacements.append((r"(^\s*)(" + name + r"[(]" + r"[^,]*, *" * leading + ")",
+            r"\g<1>EXPECT_FALSE("))
+    return replacements
+
+def _blacklist(report, text):
+    """
+    The helpers that are used other than by calling them (like the
+    comparison function given to sort()), which must keep their signature.
+    """
+    return [name for name in report["helpers"] if re.search(
+        r"\b{}\b(?!\s*\()".format(re.escape(name)), text)]
+
+def draft_rules(path, report, text, kind):
+    """
+    Returns a rules dictionary and a chain of steps for the file, in the
+    format of the convert_wrapper_*.py files, or (None, None) if it uses
+    KTF already or is unconvertible. The drafts cover the tests, helpers
+    and assertions; a file whose tests share an argument also needs the
+    KTF context code ("init_code", "new_types", "boilerplate_code"), which
+    is left to the reviewer.
+    """
+    if kind in ("ktf", "unconvertible"):
+        return None, None
+    stem = os.path.splitext(os.path.basename(path))[0]
+    rules = {
+        "test_functions": report["test_functions"],
+        "test_suite_name": stem + "_rewrite",
+        "blacklist": _blacklist(report, text),
+        "replacements": _replacements(report, text),
+    }
+    steps = ["add_include_code", "add_init_code_to_main", "add_exit_code",
+        "convert_to_test_common_args"]
+    if kind == "inline":
+        rules["should_add_new_main"] = True
+        return rules, steps + ["use_replacements"]
+
+    if report["common_args"]:
+        parameters = []
+        for name in report["test_functions"]:
+            parameters = _parameters(text, name)
+            if parameters and parameters != ["void"]:
+                break
+        if parameters:
+            rules["context_args"] = _parameter_pattern(parameters[0]) + "|void"
+            rules["extra_dummy_args_call"] = re.findall(r"\w+", parameters[0])[-1]
+        rules["common_call_args"] = ", ".join(_escape(arg)
+            for arg in report["common_args"])
+    if kind == "multi_arg":
+        steps.append("convert_to_test_extra_args")
+    steps += ["convert_calls_to_add_test",
+        "add_extra_parameters_to_helpers_and_multi_arg_defs",
+        "add_self_argument_to_helper_calls", "use_replacements"]
+    return rules, steps
+
+def scan_file(path):
+    """
+    Returns the FileScan of one file, or None if it is not a kernel module
+    (it has no module_init).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if b"module_init" not in data:
+        return None
+    text = data.decode('utf-8', errors='replace')
+    report = Converter(path, None, {}, text=text).inspect()
+    kind, traits = classify(report, text)
+    rules, steps = draft_rules(path, report, text, kind)
+    return FileScan(path, kind, traits, report, rules, steps)
+
+def scan_tree(root, patterns=DEFAULT_PATTERNS, processes=None):
+    """
+    Scans the candidate files under root with a pool of processes, and
+    returns the FileScans of the modules among them, sorted by path.
+    """
+    paths = find_candidates(root, patterns)
+    with Pool(processes) as pool:
+        scans = [scan for scan in pool.imap_unordered(scan_file, paths,
+            chunksize=16) if scan is not None]
+    return sorted(scans, key=lambda scan: scan.path)
+
+
+# Writing the drafts.
+# -------------------------------------------------------------------
+
+def _literal(value, indent):
+    if isinstance(value, str):
+        if "\\" in value and '"' not in value and not value.endswith("\\"):
+            return 'r"{}"'.format(value)
+        return json.dumps(value)
+    if isinstance(value, tuple):
+        return "(" + ", ".join(_literal(v, indent) for v in value) + ")"
+    if isinstance(value, list) and value and isinstance(value[0], tuple):
+        return "[\n" + ",\n".join(" " * (indent + 4) + _literal(v, indent + 4)
+            for v in value) + "\n" + " " * indent + "]"
+    if isinstance(value, list):
+        return "[" + ", ".join(_literal(v, indent) for v in value) + "]"
+    return repr(value)
+
+def _rule(key, value):
+    """
+    A line of the rules dictionary. Long lists go on lines of their own,
+    like in convert_wrapper_xarray.py.
+    """
+    line = '    "{}": {},'.format(key, _literal(value, 4))
+    if len(line) <= 80 or not isinstance(value, list) or \
+            isinstance(value[0], tuple):
+        return line
+    lines, line = [], "        ["
+    for i, item in enumerate(value):
+        item = _literal(item, 8) + ("," if i < len(value) - 1 else "],")
+        if len(line) + len(item) >= 80:
+            lines.append(line.rstrip())
+            line = "        "
+        line += item + " "
+    lines.append(line.rstrip())
+    return '    "{}":\n'.format(key) + "\n".join(lines)
+
+def format_wrapper(scan):
+    """
+    Returns the text of a convert_wrapper_*.py file for the draft rules of
+    the scan.
+    """
+    directory = os.path.abspath(os.path.dirname(scan.path)) + "/"
+    stem = os.path.splitext(os.path.basename(scan.path))[0]
+    target = stem + "_rewrite.c"
+    variable = re.sub(r"\W", "_", stem) + "_rules"
+    title = '| Conversion rules for "{}" |'.format(target)
+    lines = [
+        "from convert import Converter",
+        "",
+        'source_directory = "{}"'.format(directory),
+        'source_file_name = "{}"'.format(os.path.basename(scan.path)),
+        'target_file_name = "{}"'.format(target),
+        "full_source_path = source_directory + source_file_name",
+        "full_target_path = source_directory + target_file_name",
+        "",
+        'print("Converting " + source_file_name)',
+        'print("Input file path: " + full_source_path)',
+        'print("Output path: " + full_target_path)',
+        "", "", "",
+        "# |" + "-" * (len(title) - 2) + "|",
+        "# " + title,
+        "# |" + "-" * (len(title) - 2) + "|",
+        "",
+        "# Draft written by kernel_scan.py: {}{}. Review before use.".format(
+            scan.kind, "".join(", " + trait for trait in scan.traits)),
+        "",
+        variable + " = {",
+    ]
+    for key, value in scan.rules.items():
+        lines.append(_rule(key, value))
+        lines.append("")
+    lines[-1] = "}"
+    lines += ["", "state = Converter(full_source_path, full_target_path, {}, True)"
+        .format(variable)]
+    chain = ["state." + scan.steps[0] + "()"] + \
+        ["    ." + step + "()" for step in scan.steps[1:]] + ["    .result()"]
+    lines.append(" \\\n".join(chain))
+    return "\n".join(lines) + "\n"
+
+def write_drafts(scans, directory):
+    """
+    Writes a convert_wrapper_<name>.py file into directory for every
+    convertible scan. Returns the paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for scan in scans:
+        if scan.rules is None:
+            continue
+        stem = os.path.splitext(os.path.basename(scan.path))[0]
+        path = os.path.join(directory, "convert_wrapper_{}.py".format(stem))
+        with open(path, 'w') as f:
+            f.write(format_wrapper(scan))
+        paths.append(path)
+    return paths
+
+def draft_manifest(scans):
+    """
+    Returns a manifest (see batch.load_manifest) that converts every
+    convertible file with its draft rules, next to the original.
+    """
+    return [{"input": os.path.abspath(scan.path),
+        "output": os.path.splitext(os.path.abspath(scan.path))[0] + "_rewrite.c",
+        "rules": scan.rules, "steps": scan.steps}
+        for scan in scans if scan.rules is not None]
+
+def format_summary(scans, seconds):
+    lines = ["Scanned {} modules in {:.2f}s".format(len(scans), seconds)]
+    for kind in KINDS:
+        count = sum(1 for scan in scans if scan.kind == kind)
+        lines.append("  {:<14} {:>5}".format(kind, count))
+    for scan in scans:
+        lines.append("{:<14} {:>3} tests  {}{}".format(scan.kind,
+            len(scan.report["test_functions"]), scan.path,
+            "".join(" [" + trait + "]" for trait in scan.traits)))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Scans a kernel source tree for self-test modules, '
+                    'classifies how they run their tests and drafts '
+                    'conversion rules for them.')
+    parser.add_argument('root')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-p', '--pattern', dest='patterns', action='append',
+        help='file name pattern of the candidates (default: {})'.format(
+            " ".join(DEFAULT_PATTERNS)))
+    parser.add_argument('-w', '--wrappers', action='store',
+        help='directory to write draft convert_wrapper_*.py files to')
+    parser.add_argument('-m', '--manifest', action='store',
+        help='file to write a manifest converting the files with the drafts to')
+    parser.add_argument('--json', action='store_true',
+        help='print the scans as JSON instead of a summary')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scans = scan_tree(args.root, args.patterns or DEFAULT_PATTERNS, args.jobs)
+    seconds = time.perf_counter() - start
+    if args.wrappers:
+        write_drafts(scans, args.wrappers)
+    if args.manifest:
+        with open(args.manifest, 'w') as f:
+            json.dump(draft_manifest(scans), f, indent=1)
+    if args.json:
+        json.dump([scan._asdict() for scan in scans], sys.stdout, indent=1)
+        sys.stdout.write("\n")
+    else:
+        print(format_summary(scans, seconds))
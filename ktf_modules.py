@@ -0,0 +1,447 @@
+import os, re
+from collections import namedtuple
+
+
+
+# A top-level piece of a C file. "kind" is "function", "test" (a function
+# defined with the TEST macro) or "glue" (everything else: includes, types,
+# globals, prototypes, module_init...). "name" is the function or test name
+# ("" for glue), and "refs" the set of identifiers used in the text.
+Item = namedtuple('Item', 'kind name text refs')
+
+# The start of a function definition at the beginning of a line, up to and
+# including the opening brace. TEST(...) definitions match as well.
+function_header = re.compile(
+    r"^(?:[A-Za-z_][\w \t*]*?[ \t*])?(\w+)\s*\(((?:[^;{}()]|\([^;{}()]*\))*)\)\s*{",
+    re.MULTILINE)
+test_header = re.compile(r"TEST\(\s*(\w+)\s*,\s*(\w+)\s*\)")
+identifier = re.compile(r"\b[A-Za-z_]\w*\b")
+module_init_call = re.compile(r"module_init\((\w+)\);")
+module_exit_call = re.compile(r"module_exit\((\w+)\);")
+add_test_line = re.compile(r"^[ \t]*ADD_(?:LOOP_)?TEST\((\w+)[^;]*\);[ \t]*\n", re.MULTILINE)
+obj_m_line = re.compile(r"^(obj-m\s*[:+]?=)(.*)$", re.MULTILINE)
+# What "matching_brace" looks at: braces, and the comments, strings and
+# character literals whose braces don't count. The "_end" groups are None
+# if the comment or string is not closed.
+_brace_tokens = re.compile(r"""
+    (?P<open>{) | (?P<close>})
+  | (?P<block>/\*(?:.*?(?P<block_end>\*/))?)
+  | (?P<line>//[^\n]*(?P<line_end>\n)?)
+  | (?P<string>"(?:\\.|[^"\\])*(?P<string_end>")?)
+  | (?P<char>'(?:\\.|[^'\\])*(?P<char_end>')?)
+""", re.DOTALL | re.VERBOSE)
+# What "call_span" looks at: brackets, commas and semicolons, and the
+# strings and character literals they don't count in.
+_call_tokens = re.compile(r"""[()\[\],;]|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'""")
+
+
+# Parsing.
+# -------------------------------------------------------------------
+
+def matching_brace(text, open_index):
+    """
+    Returns the index of the } that closes the { at open_index in the
+    text, or -1 if there is none. Braces inside comments, strings and
+    character literals are skipped.
+    """
+    depth = 0
+    for match in _brace_tokens.finditer(text, open_index):
+        token = match.lastgroup
+        if token == "open":
+            depth += 1
+        elif token == "close":
+            depth -= 1
+            if depth == 0:
+                return match.start()
+        elif match.group(token + "_end") is None:
+            # A comment or string that is never closed.
+            break
+    return -1
+
+def call_span(text, open_index):
+    """
+    Returns the arguments of the call whose ( is at open_index, split at
+    the commas that are not nested in parentheses or inside strings, and
+    the index of the closing ). Returns None if the call is not closed
+    before a ;.
+    """
+    depth = 0
+    args = []
+    start = open_index + 1
+    for match in _call_tokens.finditer(text, open_index):
+        c = match.group()
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+            if depth == 0:
+                args.append(text[start:match.start()].strip())
+                return [arg for arg in args if arg], match.start()
+        elif c == "," and depth == 1:
+            args.append(text[start:match.start()].strip())
+            start = match.end()
+        elif c == ";":
+            break
+    return None
+
+def call_arguments(text, open_index):
+    """
+    Same as "call_span", but only returns the arguments (or None).
+    """
+    span = call_span(text, open_index)
+    return span and span[0]
+
+def _item(kind, name, text):
+    return Item(kind, name, text, set(identifier.findall(text)))
+
+def split_top_level(text):
+    """
+    Splits a C file into a list of Items. Joining the texts of the items
+    gives back the original text.
+    """
+    items = []
+    pos = 0
+    while True:
+        match = function_header.search(text, pos)
+        if not match:
+            break
+        close = matching_brace(text, match.end() - 1)
+        if close < 0:
+            break
+        if match.start() > pos:
+            items.append(_item("glue", "", text[pos:match.start()]))
+        # Keep the newline after the closing brace with the function.
+        end = close + 1
+        if text.startswith("\n", end):
+            end += 1
+        test = test_header.match(text, match.start())
+        if test:
+            items.append(_item("test", test.group(2), text[match.start():end]))
+        else:
+            items.append(_item("function", match.group(1), text[match.start():end]))
+        pos = end
+    if pos < len(text):
+        items.append(_item("glue", "", text[pos:]))
+    return items
+
+def module_functions(text):
+    """
+    Returns the names of the init and exit functions of the module (either
+    can be None).
+    """
+    init = module_init_call.search(text)
+    exit = module_exit_call.search(text)
+    return init and init.group(1), exit and exit.group(1)
+
+def keep_added_tests(text, tests):
+    """
+    Removes the ADD_TEST/ADD_LOOP_TEST lines for tests that are not in the
+    "tests" set.
+    """
+    return add_test_line.sub(
+        lambda m: m.group(0) if m.group(1) in tests else "", text)
+
+def reachable_functions(items, roots):
+    """
+    Returns the names of the functions used, directly or indirectly, by
+    the identifiers in "roots". Identifiers count as uses even when they
+    are not calls, so functions passed as pointers (like the comparison
+    function given to sort()) are kept too.
+    """
+    functions = dict((item.name, item) for item in items if item.kind == "function")
+    reached = set()
+    todo = [name for name in roots if name in functions]
+    while todo:
+        name = todo.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+        todo.extend(r for r in functions[name].refs
+            if r in functions and r not in reached)
+    return reached
+
+
+# Sharding one suite into several modules.
+# -------------------------------------------------------------------
+
+def _test_groups(tests):
+    """
+    Groups the TEST functions so that tests that refer to each other end
+    up in the same group (and therefore in the same shard).
+    """
+    names = [t.name for t in tests]
+    parent = dict((n, n) for n in names)
+
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    for test in tests:
+        for ref in test.refs:
+            if ref in parent and ref != test.name:
+                parent[find(ref)] = find(test.name)
+    groups = {}
+    for test in tests:
+        groups.setdefault(find(test.name), []).append(test)
+    return list(groups.values())
+
+def shard_suite(text, count):
+    """
+    Splits a converted file into "count" module sources. Every TEST function
+    ends up in exactly one shard, and the shards are balanced on the size
+    of the tests (longest first, each to the least loaded shard). Each
+    shard keeps:
+        - all the glue (includes, types, globals, KTF_INIT, module_init),
+        - the init and exit functions, with only the ADD_TEST calls for
+          its own tests,
+        - the helper functions reachable from what it keeps.
+    The TEST suite of shard k is renamed to "<suite>_shard<k>", so the
+    shards can be loaded side by side. Returns the list of sources (fewer
+    than "count" if there are not enough tests).
+    """
+    items = split_top_level(text)
+    init_name, exit_name = module_functions(text)
+    tests = [item for item in items if item.kind == "test"]
+    groups = sorted(_test_groups(tests),
+        key=lambda g: -sum(len(t.text) for t in g))
+    count = max(1, min(count, len(groups)))
+
+    shards = [set() for _ in range(count)]
+    loads = [0] * count
+    for group in groups:
+        k = loads.index(min(loads))
+        shards[k].update(t.name for t in group)
+        loads[k] += sum(len(t.text) for t in group)
+
+    sources = []
+    for k, shard_tests in enumerate(shards):
+        kept = []
+        for item in items:
+            if item.kind == "test" and item.name not in shard_tests:
+                continue
+            if item.kind == "function" and item.name == init_name:
+                item = _item("function", item.name,
+                    keep_added_tests(item.text, shard_tests))
+            kept.append(item)
+        roots = set()
+        for item in kept:
+            if item.kind != "function" or item.name in (init_name, exit_name):
+                roots.update(item.refs)
+        reached = reachable_functions(kept, roots)
+        source = "".join(item.text for item in kept
+            if item.kind != "function" or item.name in reached or
+            item.name in (init_name, exit_name))
+        sources.append(test_header.sub(
+            lambda m: "TEST({}_shard{}, {})".format(m.group(1), k + 1, m.group(2)),
+            source))
+    return sources
+
+def shard_paths(output_file, count):
+    """
+    Returns the file names used for the shards of output_file:
+    "dir/name.c" -> "dir/name_shard1.c", "dir/name_shard2.c", ...
+    """
+    root, ext = os.path.splitext(output_file)
+    return ["{}_shard{}{}".format(root, k + 1, ext) for k in range(count)]
+
+
+# Makefiles.
+# -------------------------------------------------------------------
+
+def replace_objects(makefile_text, old_object, new_objects):
+    """
+    Replaces old_object (like "test_xarray_rewrite.o") in the obj-m lines
+    of a kbuild makefile with the new objects. If old_object is not listed,
+    the new objects are appended to the first obj-m line.
+    """
+    matches = list(obj_m_line.finditer(makefile_text))
+    if not matches:
+        return makefile_text + "\nobj-m := {}\n".format(" ".join(new_objects))
+    replaced = [False]
+
+    def replace(match):
+        objects = match.group(2).split()
+        if old_object in objects:
+            i = objects.index(old_object)
+            objects[i:i + 1] = [o for o in new_objects if o not in objects]
+            replaced[0] = True
+        return "{} {}".format(match.group(1), " ".join(objects))
+
+    text = obj_m_line.sub(replace, makefile_text)
+    if not replaced[0]:
+        first = matches[0]
+        objects = first.group(2).split() + \
+            [o for o in new_objects if o not in first.group(2).split()]
+        text = makefile_text[:first.start()] + "{} {}".format(
+            first.group(1), " ".join(objects)) + makefile_text[first.end():]
+    return text
+
+def update_makefile(output_file, new_files, replaced_files=None):
+    """
+    Updates the Makefile.in next to output_file (if there is one), so that
+    its obj-m lists the new files instead of the replaced files (by default
+    output_file itself). Returns True if the makefile was changed.
+    """
+    makefile = os.path.join(os.path.dirname(os.path.abspath(output_file)), "Makefile.in")
+    if not os.path.exists(makefile):
+        return False
+    object_name = lambda f: os.path.splitext(os.path.basename(f))[0] + ".o"
+    old_objects = [object_name(f) for f in replaced_files or [output_file]]
+    new_objects = [object_name(f) for f in new_files]
+    with open(makefile, 'r') as f:
+        text = f.read()
+    new_text = replace_objects(text, old_objects[0], new_objects)
+    for old_object in old_objects[1:]:
+        new_text = replace_objects(new_text, old_object, [])
+    if new_text == text:
+        return False
+    with open(makefile, 'w') as f:
+        f.write(new_text)
+    return True
+
+
+# Bundling several suites into one module.
+# -------------------------------------------------------------------
+
+define_line = re.compile(r"^[ \t]*#[ \t]*define[ \t]+(\w+)", re.MULTILINE)
+struct_tag = re.compile(r"\b(?:struct|union|enum)[ \t]+(\w+)\s*{")
+global_name = re.compile(
+    r"^(?:static|const|struct|unsigned|int|long|char|bool|u8|u16|u32|u64)\b[^;=(]*?\b(\w+)\s*(?:\[[^\]]*\]\s*)*[;=]"
+    r"|^static\s+DEFINE_\w+\((\w+)", re.MULTILINE)
+ktf_init_line = re.compile(r"^[ \t]*KTF_INIT\(\);[ \t]*\n", re.MULTILINE)
+ktf_cleanup_line = re.compile(r"^[ \t]*KTF_CLEANUP\(\);[ \t]*\n?", re.MULTILINE)
+module_call_line = re.compile(r"^[ \t]*module_(?:init|exit)\(\w+\);[ \t]*\n?", re.MULTILINE)
+module_license_line = re.compile(r"^[ \t]*MODULE_LICENSE\(.*\);[ \t]*\n?", re.MULTILINE)
+
+# Templates for the combined init and exit functions of a bundle.
+bundle_init_call = "\terr = {init}();\n\tif (err)\n\t\tgoto {label};\n"
+bundle_undo = "{label}:\n\t{exit}();\n"
+bundle_init_and_exit = """
+static int {name}_init(void)
+{{
+\tint err;
+
+{calls}
+\treturn 0;
+
+{undo}out:
+\tKTF_CLEANUP();
+\treturn err;
+}}
+
+static void {name}_exit(void)
+{{
+{exits}\tKTF_CLEANUP();
+}}
+
+module_init({name}_init);
+module_exit({name}_exit);
+{license}"""
+
+def defined_names(text):
+    """
+    Returns the names defined at the top level of a converted file:
+    functions, TEST functions, macros, struct/union/enum tags and global
+    variables.
+    """
+    names = set()
+    for item in split_top_level(text):
+        if item.kind == "glue":
+            names.update(define_line.findall(item.text))
+            names.update(struct_tag.findall(item.text))
+            for match in global_name.finditer(item.text):
+                names.add(match.group(1) or match.group(2))
+        else:
+            names.add(item.name)
+            names.update(define_line.findall(item.text))
+    return names
+
+def rename_identifiers(text, renames):
+    """
+    Renames whole identifiers in text, using the renames dict.
+    """
+    if not renames:
+        return text
+    pattern = re.compile(r"\b(" + "|".join(
+        re.escape(name) for name in sorted(renames, key=len, reverse=True)) + r")\b")
+    return pattern.sub(lambda m: renames[m.group(1)], text)
+
+def bundle_suites(sources, name):
+    """
+    Merges several converted files into the source of a single module
+    called "name". "sources" is a list of (tag, text), where the tag (like
+    the file name without extension) is used to rename names that are
+    defined by more than one file: "cmpint" becomes "cmpint_<tag>". The
+    module_init/module_exit calls, KTF_INIT and KTF_CLEANUP of the files
+    are replaced by one KTF_INIT, and a combined init function that calls
+    the init function of every suite in turn (undoing the earlier ones if
+    one fails), and a combined exit function.
+    """
+    defined = [defined_names(text) for tag, text in sources]
+    counts = {}
+    for names in defined:
+        for n in names:
+            counts[n] = counts.get(n, 0) + 1
+    # Names the bundle itself defines must not be used by any suite.
+    counts["{}_init".format(name)] = counts["{}_exit".format(name)] = 2
+
+    parts, suites = [], []
+    license = None
+    for k, ((tag, text), names) in enumerate(zip(sources, defined)):
+        renames = dict((n, "{}_{}".format(n, tag)) for n in names if counts.get(n, 0) > 1)
+        init_name, exit_name = module_functions(text)
+        license_match = module_license_line.search(text)
+        if license is None and license_match:
+            license = license_match.group(0).strip() + "\n"
+        text = module_call_line.sub("", text)
+        text = module_license_line.sub("", text)
+        text = ktf_cleanup_line.sub("", text)
+        if k > 0:
+            text = ktf_init_line.sub("", text)
+        parts.append("/* ---- {} ---- */\n\n{}\n".format(tag, rename_identifiers(text, renames).strip()))
+        suites.append((tag, init_name and renames.get(init_name, init_name),
+            exit_name and renames.get(exit_name, exit_name)))
+
+    # When the init function of a suite fails, the suites before it are
+    # undone in reverse order, by jumping to the label of the last suite
+    # that has an exit function.
+    calls, undo = "", ""
+    label = "out"
+    pending_undo = ""
+    for tag, init, exit in suites:
+        if init:
+            calls += bundle_init_call.format(init=init, label=label)
+            # Only labels that some goto jumps to are emitted.
+            undo = pending_undo + undo
+            pending_undo = ""
+        if exit:
+            pending_undo = bundle_undo.format(label="undo_" + tag, exit=exit)
+            label = "undo_" + tag
+    exits = "".join("\t{}();\n".format(exit)
+        for tag, init, exit in reversed(suites) if exit)
+    return "\n".join(parts) + bundle_init_and_exit.format(name=name,
+        calls=calls, undo=undo, exits=exits,
+        license=license or 'MODULE_LICENSE("GPL");\n')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Bundles several converted files into a single KTF module.')
+    parser.add_argument('inputs', nargs='+', help='converted files to bundle')
+    parser.add_argument('-o', '--out', required=True,
+        help='the file to write; its name (without .c) is the module name')
+    args = parser.parse_args()
+
+    sources = []
+    for path in args.inputs:
+        with open(path, 'r') as f:
+            sources.append((os.path.splitext(os.path.basename(path))[0], f.read()))
+    module_name = os.path.splitext(os.path.basename(args.out))[0]
+    with open(args.out, 'w') as f:
+        f.write(bundle_suites(sources, module_name))
+    update_makefile(args.out, [args.out], args.inputs)
+    print("Bundled {} files into {}".format(len(sources), args.out))
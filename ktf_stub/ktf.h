@@ -0,0 +1,135 @@
+/*
+ * A stand-in for the Kernel Test Framework header, used to check the
+ * converted test files outside of kbuild (see compile_check.py), and to run
+ * them as normal processes with the runtime in ktf_runtime.c (see
+ * run_native.py).
+ *
+ * Only the parts of the KTF API that the converter generates, or that the
+ * converted suites use, are provided. The headers in ktf_stub/linux/ are
+ * equally minimal stand-ins for the kernel headers: they only declare the
+ * few kernel APIs used by the pure-logic suites (test_sort, test_string).
+ * Files that need more of the kernel (xarray, rhashtable, ntb) will fail
+ * the check on the missing headers.
+ */
+#ifndef KTF_STUB_H
+#define KTF_STUB_H
+
+#include <linux/types.h>
+#include <linux/kernel.h>
+
+struct ktf_context {
+	const char *name;
+	struct ktf_context *next;
+};
+
+struct ktf_test {
+	const char *suite;
+	const char *name;
+	int asserts;
+	int failures;
+};
+
+typedef void (*ktf_test_fun)(struct ktf_test *self, struct ktf_context *ctx,
+			     int _i, u32 _value);
+
+struct ktf_test_case {
+	const char *suite;
+	const char *name;
+	ktf_test_fun fun;
+};
+
+void ktf_add_test(struct ktf_test_case *tc, int from, int to);
+int ktf_assert(struct ktf_test *self, int ok, const char *expr,
+	       const char *file, int line);
+void ktf_context_add(struct ktf_context *ctx, const char *name);
+struct ktf_context *ktf_context_find(const char *name);
+void ktf_context_remove(struct ktf_context *ctx);
+void ktf_cleanup(void);
+void ktf_log(int level, const char *fmt, ...)
+	__attribute__((format(printf, 2, 3)));
+
+/* Test definition and registration */
+
+#define TEST(__suite, __name) \
+	static void __name(struct ktf_test *self, struct ktf_context *ctx, \
+			   int _i, u32 _value); \
+	static struct ktf_test_case __ktf_case_##__name \
+		__attribute__((unused)) = { #__suite, #__name, __name }; \
+	static void __name(struct ktf_test *self, struct ktf_context *ctx, \
+			   int _i, u32 _value)
+
+#define ADD_TEST(__name)	ktf_add_test(&__ktf_case_##__name, 0, 1)
+#define ADD_LOOP_TEST(__name, __from, __to) \
+	ktf_add_test(&__ktf_case_##__name, __from, __to)
+
+#define KTF_INIT()		extern int ktf_stub_initialized
+#define KTF_CLEANUP()		ktf_cleanup()
+
+/* Contexts */
+
+#define KTF_CONTEXT_ADD(__ctx, __name)	ktf_context_add(__ctx, __name)
+#define KTF_CONTEXT_FIND(__name)	ktf_context_find(__name)
+#define KTF_CONTEXT_GET(__name, __type) \
+	container_of(ktf_context_find(__name), __type, k)
+#define KTF_CONTEXT_REMOVE(__ctx)	ktf_context_remove(__ctx)
+
+/* Logging */
+
+#define T_ERROR		1
+#define T_INFO		2
+#define T_DEBUG		3
+
+#define tlog(__level, __fmt, ...)	ktf_log(__level, __fmt, ##__VA_ARGS__)
+
+/* Assertions */
+
+#define __ktf_check(__ok, __expr) \
+	ktf_assert(self, !!(__ok), __expr, __FILE__, __LINE__)
+#define __ktf_true(c)		__ktf_check(c, #c)
+#define __ktf_false(c)		__ktf_check(!(c), "!(" #c ")")
+#define __ktf_int(a, op, b)	__ktf_check((long)(a) op (long)(b), #a " " #op " " #b)
+#define __ktf_ok_addr(p) \
+	__ktf_check((p) && (unsigned long)(p) < (unsigned long)-4095, #p)
+
+#define EXPECT_TRUE(c)		((void)__ktf_true(c))
+#define EXPECT_FALSE(c)		((void)__ktf_false(c))
+#define EXPECT_INT_EQ(a, b)	((void)__ktf_int(a, ==, b))
+#define EXPECT_INT_NE(a, b)	((void)__ktf_int(a, !=, b))
+#define EXPECT_INT_LT(a, b)	((void)__ktf_int(a, <, b))
+#define EXPECT_INT_LE(a, b)	((void)__ktf_int(a, <=, b))
+#define EXPECT_INT_GT(a, b)	((void)__ktf_int(a, >, b))
+#define EXPECT_INT_GE(a, b)	((void)__ktf_int(a, >=, b))
+#define EXPECT_OK_ADDR(p)	((void)__ktf_ok_addr(p))
+
+#define ASSERT_TRUE(c)		do { if (!__ktf_true(c)) return; } while (0)
+#define ASSERT_FALSE(c)		do { if (!__ktf_false(c)) return; } while (0)
+#define ASSERT_INT_EQ(a, b)	do { if (!__ktf_int(a, ==, b)) return; } while (0)
+#define ASSERT_INT_NE(a, b)	do { if (!__ktf_int(a, !=, b)) return; } while (0)
+#define ASSERT_INT_LT(a, b)	do { if (!__ktf_int(a, <, b)) return; } while (0)
+#define ASSERT_INT_LE(a, b)	do { if (!__ktf_int(a, <=, b)) return; } while (0)
+#define ASSERT_INT_GT(a, b)	do { if (!__ktf_int(a, >, b)) return; } while (0)
+#define ASSERT_INT_GE(a, b)	do { if (!__ktf_int(a, >=, b)) return; } while (0)
+#define ASSERT_OK_ADDR(p)	do { if (!__ktf_ok_addr(p)) return; } while (0)
+
+#define ASSERT_TRUE_GOTO(c, l)		do { if (!__ktf_true(c)) goto l; } while (0)
+#define ASSERT_FALSE_GOTO(c, l)		do { if (!__ktf_false(c)) goto l; } while (0)
+#define ASSERT_INT_EQ_GOTO(a, b, l)	do { if (!__ktf_int(a, ==, b)) goto l; } while (0)
+#define ASSERT_INT_NE_GOTO(a, b, l)	do { if (!__ktf_int(a, !=, b)) goto l; } while (0)
+#define ASSERT_INT_LT_GOTO(a, b, l)	do { if (!__ktf_int(a, <, b)) goto l; } while (0)
+#define ASSERT_INT_LE_GOTO(a, b, l)	do { if (!__ktf_int(a, <=, b)) goto l; } while (0)
+#define ASSERT_INT_GT_GOTO(a, b, l)	do { if (!__ktf_int(a, >, b)) goto l; } while (0)
+#define ASSERT_INT_GE_GOTO(a, b, l)	do { if (!__ktf_int(a, >=, b)) goto l; } while (0)
+#define ASSERT_OK_ADDR_GOTO(p, l)	do { if (!__ktf_ok_addr(p)) goto l; } while (0)
+
+#define ASSERT_TRUE_RETVAL(c, v)	do { if (!__ktf_true(c)) return v; } while (0)
+#define ASSERT_FALSE_RETVAL(c, v)	do { if (!__ktf_false(c)) return v; } while (0)
+#define ASSERT_INT_EQ_RETVAL(a, b, v)	do { if (!__ktf_int(a, ==, b)) return v; } while (0)
+#define ASSERT_OK_ADDR_RETVAL(p, v)	do { if (!__ktf_ok_addr(p)) return v; } while (0)
+
+/* These are used inside loops, so they can't be wrapped in do/while. */
+#define ASSERT_TRUE_BREAK(c)		if (!__ktf_true(c)) break
+#define ASSERT_FALSE_BREAK(c)		if (!__ktf_false(c)) break
+#define ASSERT_TRUE_CONT(c)		if (!__ktf_true(c)) continue
+#define ASSERT_FALSE_CONT(c)		if (!__ktf_false(c)) continue
+
+#endif
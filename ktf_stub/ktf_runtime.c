@@ -0,0 +1,357 @@
+/*
+ * A userspace runtime for the stub KTF and kernel headers, so that converted
+ * suites that only use those APIs (test_sort, test_string) can be built and
+ * run as a normal process, without a kernel build tree (see run_native.py).
+ *
+ * The module init function (found through the pointer module_init() stores)
+ * registers the tests, and every test is then run once per context, or once
+ * if there are no contexts, and once per index of loop tests. Each run is
+ * timed, and reported on a line of its own:
+ *
+ *	PASS <suite>.<test>[@<context>] <ns> ns <asserts> asserts <failures> failures
+ *
+ * Usage: <program> [-r repeats] [test ...]
+ * With test names (either "test" or "suite.test"), only those tests are run.
+ * With repeats, every test is run that many times, and the fastest time is
+ * reported. The exit status is 1 if a test failed or the init function did.
+ * As in the kernel, no test is run and the exit function is not called after
+ * a failed init.
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdarg.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "ktf.h"
+#include <linux/slab.h>
+#include <linux/sort.h>
+#include <linux/timekeeping.h>
+#include <linux/cpumask.h>
+
+/* Set by module_init() and module_exit() in the converted file, if used. */
+extern int (* const ktf_stub_module_init)(void) __attribute__((weak));
+extern void (* const ktf_stub_module_exit)(void) __attribute__((weak));
+
+struct registered_test {
+	struct ktf_test_case *tc;
+	int from;
+	int to;
+};
+
+static struct registered_test *tests;
+static int test_count;
+static int test_capacity;
+
+static struct ktf_context *contexts;
+
+/* Registration */
+
+void ktf_add_test(struct ktf_test_case *tc, int from, int to)
+{
+	if (test_count == test_capacity) {
+		test_capacity = test_capacity ? 2 * test_capacity : 64;
+		tests = realloc(tests, test_capacity * sizeof(*tests));
+		if (!tests) {
+			perror("ktf_add_test");
+			exit(2);
+		}
+	}
+	tests[test_count].tc = tc;
+	tests[test_count].from = from;
+	tests[test_count].to = to;
+	test_count++;
+}
+
+void ktf_cleanup(void)
+{
+	free(tests);
+	tests = NULL;
+	test_count = test_capacity = 0;
+}
+
+/* Contexts */
+
+void ktf_context_add(struct ktf_context *ctx, const char *name)
+{
+	struct ktf_context **last = &contexts;
+
+	while (*last)
+		last = &(*last)->next;
+	ctx->name = name;
+	ctx->next = NULL;
+	*last = ctx;
+}
+
+struct ktf_context *ktf_context_find(const char *name)
+{
+	struct ktf_context *ctx;
+
+	for (ctx = contexts; ctx; ctx = ctx->next)
+		if (strcmp(ctx->name, name) == 0)
+			return ctx;
+	return NULL;
+}
+
+void ktf_context_remove(struct ktf_context *ctx)
+{
+	struct ktf_context **p;
+
+	for (p = &contexts; *p; p = &(*p)->next) {
+		if (*p == ctx) {
+			*p = ctx->next;
+			return;
+		}
+	}
+}
+
+/* Assertions and logging */
+
+int ktf_assert(struct ktf_test *self, int ok, const char *expr,
+	       const char *file, int line)
+{
+	self->asserts++;
+	if (!ok) {
+		self->failures++;
+		printf("  %s:%d: %s.%s: assertion failed: %s\n", file, line,
+		       self->suite, self->name, expr);
+	}
+	return ok;
+}
+
+static const char *level_name(int level)
+{
+	switch (level) {
+	case T_ERROR:
+		return "error";
+	case T_INFO:
+		return "info";
+	default:
+		return "debug";
+	}
+}
+
+void ktf_log(int level, const char *fmt, ...)
+{
+	va_list args;
+
+	printf("  [%s] ", level_name(level));
+	va_start(args, fmt);
+	vprintf(fmt, args);
+	va_end(args);
+	printf("\n");
+}
+
+int printk(const char *fmt, ...)
+{
+	va_list args;
+	int n;
+
+	/* Skip the KERN_<LEVEL> prefix. */
+	if (fmt[0] == '\001' && fmt[1])
+		fmt += 2;
+	printf("  ");
+	va_start(args, fmt);
+	n = vprintf(fmt, args);
+	va_end(args);
+	return n;
+}
+
+/* Kernel APIs */
+
+void *kmalloc(size_t size, gfp_t flags)
+{
+	return malloc(size);
+}
+
+void *kzalloc(size_t size, gfp_t flags)
+{
+	return calloc(1, size);
+}
+
+void *kmalloc_array(size_t n, size_t size, gfp_t flags)
+{
+	if (size && n > (size_t)-1 / size)
+		return NULL;
+	return malloc(n * size);
+}
+
+void *kcalloc(size_t n, size_t size, gfp_t flags)
+{
+	return calloc(n, size);
+}
+
+void kfree(const void *p)
+{
+	free((void *)p);
+}
+
+void *memset16(u16 *s, u16 v, size_t count)
+{
+	size_t i;
+
+	for (i = 0; i < count; i++)
+		s[i] = v;
+	return s;
+}
+
+void *memset32(u32 *s, u32 v, size_t count)
+{
+	size_t i;
+
+	for (i = 0; i < count; i++)
+		s[i] = v;
+	return s;
+}
+
+void *memset64(u64 *s, u64 v, size_t count)
+{
+	size_t i;
+
+	for (i = 0; i < count; i++)
+		s[i] = v;
+	return s;
+}
+
+static void swap_bytes(void *a, void *b, int size)
+{
+	char *x = a, *y = b, t;
+
+	while (size--) {
+		t = *x;
+		*x++ = *y;
+		*y++ = t;
+	}
+}
+
+/* A heapsort, like the kernel's, so it is not stable either. */
+void sort(void *base, size_t num, size_t size,
+	  int (*cmp)(const void *, const void *),
+	  void (*swap)(void *, void *, int))
+{
+	char *a = base;
+	size_t start, end, root, child;
+
+	if (!swap)
+		swap = swap_bytes;
+	if (num < 2)
+		return;
+	for (end = num, start = num / 2; ; ) {
+		if (start > 0) {
+			start--;
+		} else {
+			end--;
+			swap(a, a + end * size, size);
+			if (end == 1)
+				break;
+		}
+		for (root = start; (child = 2 * root + 1) < end; root = child) {
+			if (child + 1 < end &&
+			    cmp(a + child * size, a + (child + 1) * size) < 0)
+				child++;
+			if (cmp(a + root * size, a + child * size) >= 0)
+				break;
+			swap(a + root * size, a + child * size, size);
+		}
+	}
+}
+
+u64 ktime_get_ns(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (u64)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+unsigned int num_online_cpus(void)
+{
+	long n = sysconf(_SC_NPROCESSORS_ONLN);
+
+	return n > 0 ? n : 1;
+}
+
+/* Running the tests */
+
+static int selected(struct ktf_test_case *tc, int argc, char **argv)
+{
+	char full_name[256];
+	int i;
+
+	if (argc == 0)
+		return 1;
+	snprintf(full_name, sizeof(full_name), "%s.%s", tc->suite, tc->name);
+	for (i = 0; i < argc; i++)
+		if (strcmp(argv[i], tc->name) == 0 || strcmp(argv[i], full_name) == 0)
+			return 1;
+	return 0;
+}
+
+/* Runs one test in one context, and returns 0 if it passed. */
+static int run_test(struct registered_test *t, struct ktf_context *ctx,
+		    int repeats)
+{
+	struct ktf_test self;
+	u64 best = 0, start, ns;
+	int r, i;
+
+	for (r = 0; r < repeats; r++) {
+		memset(&self, 0, sizeof(self));
+		self.suite = t->tc->suite;
+		self.name = t->tc->name;
+		start = ktime_get_ns();
+		for (i = t->from; i < t->to; i++)
+			t->tc->fun(&self, ctx, i, 0);
+		ns = ktime_get_ns() - start;
+		if (r == 0 || ns < best)
+			best = ns;
+		if (self.failures)
+			break;
+	}
+	printf("%s %s.%s%s%s %llu ns %d asserts %d failures\n",
+	       self.failures ? "FAIL" : "PASS", self.suite, self.name,
+	       ctx ? "@" : "", ctx ? ctx->name : "",
+	       (unsigned long long)best, self.asserts, self.failures);
+	fflush(stdout);
+	return self.failures != 0;
+}
+
+int main(int argc, char **argv)
+{
+	struct ktf_context *ctx;
+	int repeats = 1, runs = 0, failed = 0, err, i;
+
+	if (argc > 2 && strcmp(argv[1], "-r") == 0) {
+		repeats = atoi(argv[2]);
+		if (repeats < 1)
+			repeats = 1;
+		argc -= 2;
+		argv += 2;
+	}
+	if (!&ktf_stub_module_init) {
+		fprintf(stderr, "No module_init() in the suite\n");
+		return 2;
+	}
+	err = ktf_stub_module_init();
+	if (err) {
+		printf("FAIL module init returned %d\n", err);
+		return 1;
+	}
+	for (i = 0; i < test_count; i++) {
+		if (!selected(tests[i].tc, argc - 1, argv + 1))
+			continue;
+		if (!contexts) {
+			failed += run_test(&tests[i], NULL, repeats);
+			runs++;
+		}
+		for (ctx = contexts; ctx; ctx = ctx->next) {
+			failed += run_test(&tests[i], ctx, repeats);
+			runs++;
+		}
+	}
+	printf("%d tests run, %d failed\n", runs, failed);
+	if (&ktf_stub_module_exit)
+		ktf_stub_module_exit();
+	return failed ? 1 : 0;
+}
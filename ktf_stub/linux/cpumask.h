@@ -0,0 +1,9 @@
+/*
+ * Minimal stand-in for <linux/cpumask.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_CPUMASK_H
+#define KTF_STUB_LINUX_CPUMASK_H
+
+unsigned int num_online_cpus(void);
+
+#endif
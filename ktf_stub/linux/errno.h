@@ -0,0 +1,19 @@
+/*
+ * Minimal stand-in for <linux/errno.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_ERRNO_H
+#define KTF_STUB_LINUX_ERRNO_H
+
+#define EPERM		 1
+#define ENOENT		 2
+#define EINTR		 4
+#define EIO		 5
+#define EAGAIN		11
+#define ENOMEM		12
+#define EBUSY		16
+#define EEXIST		17
+#define EINVAL		22
+#define ENOSPC		28
+#define ERANGE		34
+
+#endif
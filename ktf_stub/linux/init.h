@@ -0,0 +1,10 @@
+/*
+ * Minimal stand-in for <linux/init.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_INIT_H
+#define KTF_STUB_LINUX_INIT_H
+
+#define __init
+#define __exit
+
+#endif
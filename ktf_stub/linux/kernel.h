@@ -0,0 +1,24 @@
+/*
+ * Minimal stand-in for <linux/kernel.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_KERNEL_H
+#define KTF_STUB_LINUX_KERNEL_H
+
+#include <linux/types.h>
+#include <linux/errno.h>
+#include <linux/printk.h>
+
+#define INT_MAX		((int)(~0U >> 1))
+#define UINT_MAX	(~0U)
+#define ULONG_MAX	(~0UL)
+#define S64_MAX		((s64)(~0ULL >> 1))
+
+#define ARRAY_SIZE(arr)	(sizeof(arr) / sizeof((arr)[0]))
+
+#define container_of(ptr, type, member) \
+	((type *)((char *)(ptr) - __builtin_offsetof(type, member)))
+
+int snprintf(char *buf, size_t size, const char *fmt, ...)
+	__attribute__((format(printf, 3, 4)));
+
+#endif
@@ -0,0 +1,14 @@
+/*
+ * Minimal stand-in for <linux/math64.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_MATH64_H
+#define KTF_STUB_LINUX_MATH64_H
+
+#include <linux/types.h>
+
+static inline s64 div64_s64(s64 dividend, s64 divisor)
+{
+	return dividend / divisor;
+}
+
+#endif
@@ -0,0 +1,22 @@
+/*
+ * Minimal stand-in for <linux/module.h>, see ktf_stub/ktf.h.
+ *
+ * module_init() and module_exit() store the functions in two well known
+ * pointers, so a userspace runner can find them.
+ */
+#ifndef KTF_STUB_LINUX_MODULE_H
+#define KTF_STUB_LINUX_MODULE_H
+
+#include <linux/init.h>
+#include <linux/kernel.h>
+
+#define module_init(fn)	int (* const ktf_stub_module_init)(void) = fn
+#define module_exit(fn)	void (* const ktf_stub_module_exit)(void) = fn
+
+#define MODULE_LICENSE(x)		extern int ktf_stub_module_info
+#define MODULE_AUTHOR(x)		extern int ktf_stub_module_info
+#define MODULE_DESCRIPTION(x)		extern int ktf_stub_module_info
+#define MODULE_PARM_DESC(name, x)	extern int ktf_stub_module_info
+#define module_param(name, type, perm)	extern int ktf_stub_module_info
+
+#endif
@@ -0,0 +1,19 @@
+/*
+ * Minimal stand-in for <linux/printk.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_PRINTK_H
+#define KTF_STUB_LINUX_PRINTK_H
+
+#define KERN_ERR	"\0013"
+#define KERN_WARNING	"\0014"
+#define KERN_INFO	"\0016"
+#define KERN_DEBUG	"\0017"
+
+int printk(const char *fmt, ...) __attribute__((format(printf, 1, 2)));
+
+#define pr_err(fmt, ...)	printk(KERN_ERR fmt, ##__VA_ARGS__)
+#define pr_warn(fmt, ...)	printk(KERN_WARNING fmt, ##__VA_ARGS__)
+#define pr_info(fmt, ...)	printk(KERN_INFO fmt, ##__VA_ARGS__)
+#define pr_debug(fmt, ...)	printk(KERN_DEBUG fmt, ##__VA_ARGS__)
+
+#endif
@@ -0,0 +1,19 @@
+/*
+ * Minimal stand-in for <linux/slab.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_SLAB_H
+#define KTF_STUB_LINUX_SLAB_H
+
+#include <linux/types.h>
+
+#define GFP_KERNEL	((gfp_t)0x1)
+#define GFP_ATOMIC	((gfp_t)0x2)
+#define GFP_NOWAIT	((gfp_t)0x4)
+
+void *kmalloc(size_t size, gfp_t flags);
+void *kzalloc(size_t size, gfp_t flags);
+void *kmalloc_array(size_t n, size_t size, gfp_t flags);
+void *kcalloc(size_t n, size_t size, gfp_t flags);
+void kfree(const void *p);
+
+#endif
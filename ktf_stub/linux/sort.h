@@ -0,0 +1,13 @@
+/*
+ * Minimal stand-in for <linux/sort.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_SORT_H
+#define KTF_STUB_LINUX_SORT_H
+
+#include <linux/types.h>
+
+void sort(void *base, size_t num, size_t size,
+	  int (*cmp)(const void *, const void *),
+	  void (*swap)(void *, void *, int));
+
+#endif
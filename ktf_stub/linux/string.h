@@ -0,0 +1,20 @@
+/*
+ * Minimal stand-in for <linux/string.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_STRING_H
+#define KTF_STUB_LINUX_STRING_H
+
+#include <linux/types.h>
+
+void *memset(void *s, int c, size_t count);
+void *memcpy(void *dest, const void *src, size_t count);
+void *memmove(void *dest, const void *src, size_t count);
+int memcmp(const void *a, const void *b, size_t count);
+size_t strlen(const char *s);
+int strcmp(const char *a, const char *b);
+
+void *memset16(u16 *s, u16 v, size_t count);
+void *memset32(u32 *s, u32 v, size_t count);
+void *memset64(u64 *s, u64 v, size_t count);
+
+#endif
@@ -0,0 +1,11 @@
+/*
+ * Minimal stand-in for <linux/timekeeping.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_TIMEKEEPING_H
+#define KTF_STUB_LINUX_TIMEKEEPING_H
+
+#include <linux/types.h>
+
+u64 ktime_get_ns(void);
+
+#endif
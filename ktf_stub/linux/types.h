@@ -0,0 +1,30 @@
+/*
+ * Minimal stand-in for <linux/types.h>, see ktf_stub/ktf.h.
+ */
+#ifndef KTF_STUB_LINUX_TYPES_H
+#define KTF_STUB_LINUX_TYPES_H
+
+typedef signed char s8;
+typedef unsigned char u8;
+typedef signed short s16;
+typedef unsigned short u16;
+typedef signed int s32;
+typedef unsigned int u32;
+typedef signed long long s64;
+typedef unsigned long long u64;
+
+typedef __SIZE_TYPE__ size_t;
+typedef long ssize_t;
+typedef _Bool bool;
+typedef unsigned int gfp_t;
+
+enum {
+	false = 0,
+	true = 1
+};
+
+#ifndef NULL
+#define NULL ((void *)0)
+#endif
+
+#endif
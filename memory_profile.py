@@ -0,0 +1,150 @@
+import os, sys, argparse, linecache, contextlib, tracemalloc
+from collections import namedtuple
+
+from convert import Converter
+from batch import load_manifest, read_input, run_steps
+
+
+
+# The memory used by one step of a conversion, in bytes: "peak" is the most
+# the step had allocated at any time, and "net" what it still held when it
+# returned (negative if it freed more than it allocated). Both are counted
+# from the start of the step.
+StepMemory = namedtuple('StepMemory', 'step peak net')
+
+# An allocation site: the line that allocated "size" bytes (in "count"
+# blocks) that were still in use at the end of the conversion.
+AllocationSite = namedtuple('AllocationSite', 'location line size count')
+
+# The memory profile of a whole conversion. "peak" is the most memory the
+# conversion had allocated at any time, on top of the input text, and
+# "steps" and "top" the StepMemory records (the construction and analysis
+# of the Converter are reported as "__init__") and AllocationSites.
+MemoryProfile = namedtuple('MemoryProfile', 'input_bytes peak steps top')
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    Raised when a conversion allocates more than its budget (see
+    "profile_memory").
+    """
+
+    def __init__(self, job, step, peak, budget):
+        Exception.__init__(self, "Converting {} used {:,} bytes in {}, over "
+            "the budget of {:,} bytes".format(job.input_file, peak, step, budget))
+        self.job = job
+        self.step = step
+        self.peak = peak
+        self.budget = budget
+
+
+def _sites(before, after, top):
+    sites = []
+    for stat in after.compare_to(before, 'lineno'):
+        if stat.size_diff <= 0:
+            continue
+        frame = stat.traceback[0]
+        sites.append(AllocationSite("{}:{}".format(frame.filename, frame.lineno),
+            linecache.getline(frame.filename, frame.lineno).strip(),
+            stat.size_diff, stat.count_diff))
+        if len(sites) == top:
+            break
+    return sites
+
+def profile_memory(job, text=None, top=10, budget=None):
+    """
+    Converts the job with tracemalloc running and returns its MemoryProfile.
+    With a budget (a factor of the size of the input), a
+    MemoryBudgetExceeded is raised as soon as a step brings the peak over
+    budget times the size of the input. The job is converted once without
+    tracing first, so the regex caches are filled and not counted. The
+    output of the Converter is discarded (not kept in memory, where it
+    would be counted).
+    """
+    if text is None:
+        text = read_input(job)
+    input_bytes = len(text.encode('utf-8'))
+    limit = int(budget * input_bytes) if budget else None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run_steps(Converter(job.input_file, job.output_file, job.rules,
+            text=text), job.steps)
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            base = tracemalloc.get_traced_memory()[0]
+            steps = []
+            peak = 0
+            converter = None
+            for step in ["__init__"] + list(job.steps):
+                start = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                if step == "__init__":
+                    converter = Converter(job.input_file, job.output_file,
+                        job.rules, text=text).prepare()
+                else:
+                    getattr(converter, step)()
+                current, step_peak = tracemalloc.get_traced_memory()
+                steps.append(StepMemory(step, step_peak - start, current - start))
+                peak = max(peak, step_peak - base)
+                if limit is not None and peak > limit:
+                    raise MemoryBudgetExceeded(job, step, peak, limit)
+            after = tracemalloc.take_snapshot()
+            del converter
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+    after = after.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    return MemoryProfile(input_bytes, peak, steps, _sites(before, after, top))
+
+def _size(value):
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(value) < 1024 or unit == "MiB":
+            return "{:.1f} {}".format(value, unit) if unit != "B" else \
+                "{} B".format(value)
+        value /= 1024.0
+
+def format_memory(job, profile):
+    """
+    Returns a report with the peak and net allocations of every step and
+    the allocation sites still holding the most memory at the end.
+    """
+    lines = [job.input_file]
+    lines.append("  {:<52} {:>12} {:>12}".format("step", "peak", "net"))
+    for step in profile.steps:
+        lines.append("  {:<52} {:>12} {:>12}".format(step.step,
+            _size(step.peak), _size(step.net)))
+    lines.append("  peak {} for {} of input ({:.1f}x)".format(_size(profile.peak),
+        _size(profile.input_bytes), profile.peak / float(profile.input_bytes or 1)))
+    if profile.top:
+        lines.append("  top allocation sites at the end:")
+    for site in profile.top:
+        lines.append("    {:>12} {:>6} blocks  {}".format(_size(site.size),
+            site.count, os.path.relpath(site.location)))
+        lines.append("        " + site.line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Reports the memory allocated by every step of the '
+                    'conversions listed in a JSON manifest (see batch.py).')
+    parser.add_argument('manifest')
+    parser.add_argument('-t', '--top', type=int, default=10,
+        help='number of allocation sites to list')
+    parser.add_argument('-b', '--budget', type=float, default=None,
+        help='fail if a conversion allocates more than this many times the '
+             'size of its input')
+    args = parser.parse_args()
+
+    failed = 0
+    for job in load_manifest(args.manifest):
+        try:
+            print(format_memory(job, profile_memory(job, top=args.top,
+                budget=args.budget)))
+        except MemoryBudgetExceeded as e:
+            print(e)
+            failed += 1
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,186 @@
+import os, time
+from collections import OrderedDict
+
+
+
+# The upper bounds (in seconds) of the buckets of the step duration
+# histogram.
+STEP_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+PREFIX = "ktf_convert_"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value))
+        for name, value in labels) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Family(object):
+
+    def __init__(self, name, kind, help):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        # Values by label tuple. For histograms, the value is a list of the
+        # bucket counts followed by the count and the sum.
+        self.values = OrderedDict()
+
+
+class ConversionMetrics(object):
+    """
+    Collects metrics about conversions, and writes them in the text format
+    read by Prometheus (for example through the textfile collector of the
+    node exporter), or as OpenMetrics. Every metric is labelled with the
+    name of the test suite (see ["test_suite_name"]):
+
+        ktf_convert_step_duration_seconds   histogram, by step
+        ktf_convert_files_total             files converted
+        ktf_convert_input_bytes_total       size of the inputs
+        ktf_convert_output_bytes_total      size of the converted text
+        ktf_convert_regex_passes_total      regex passes, by result ("run"
+                                            or "skipped", see
+                                            "convert.required_literals")
+        ktf_convert_regex_matches_total     matches replaced by the passes
+        ktf_convert_reused_dummy_functions_total
+                                            calls that reused the dummy
+                                            TEST function of an identical
+                                            call
+        ktf_convert_failures_total          failed conversions, by reason
+
+    and, without the suite label:
+
+        ktf_convert_cache_requests_total    lookups, by cache and result
+                                            ("hit" or "miss")
+        ktf_convert_run_seconds             wall-clock time of the last run
+        ktf_convert_run_timestamp_seconds   when the last run finished
+    """
+
+    def __init__(self):
+        self._families = OrderedDict()
+        for name, kind, help in [
+                ("step_duration_seconds", "histogram",
+                 "Time spent in each step of a conversion."),
+                ("files", "counter", "Files converted."),
+                ("input_bytes", "counter", "Bytes read from the input files."),
+                ("output_bytes", "counter", "Bytes of converted text."),
+                ("regex_passes", "counter", "Regex passes, run or skipped."),
+                ("regex_matches", "counter", "Matches replaced by regex passes."),
+                ("reused_dummy_functions", "counter",
+                 "Calls that reused the dummy TEST function of an identical call."),
+                ("failures", "counter", "Conversions that failed."),
+                ("cache_requests", "counter", "Cache lookups."),
+                ("run_seconds", "gauge", "Wall-clock time of the last run."),
+                ("run_timestamp_seconds", "gauge",
+                 "Unix time at which the last run finished.")]:
+            self._families[name] = _Family(PREFIX + name, kind, help)
+
+    def _add(self, name, labels, amount=1):
+        values = self._families[name].values
+        values[labels] = values.get(labels, 0) + amount
+
+    def _set(self, name, labels, value):
+        self._families[name].values[labels] = value
+
+    def observe_step(self, suite, step, seconds):
+        values = self._families["step_duration_seconds"].values
+        labels = (("suite", suite), ("step", step))
+        entry = values.get(labels)
+        if entry is None:
+            entry = values[labels] = [0] * (len(STEP_BUCKETS) + 2) + [0.0]
+        for i, bound in enumerate(STEP_BUCKETS):
+            if seconds <= bound:
+                entry[i] += 1
+        entry[-3] += 1                 # +Inf
+        entry[-2] += 1                 # count
+        entry[-1] += seconds           # sum
+
+    def add_result(self, result):
+        """
+        Records a batch.JobResult. Results without stats (like the ones
+        from governed batches) only count as files.
+        """
+        stats = result.stats or {}
+        suite = stats.get("suite") or result.job.rules.get("test_suite_name") or ""
+        labels = (("suite", suite),)
+        self._add("files", labels)
+        self._add("output_bytes", labels, len(result.text.encode('utf-8')))
+        if not stats:
+            return
+        self._add("input_bytes", labels, stats["input_bytes"])
+        for step, seconds in stats["steps"]:
+            self.observe_step(suite, step, seconds)
+        skipped = stats["skipped_passes"]
+        self._add("regex_passes", labels + (("result", "run"),),
+            stats["passes"] - skipped)
+        self._add("regex_passes", labels + (("result", "skipped"),), skipped)
+        self._add("regex_matches", labels, stats["matches"])
+        self._add("reused_dummy_functions", labels, stats.get("reused_dummies", 0))
+
+    def add_failure(self, suite, reason):
+        self._add("failures", (("suite", suite or ""), ("reason", reason)))
+
+    def add_cache_requests(self, cache, hits, misses):
+        self._add("cache_requests", (("cache", cache), ("result", "hit")), hits)
+        self._add("cache_requests", (("cache", cache), ("result", "miss")), misses)
+
+    def set_run(self, seconds):
+        self._set("run_seconds", (), seconds)
+        self._set("run_timestamp_seconds", (), time.time())
+
+    def render(self, openmetrics=False):
+        """
+        Returns the metrics as text. In the Prometheus text format, the
+        counters are named with their "_total" suffix in the TYPE lines
+        too; OpenMetrics leaves it out, and ends with "# EOF".
+        """
+        lines = []
+        for family in self._families.values():
+            if not family.values:
+                continue
+            name = family.name
+            if family.kind == "counter" and not openmetrics:
+                name += "_total"
+            lines.append("# TYPE {} {}".format(name, family.kind))
+            lines.append("# HELP {} {}".format(name, family.help))
+            for labels, value in family.values.items():
+                if family.kind == "counter":
+                    lines.append("{}_total{} {}".format(family.name,
+                        _labels(labels), _number(value)))
+                elif family.kind == "histogram":
+                    bounds = STEP_BUCKETS + (float("inf"),)
+                    for bound, count in zip(bounds, value):
+                        lines.append("{}_bucket{} {}".format(family.name,
+                            _labels(labels + (("le", _number(bound)),)), count))
+                    lines.append("{}_count{} {}".format(family.name,
+                        _labels(labels), value[-2]))
+                    lines.append("{}_sum{} {}".format(family.name,
+                        _labels(labels), _number(value[-1])))
+                else:
+                    lines.append("{}{} {}".format(family.name, _labels(labels),
+                        _number(value)))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, openmetrics=False):
+        """
+        Writes the metrics to path. The file is written under another name
+        and renamed into place, as the textfile collector may read it at
+        any time.
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render(openmetrics))
+        os.replace(tmp_path, path)
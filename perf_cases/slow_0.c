@@ -0,0 +1,353 @@
+#include <linux/module.h>
+#include <linux/xarray.h>
+
+static DEFINE_XARRAY(array);
+
+static noinline void check_0(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 105) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 738) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 405) != NULL);
+}
+
+static void check_void_1(void)
+{
+	pr_info("check_void_1\n");
+}
+
+static void helper_2(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 562) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 939) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 296) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 819) != NULL);
+}
+
+static void helper_3(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 532) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 549) != NULL);
+	helper_2(xa, 13);
+}
+
+static noinline void check_range_4(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 965) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 949) != NULL);
+	helper_3(xa, 34);
+}
+
+static noinline void check_range_5(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 888) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 749) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 983) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 875) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 868) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 901) != NULL);
+	helper_3(xa, 49);
+}
+
+static noinline void check_range_6(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 930) != NULL);
+	helper_3(xa, 24);
+}
+
+static void check_void_7(void)
+{
+	pr_info("check_void_7\n");
+}
+
+static void helper_8(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 641) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 287) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 531) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 547) != NULL);
+}
+
+static noinline void check_range_9(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 689) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 200) != NULL);
+	helper_2(xa, 56);
+}
+
+static noinline void check_range_10(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 571) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 203) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 926) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 331) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 103) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 859) != NULL);
+	helper_2(xa, 35);
+}
+
+static void check_void_11(void)
+{
+	pr_info("check_void_11\n");
+}
+
+static noinline void check_range_12(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 330) != NULL);
+	helper_2(xa, 52);
+}
+
+static noinline void check_13(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 390) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 613) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 984) != NULL);
+	helper_8(xa, 1);
+}
+
+static noinline void check_range_14(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 465) != NULL);
+	helper_3(xa, 37);
+}
+
+static void helper_15(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 56) != NULL);
+}
+
+static noinline void check_16(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 41) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 559) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 502) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 596) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 255) != NULL);
+	helper_2(xa, 15);
+}
+
+static noinline void check_range_17(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 667) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 205) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 489) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 206) != NULL);
+	helper_15(xa, 62);
+}
+
+static void check_void_18(void)
+{
+	pr_info("check_void_18\n");
+}
+
+static noinline void check_19(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 37) != NULL);
+	helper_3(xa, 26);
+}
+
+static noinline void check_20(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 890) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 267) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 145) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 332) != NULL);
+	helper_8(xa, 14);
+}
+
+static void check_void_21(void)
+{
+	pr_info("check_void_21\n");
+}
+
+static noinline void check_22(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 921) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 966) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 946) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 169) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 344) != NULL);
+	helper_15(xa, 40);
+}
+
+static void check_void_23(void)
+{
+	pr_info("check_void_23\n");
+}
+
+static void helper_24(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 984) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 642) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 684) != NULL);
+	helper_15(xa, 16);
+}
+
+static noinline void check_range_25(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 876) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 61) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 890) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 171) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 704) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 650) != NULL);
+	helper_15(xa, 51);
+}
+
+static void helper_26(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 897) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 263) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 118) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 405) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 829) != NULL);
+}
+
+static void check_void_27(void)
+{
+	pr_info("check_void_27\n");
+aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa}
+
+static noinline void check_28(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 687) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 622) != NULL);
+	helper_24(xa, 60);
+}
+
+static void check_void_29(void)
+{
+	pr_info("check_void_29\n");
+}
+
+static void check_void_30(void)
+{
+	pr_info("check_void_30\n");
+}
+
+static noinline void check_range_31(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 847) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 76) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 87) != NULL);
+}
+
+static noinline void check_32(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 876) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 989) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 409) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 97) != NULL);
+	helper_24(xa, 46);
+}
+
+static void check_void_33(void)
+{
+	pr_info("check_void_33\n");
+}
+
+static void check_void_34(void)
+{
+	pr_info("check_void_34\n");
+}
+
+static noinline void check_35(struct xarray *xa)
+{
+	XA_BUG_ON(xa, xa_load(xa, 506) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 880) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 346) != NULL);
+	helper_2(xa, 21);
+}
+
+static void helper_36(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 319) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 123) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 558) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 113) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 498) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 805) != NULL);
+}
+
+static void check_void_37(void)
+{
+	pr_info("check_void_37\n");
+}
+
+static void helper_38(struct xarray *xa, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 54) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 624) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 929) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 320) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 557) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 934) != NULL);
+}
+
+static noinline void check_range_39(struct xarray *xa, unsigned int order, unsigned long index)
+{
+	XA_BUG_ON(xa, xa_load(xa, 805) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 451) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 627) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 632) != NULL);
+	XA_BUG_ON(xa, xa_load(xa, 452) != NULL);
+	helper_24(xa, 46);
+}
+
+static int synthetic_4_init(void)
+{
+	check_0(&array);
+	check_void_1();
+	check_range_4(&array, 2, 39);
+	check_range_5(&array, 3, 22);
+	check_range_5(&array, 3, 60);
+	check_range_5(&array, 4, 11);
+	check_range_6(&array, 6, 76);
+	check_range_6(&array, 4, 55);
+	check_void_7();
+	check_range_9(&array, 2, 45);
+	check_range_9(&array, 6, 95);
+	check_range_10(&array, 9, 30);
+	check_range_10(&array, 1, 42);
+	check_range_10(&array, 2, 37);
+	check_void_11();
+	check_range_12(&array, 1, 37);
+	check_range_12(&array, 9, 24);
+	check_range_12(&array, 7, 37);
+	check_13(&array);
+	check_range_14(&array, 1, 56);
+	check_range_14(&array, 3, 54);
+	check_range_14(&array, 3, 14);
+	check_16(&array);
+	check_range_17(&array, 3, 53);
+	check_void_18();
+	check_19(&array);
+	check_20(&array);
+	check_void_21();
+	check_22(&array);
+	check_void_23();
+	check_range_25(&array, 3, 0);
+	check_range_25(&array, 3, 20);
+	check_void_27();
+	check_28(&array);
+	check_void_29();
+	check_void_30();
+	check_range_31(&array, 6, 26);
+	check_range_31(&array, 4, 49);
+	check_32(&array);
+	check_void_33();
+	check_void_34();
+	check_35(&array);
+	check_void_37();
+	check_range_39(&array, 5, 17);
+	check_range_39(&array, 6, 10);
+	check_range_39(&array, 9, 18);
+
+	return 0;
+}
+
+static void synthetic_4_exit(void)
+{
+}
+
+module_init(synthetic_4_init);
+module_exit(synthetic_4_exit);
@@ -0,0 +1,312 @@
+import os, sys, json, math, time, random, argparse
+from collections import namedtuple
+from multiprocessing import Pool, TimeoutError
+
+from batch import convert_job, init_worker
+from difftest import bundled_cases, synthetic_case, minimize
+
+
+
+# An input that can be made larger: "unit" repeated "count" times is
+# inserted at "position" of the text of the base case (see "grow").
+Candidate = namedtuple('Candidate', 'name case position unit mutation')
+
+# How the conversion time of a candidate grows. "sizes" are the lengths of
+# the converted texts and "seconds" the best times, over the time of the
+# base text alone; "exponent" is the slope of log(seconds) over the log of
+# the number of copies of the unit, and "step" the step whose time grew the
+# fastest (with its own exponent). A candidate that ran out of time has an
+# infinite exponent.
+Growth = namedtuple('Growth', 'sizes seconds exponent step step_exponent')
+
+# The number of copies of the unit for every measurement, for a unit of
+# UNIT_CHARS characters (smaller units get proportionally more copies).
+GROWTH_STEPS = (1, 2, 4, 8)
+UNIT_CHARS = 512
+
+# Times below this are too noisy to say anything about growth.
+MIN_SECONDS = 0.005
+
+
+# Making inputs.
+# -------------------------------------------------------------------
+
+def _random_identifier(rng):
+    return rng.choice(["xa", "index", "order", "ht", "obj", "key", "entry",
+        "check", "static", "noinline", "test", "init"]) + \
+        rng.choice(["", "_", "_1", "_init", "_exit", "s"])
+
+def grammar_unit(rng, depth=0):
+    """
+    Returns a random piece of C-like code, with the constructs the
+    conversion regexes look at: static functions with odd signatures,
+    calls with nested arguments, multi-line macros, comments and strings
+    that contain code.
+    """
+    kind = rng.choice(["function", "call", "macro", "comment", "string",
+        "declaration", "assert"])
+    name = _random_identifier(rng)
+    if kind == "function" and depth < 2:
+        qualifiers = " ".join(rng.choice(["static", "noinline", "unsigned",
+            "long", "int", "void", "*", "__init", ""])
+            for _ in range(rng.randint(1, 6)))
+        params = ", ".join("struct {} *{}".format(_random_identifier(rng),
+            _random_identifier(rng)) for _ in range(rng.randint(0, 4))) or "void"
+        body = "".join("\t" + grammar_unit(rng, depth + 1)
+            for _ in range(rng.randint(0, 4)))
+        return "{} {}({})\n{{\n{}}}\n\n".format(qualifiers, name, params, body)
+    if kind == "call":
+        args = "&array"
+        for _ in range(rng.randint(0, 4)):
+            args = "{}({}, {})".format(_random_identifier(rng), args,
+                rng.randint(0, 99))
+        return "{}({});\n".format(name, args)
+    if kind == "macro":
+        lines = ["#define {}(a, b) \\".format(name.upper())]
+        lines += ["\tdo {{ {}(a, b); }} while (0) \\".format(_random_identifier(rng))
+            for _ in range(rng.randint(1, 4))]
+        return "\n".join(lines) + "\n\t/* end */\n"
+    if kind == "comment":
+        return "/* static void {}(void) {{ module_init({}); */\n".format(name, name)
+    if kind == "string":
+        return 'pr_info("{}(&array, {{ TEST(a, b) {{");\n'.format(name)
+    if kind == "declaration":
+        return "static {} {}[{}];\n".format(rng.choice(["int", "u64",
+            "struct xarray"]), name, rng.randint(1, 64))
+    return "XA_BUG_ON({}, {}({}) != NULL);\n".format(
+        rng.choice(["xa", "&xa0", "NULL"]), name, rng.choice(["xa", "&array", ""]))
+
+def _line_starts(text):
+    starts = [0]
+    starts.extend(i + 1 for i, c in enumerate(text) if c == "\n")
+    return starts
+
+def mutate(case, rng):
+    """
+    Returns a Candidate made from a bundled case: a repeated block of its
+    own lines, a run of characters that the patterns match loosely
+    (spaces, stars, parentheses), or generated code.
+    """
+    starts = _line_starts(case.text)
+    position = rng.choice(starts)
+    mutation = rng.choice(["lines", "characters", "grammar"])
+    if mutation == "lines":
+        first = rng.randrange(len(starts))
+        last = min(len(starts) - 1, first + rng.randint(1, 30))
+        unit = case.text[starts[first]:starts[last]] or "\n"
+    elif mutation == "characters":
+        prefix = rng.choice(["static", "static noinline", "TEST(", "module_init(",
+            "XA_BUG_ON(xa, ", "for (i = 0", "#include <", ""])
+        unit = prefix + rng.choice([" ", "\t", "*", "(", " (", "a", "\\\n", ", "])
+    else:
+        unit = "".join(grammar_unit(rng) for _ in range(rng.randint(1, 5)))
+    return Candidate("{} +{}@{}".format(case.name, mutation, position), case,
+        position, unit, mutation)
+
+def grow(candidate, count):
+    text = candidate.case.text
+    return text[:candidate.position] + candidate.unit * count + \
+        text[candidate.position:]
+
+def growth_counts(unit):
+    base = max(1, UNIT_CHARS // max(1, len(unit)))
+    return [base * step for step in GROWTH_STEPS]
+
+
+# Measuring.
+# -------------------------------------------------------------------
+
+def exponent(sizes, seconds):
+    """
+    The least squares slope of log(seconds) over log(size): about 1 for
+    linear growth, 2 for quadratic. Sizes with no time are left out.
+    """
+    points = [(math.log(n), math.log(s)) for n, s in zip(sizes, seconds) if s > 0]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+def _measure(task):
+    """
+    Converts every text (best of "repeat" runs) and returns a list of
+    (size, seconds, {step: seconds}), or None if the conversion fails.
+    """
+    job, texts, repeat = task
+    points = []
+    for text in texts:
+        best, steps = None, {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                stats = convert_job(job, text)[3]
+            except Exception:
+                return None
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best:
+                best, steps = seconds, dict(stats["steps"])
+        points.append((len(text), best, steps))
+    return points
+
+class Measurer(object):
+    """
+    Measures candidates in a worker process, so that an input that makes a
+    pass run (nearly) forever can be given up on after "timeout" seconds.
+    """
+
+    def __init__(self, timeout=10.0, repeat=3):
+        self._timeout = timeout
+        self._repeat = repeat
+        self._pool = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def growth(self, candidate):
+        """
+        Returns the Growth of the candidate, or None if it can't be
+        converted at all.
+        """
+        if self._pool is None:
+            self._pool = Pool(1, initializer=init_worker, initargs=(True,))
+        counts = growth_counts(candidate.unit)
+        texts = [grow(candidate, count) for count in [0] + counts]
+        job = candidate.case.job
+        try:
+            points = self._pool.apply_async(_measure,
+                ((job, texts, self._repeat),)).get(self._timeout)
+        except TimeoutError:
+            self.close()
+            return Growth([len(t) for t in texts[1:]], None, float("inf"), None,
+                float("inf"))
+        if points is None:
+            return None
+        # Only the time added by the copies counts, so that a unit which is
+        # merely slower per byte than the rest of the text is not reported.
+        _, base_seconds, base_steps = points[0]
+        sizes = [size for size, _, _ in points[1:]]
+        seconds = [max(0.0, s - base_seconds) for _, s, _ in points[1:]]
+        step, step_exponent = None, 0.0
+        for name in points[-1][2]:
+            times = [max(0.0, steps.get(name, 0.0) - base_steps.get(name, 0.0))
+                for _, _, steps in points[1:]]
+            if times[-1] >= MIN_SECONDS / 2:
+                e = exponent(counts, times)
+                if step is None or e > step_exponent:
+                    step, step_exponent = name, e
+        return Growth(sizes, seconds, exponent(counts, seconds), step,
+            step_exponent)
+
+def is_superlinear(growth, threshold):
+    if growth is None:
+        return False
+    if growth.seconds is None:
+        return True
+    return growth.exponent > threshold and growth.seconds[-1] >= MIN_SECONDS
+
+
+# Saving the cases.
+# -------------------------------------------------------------------
+
+def minimize_unit(candidate, measurer, threshold, max_tests=100):
+    """
+    Shrinks the repeated unit of a slow candidate (by lines, or by
+    characters for units of a single line) as long as it stays slow.
+    """
+    multiline = "\n" in candidate.unit.rstrip("\n")
+    pieces = candidate.unit.splitlines(True) if multiline else list(candidate.unit)
+
+    def slow(pieces):
+        return is_superlinear(measurer.growth(
+            candidate._replace(unit="".join(pieces))), threshold)
+
+    return candidate._replace(unit="".join(minimize(pieces, slow, max_tests)))
+
+def save_case(candidate, growth, directory):
+    """
+    Writes the largest input of a slow candidate and a one-job manifest for
+    it (see batch.load_manifest), so that it can be timed again with
+    step_profile.py. Cases already in the directory are kept. Returns the
+    path of the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    number = 0
+    while os.path.exists(os.path.join(directory, "slow_{}.json".format(number))):
+        number += 1
+    name = "slow_{}".format(number)
+    text = grow(candidate, growth_counts(candidate.unit)[-1])
+    with open(os.path.join(directory, name + ".c"), 'w') as f:
+        f.write(text)
+    manifest = os.path.join(directory, name + ".json")
+    with open(manifest, 'w') as f:
+        json.dump([{
+            "input": name + ".c",
+            "output": name + "_rewrite.c",
+            "rules": candidate.case.job.rules,
+            "steps": candidate.case.job.steps,
+            "found": {"from": candidate.name, "unit": candidate.unit,
+                "exponent": growth.exponent, "step": growth.step},
+        }], f, indent=1)
+    return manifest
+
+def format_growth(candidate, growth):
+    if growth.seconds is None:
+        return "{}: timed out (unit {!r})".format(candidate.name, candidate.unit[:40])
+    return "{}: exponent {:.2f}, +{:.1f}ms at {} bytes, worst step {} ({:.2f}), " \
+        "unit {!r}".format(candidate.name, growth.exponent,
+            growth.seconds[-1] * 1000, growth.sizes[-1], growth.step,
+            growth.step_exponent, candidate.unit[:40])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Looks for inputs whose conversion time grows faster than '
+                    'their size, by mutating the bundled sources and '
+                    'generating C-like code. Slow inputs are minimized and '
+                    'saved as benchmark cases.')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=1.5,
+        help='growth exponent above which an input is reported (1 is linear)')
+    parser.add_argument('--timeout', type=float, default=10.0,
+        help='seconds allowed for measuring one input')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--no-minimize', action='store_true')
+    parser.add_argument('--save-dir', default='perf_cases',
+        help='where the slow inputs are written')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bases = bundled_cases() + [synthetic_case(args.seed + i) for i in range(5)]
+    measurer = Measurer(args.timeout, args.repeat)
+    found = 0
+    try:
+        for i in range(args.iterations):
+            candidate = mutate(rng.choice(bases), rng)
+            growth = measurer.growth(candidate)
+            if not is_superlinear(growth, args.threshold):
+                continue
+            print("slow: " + format_growth(candidate, growth))
+            if not args.no_minimize:
+                minimized = minimize_unit(candidate, measurer, args.threshold)
+                minimized_growth = measurer.growth(minimized)
+                # The timings are noisy, so the minimized unit may no longer
+                # measure as slow; the candidate itself still did.
+                if is_superlinear(minimized_growth, args.threshold):
+                    candidate, growth = minimized, minimized_growth
+                else:
+                    print("  minimized unit no longer slow, saving it unminimized")
+            print("  saved {}: {}".format(
+                save_case(candidate, growth, args.save_dir),
+                format_growth(candidate, growth)))
+            found += 1
+    finally:
+        measurer.close()
+    print("{} inputs tried, {} slow inputs found".format(args.iterations, found))
+    sys.exit(1 if found else 0)
@@ -0,0 +1,227 @@
+import os, sys, time, queue, argparse, threading
+from collections import namedtuple
+from multiprocessing import Pool
+
+from batch import JobResult, load_manifest, read_input, write_output, \
+    output_files, init_worker, pickle_worker
+from ktf_modules import update_makefile
+
+
+
+# How busy one stage of the pipeline was. "utilization" is the time the
+# stage spent working divided by the time it was running (for the
+# transform stage, divided by the number of worker processes as well).
+# The depths are those of the queue the stage takes its work from, sampled
+# every time an item is put on it.
+StageStats = namedtuple('StageStats',
+    'name items busy_seconds utilization max_depth mean_depth')
+
+# The outcome of a whole pipeline run. "files" is the list of paths of all
+# the files produced, written or not, and "failed" the JobResults of the
+# jobs whose conversion raised an exception (see "batch.JobResult").
+PipelineStats = namedtuple('PipelineStats',
+    'jobs seconds written files stages failed', defaults=((),))
+
+# Marks the end of the items on a queue.
+_DONE = None
+
+
+class _Stage(object):
+    """
+    Keeps the counters of one stage, and of the bounded queue feeding it.
+    """
+
+    def __init__(self, name, queue_size):
+        self.name = name
+        self.queue = queue.Queue(queue_size) if queue_size else None
+        self.items = 0
+        self.busy = 0.0
+        self.depths = []
+        self.error = None
+
+    def put(self, item):
+        self.queue.put(item)
+        self.depths.append(self.queue.qsize())
+
+    def stats(self, seconds, workers=1):
+        depths = self.depths or [0]
+        return StageStats(self.name, self.items, self.busy,
+            self.busy / (seconds * workers) if seconds else 0.0,
+            max(depths), sum(depths) / float(len(depths)))
+
+
+def _read(jobs, reader, transform, stop):
+    """
+    The reader thread: reads the input files in order and puts them on the
+    transform queue, waiting whenever it is full.
+    """
+    try:
+        for index, job in enumerate(jobs):
+            if stop.is_set():
+                break
+            start = time.perf_counter()
+            text = read_input(job)
+            reader.busy += time.perf_counter() - start
+            reader.items += 1
+            transform.put((index, job, text))
+    except Exception as e:
+        reader.error = e
+    finally:
+        transform.put(_DONE)
+
+def _write(writer):
+    """
+    The writer thread: writes the files of every converted job as it
+    arrives (see "batch.output_files"), skipping the files that did not
+    change. Jobs that are part of a bundle can only be written once all
+    of them are done, so they are kept until the end.
+    """
+    try:
+        bundled = []
+        while True:
+            result = writer.queue.get()
+            if result is _DONE:
+                break
+            if result.job.rules.get("bundle"):
+                bundled.append(result)
+                continue
+            _write_results(writer, [result])
+        if bundled:
+            _write_results(writer, bundled)
+    except Exception as e:
+        writer.error = e
+        # Keep taking results, so the transform stage is never blocked.
+        while writer.queue.get() is not _DONE:
+            pass
+
+def _write_results(writer, results):
+    start = time.perf_counter()
+    files, makefile_updates = output_files(results)
+    for path, text in files:
+        writer.written += write_output(path, text)
+        writer.files.append(path)
+    for update in makefile_updates:
+        update_makefile(*update)
+    writer.busy += time.perf_counter() - start
+    writer.items += len(results)
+
+def convert_streaming(jobs, processes=None, queue_size=8, quiet=True):
+    """
+    Converts and writes all the jobs with a pipeline of three stages, so
+    that reading, converting and writing files all overlap:
+
+        reader thread -> queue -> process pool -> queue -> writer thread
+
+    Both queues hold at most queue_size items, and no more than queue_size
+    jobs are handed to the pool at a time, so the number of files held in
+    memory does not grow with the number of jobs (except for bundled
+    jobs, which are written together at the end). The files are written
+    as in "batch.write_results".
+
+    Returns a PipelineStats, with the StageStats of the "read",
+    "transform" and "write" stages.
+    """
+    jobs = list(jobs)
+    processes = processes or os.cpu_count()
+    reader = _Stage("read", 0)
+    transform = _Stage("transform", queue_size)
+    writer = _Stage("write", queue_size)
+    writer.written = 0
+    writer.files = []
+    # Jobs handed to the pool and not yet returned, by index.
+    in_flight = {}
+    failed = []
+    slots = threading.BoundedSemaphore(queue_size)
+    # Set when the pool is shut down. The pool waits for its task handler
+    # thread, which runs "tasks", so that must never block for good.
+    stop = threading.Event()
+
+    def tasks():
+        # Runs in the task handler thread of the pool, which would
+        # otherwise take every item from the queue as fast as it can.
+        while not stop.is_set():
+            try:
+                item = transform.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            index, job, text = item
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            in_flight[index] = job
+            yield index, (job, text, None)
+
+    start = time.perf_counter()
+    read_thread = threading.Thread(target=_read,
+        args=(jobs, reader, transform, stop))
+    write_thread = threading.Thread(target=_write, args=(writer,))
+    read_thread.start()
+    write_thread.start()
+    try:
+        with Pool(processes, initializer=init_worker, initargs=(quiet,)) as pool:
+            try:
+                for index, pid, (text, seconds, source_map, stats, error, _) in \
+                        pool.imap_unordered(pickle_worker, tasks(), chunksize=1):
+                    slots.release()
+                    transform.busy += seconds
+                    transform.items += 1
+                    result = JobResult(in_flight.pop(index), text, seconds,
+                        source_map, stats, error)
+                    if error:
+                        failed.append(result)
+                    else:
+                        writer.put(result)
+            finally:
+                stop.set()
+    finally:
+        writer.put(_DONE)
+        # If the pool failed, the reader may be waiting for room on the queue.
+        while read_thread.is_alive():
+            try:
+                transform.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_thread.join()
+    seconds = time.perf_counter() - start
+
+    for stage in (reader, writer):
+        if stage.error is not None:
+            raise stage.error
+    stages = [reader.stats(seconds), transform.stats(seconds, processes),
+        writer.stats(seconds)]
+    return PipelineStats(len(jobs), seconds, writer.written, writer.files, stages,
+        failed)
+
+def format_stats(stats):
+    lines = ["Converted {} files in {:.3f}s ({} files written, {} failed)".format(
+        stats.jobs, stats.seconds, stats.written, len(stats.failed))]
+    lines.append("  {:<10} {:>6} {:>9} {:>6} {:>10} {:>11}".format(
+        "stage", "items", "busy (s)", "util", "max queue", "mean queue"))
+    for stage in stats.stages:
+        lines.append("  {:<10} {:>6} {:>9.3f} {:>6.1%} {:>10} {:>11.1f}".format(
+            stage.name, stage.items, stage.busy_seconds, stage.utilization,
+            stage.max_depth, stage.mean_depth))
+    for result in stats.failed:
+        lines.append("FAILED {}: error during step '{}': {}".format(
+            result.job.input_file, result.error[0], result.error[1]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Converts all the files listed in a JSON manifest (see '
+                    'batch.py), reading, converting and writing them in a '
+                    'pipeline.')
+    parser.add_argument('manifest')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-q', '--queue-size', type=int, default=8,
+        help='number of files each queue of the pipeline can hold')
+    args = parser.parse_args()
+
+    stats = convert_streaming(load_manifest(args.manifest), args.jobs,
+        args.queue_size)
+    print(format_stats(stats))
+    sys.exit(1 if stats.failed else 0)
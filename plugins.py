@@ -0,0 +1,289 @@
+import os, re, time, importlib
+from bisect import bisect_right
+from collections import namedtuple
+
+from ktf_modules import split_top_level, module_functions, call_span
+
+
+
+# A structural event found while traversing a file. "kind" is one of:
+#     "include_block" : a run of consecutive #include lines
+#     "function"      : a function definition, from its header to its }
+#     "init_body"     : the body (between the braces) of the module init
+#     "exit_body"     : the body of the module exit function
+#     "call"          : a call to a function, from its name to its )
+#     "macro"         : the same, for names in all capitals (XA_BUG_ON...)
+# "name" is the name of the function, called function or macro ("" for
+# include blocks), [start, end) the span of "text" in the file, "args" the
+# arguments of calls and macros, or the parameters of functions, and
+# "function" the name of the function the event is in ("" at top level).
+Event = namedtuple('Event', 'kind name start end text args function')
+
+# The time a plugin spent in its handlers during one "traverse", the number
+# of events it was given and the number of edits it made.
+PluginTiming = namedtuple('PluginTiming', 'plugin seconds events edits')
+
+EVENT_KINDS = ("include_block", "function", "init_body", "exit_body", "call",
+    "macro")
+
+# Comments, strings and preprocessor lines are skipped as a whole, except
+# for #include lines. Everything else of interest is a name followed by (.
+_tokens = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<include>^[ \t]*\#[ \t]*include\b[^\n]*\n?)
+  | (?P<directive>^[ \t]*\#(?:[^\n\\]|\\.)*)
+  | (?P<name>\b[A-Za-z_]\w*)\s*\(
+""", re.MULTILINE | re.DOTALL | re.VERBOSE)
+
+# Names followed by ( that are not calls.
+_keywords = frozenset(["if", "for", "while", "switch", "return", "sizeof",
+    "typeof", "__typeof__", "alignof", "_Alignof", "__attribute__", "asm",
+    "__asm__", "defined", "do", "else", "case"])
+
+_macro_name = re.compile(r"[A-Z][A-Z0-9_]*$")
+
+
+class ConverterPlugin(object):
+    """
+    The base class of plugins run by "Converter.run_plugins". A plugin
+    overrides the handlers for the events it is interested in (see Event);
+    a handler returns the text to replace the event's span with, or None to
+    leave it as it is. All the plugins of a converter are run during a
+    single traversal of the text, so a plugin does not cost another pass
+    over the file, and only the handlers a plugin overrides are called.
+
+    "begin" is called with the converter before the traversal, so the
+    plugin can look at its rules (for example the suite name), and "end"
+    after the edits have been made. The handlers of an event are called
+    after those of the events inside it, with the text those made (see
+    "traverse"), so a plugin that rewrites a function can be combined with
+    one that rewrites a macro in it.
+
+    For example, to log the start of every test function:
+
+        class LogStart(ConverterPlugin):
+            def on_function(self, event):
+                if event.text.startswith("TEST("):
+                    brace = event.text.index("{") + 1
+                    return event.text[:brace] + '\\n\\ttlog(T_INFO, "start");' + \\
+                        event.text[brace:]
+    """
+
+    def name(self):
+        return type(self).__name__
+
+    def begin(self, converter):
+        pass
+
+    def end(self, converter):
+        pass
+
+    def on_include_block(self, event):
+        return None
+
+    def on_function(self, event):
+        return None
+
+    def on_init_body(self, event):
+        return None
+
+    def on_exit_body(self, event):
+        return None
+
+    def on_call(self, event):
+        return None
+
+    def on_macro(self, event):
+        return None
+
+
+def load_plugin(spec):
+    """
+    Returns a plugin given as an instance, or as a "module:Class" string,
+    in which case the class is created without arguments. Strings are what
+    manifests use, as they are sent to worker processes.
+    """
+    if not isinstance(spec, str):
+        return spec
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+def _handlers(plugins, kind):
+    """
+    Returns (plugin index, bound handler) for the plugins that override the
+    handler of that kind of event.
+    """
+    method = "on_" + kind
+    base = getattr(ConverterPlugin, method)
+    return [(i, getattr(plugin, method)) for i, plugin in enumerate(plugins)
+        if getattr(type(plugin), method, base) is not base]
+
+def _functions(text):
+    """
+    Returns the function definitions of the text as a list of (start, body
+    start, end, name, parameters), where body start is the index of the {
+    and end that of the }.
+    """
+    functions = []
+    position = 0
+    for item in split_top_level(text):
+        if item.kind != "glue":
+            span = call_span(item.text, item.text.find("("))
+            functions.append((position, position + item.text.index("{"),
+                position + len(item.text.rstrip("\n")) - 1, item.name,
+                span[0] if span else []))
+        position += len(item.text)
+    return functions
+
+def events(text, kinds=EVENT_KINDS):
+    """
+    Yields the Events of the text, of the given kinds, in the order of
+    their start (an event comes before the events inside it).
+    """
+    init_name, exit_name = module_functions(text)
+    functions = _functions(text)
+    starts = [f[0] for f in functions]
+    wants_calls = "call" in kinds or "macro" in kinds
+    next_function = 0
+    block = None
+
+    def events_before(position):
+        # The include block seen last, and the functions starting before
+        # position that have not been given yet.
+        nonlocal next_function, block
+        if block is not None and block[1] <= position:
+            if "include_block" in kinds:
+                yield Event("include_block", "", block[0], block[1],
+                    text[block[0]:block[1]], [], "")
+            block = None
+        while next_function < len(functions) and \
+                functions[next_function][0] < position:
+            start, body, end, name, params = functions[next_function]
+            next_function += 1
+            if "function" in kinds:
+                yield Event("function", name, start, end + 1,
+                    text[start:end + 1], params, "")
+            kind = "init_body" if name == init_name else \
+                "exit_body" if name == exit_name else None
+            if kind in kinds:
+                yield Event(kind, name, body + 1, end, text[body + 1:end], [],
+                    name)
+
+    for match in _tokens.finditer(text):
+        group = match.lastgroup
+        if group == "include":
+            if block is not None and block[1] == match.start():
+                block[1] = match.end()
+            else:
+                for event in events_before(match.start()):
+                    yield event
+                block = [match.start(), match.end()]
+            continue
+        if group != "name":
+            continue
+        for event in events_before(match.start() + 1):
+            yield event
+        name = match.group("name")
+        if not wants_calls or name in _keywords:
+            continue
+        i = bisect_right(starts, match.start()) - 1
+        inside = i >= 0 and match.start() < functions[i][2]
+        if inside and match.start() < functions[i][1]:
+            # The name in the header of the function definition.
+            continue
+        span = call_span(text, match.end() - 1)
+        if span is None:
+            continue
+        kind = "macro" if _macro_name.match(name) else "call"
+        if kind in kinds:
+            yield Event(kind, name, match.start(), span[1] + 1,
+                text[match.start():span[1] + 1], span[0],
+                functions[i][3] if inside else "")
+    for event in events_before(len(text) + 1):
+        yield event
+
+def _with_text(event, text):
+    """
+    Returns the event with another text, and the arguments of that text if
+    it is a call or a macro.
+    """
+    args = event.args
+    if event.kind in ("call", "macro"):
+        span = call_span(text, text.find("("))
+        args = span[0] if span else []
+    return event._replace(text=text, args=args)
+
+def traverse(text, plugins):
+    """
+    Gives every event of the text to the plugins that handle it, and
+    returns the edits they made, as a list of (start, end, replacement)
+    sorted by start, together with a PluginTiming for every plugin.
+
+    The handlers of an event are called after those of the events inside
+    it, and are given its text with their edits made, so a plugin that
+    rewrites a function can be combined with one that rewrites the calls in
+    it. When several plugins handle the same event, each is given the text
+    as the one before left it.
+    """
+    handlers = dict((kind, _handlers(plugins, kind)) for kind in EVENT_KINDS)
+    kinds = [kind for kind in EVENT_KINDS if handlers[kind]]
+    seconds = [0.0] * len(plugins)
+    counts = [0] * len(plugins)
+    edit_counts = [0] * len(plugins)
+    # (start, end, replacement, plugin index), in the order they were made.
+    edits = []
+    # The events whose handlers wait for the events inside them, with the
+    # number of edits made before each of them started.
+    open_events = []
+
+    def close(event, first_inner):
+        inner = edits[first_inner:]
+        if inner:
+            pieces = []
+            position = event.start
+            for start, end, replacement, _ in inner:
+                pieces.append(text[position:start])
+                pieces.append(replacement)
+                position = end
+            pieces.append(text[position:event.end])
+            event = _with_text(event, "".join(pieces))
+        current, last = event, None
+        for i, handler in handlers[event.kind]:
+            start = time.perf_counter()
+            replacement = handler(current)
+            seconds[i] += time.perf_counter() - start
+            counts[i] += 1
+            if replacement is None or replacement == current.text:
+                continue
+            current, last = _with_text(current, replacement), i
+            edit_counts[i] += 1
+        if last is None:
+            return
+        # One edit replaces the inner ones. Only the part that differs from
+        # the original is replaced, so the rest still maps back to where it
+        # came from (see "Converter.get_source_map").
+        original = text[event.start:event.end]
+        replacement = current.text
+        prefix = len(os.path.commonprefix([original, replacement]))
+        suffix = len(os.path.commonprefix([original[prefix:][::-1],
+            replacement[prefix:][::-1]]))
+        del edits[first_inner:]
+        edits.append((event.start + prefix, event.end - suffix,
+            replacement[prefix:len(replacement) - suffix], last))
+
+    for event in events(text, kinds):
+        while open_events and open_events[-1][0].end <= event.start:
+            close(*open_events.pop())
+        open_events.append((event, len(edits)))
+    while open_events:
+        close(*open_events.pop())
+
+    edits.sort(key=lambda edit: edit[0])
+    for previous, edit in zip(edits, edits[1:]):
+        if edit[0] < previous[1]:
+            raise ValueError("Edits of plugins {} and {} overlap at {}".format(
+                plugins[previous[3]].name(), plugins[edit[3]].name(), edit[0]))
+    timings = [PluginTiming(plugin.name(), seconds[i], counts[i], edit_counts[i])
+        for i, plugin in enumerate(plugins)]
+    return [edit[:3] for edit in edits], timings
@@ -0,0 +1,168 @@
+import os, re, sys, time, argparse, tempfile, subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from compile_check import STUB_DIRECTORY, DEFAULT_COMPILER, find_generated_sources
+
+
+
+# The runtime every suite is linked with: it implements the stub KTF and
+# kernel APIs and runs the registered tests (see the comment at its top).
+RUNTIME_SOURCE = os.path.join(STUB_DIRECTORY, "ktf_runtime.c")
+
+BUILD_FLAGS = ["-std=gnu11", "-O2", "-Wall",
+    "-Werror=implicit-function-declaration"]
+
+# One run of a test in a context ("" if the suite has none), as reported
+# by the runtime. "nanoseconds" is the run time (the fastest of the
+# repeats).
+TestRun = namedtuple('TestRun', 'suite test context ok nanoseconds asserts failures')
+
+# The outcome of building and running one converted file. "ok" is False if
+# the build failed, a test failed or the process did not exit cleanly;
+# "output" is the compiler output if the build failed, and the output of
+# the process otherwise.
+NativeRun = namedtuple('NativeRun', 'path ok tests output build_seconds run_seconds')
+
+_test_line = re.compile(r"^(PASS|FAIL) (\w+)\.(\w+)(?:@(\S+))? (\d+) ns "
+    r"(\d+) asserts (\d+) failures$", re.MULTILINE)
+
+
+def build(path, binary, compiler=DEFAULT_COMPILER, include_dirs=()):
+    """
+    Compiles a converted file together with the runtime into an executable.
+    Returns (ok, compiler output).
+    """
+    command = [compiler] + BUILD_FLAGS + ["-I" + d for d in include_dirs] + \
+        ["-I" + STUB_DIRECTORY, path, RUNTIME_SOURCE, "-o", binary]
+    proc = subprocess.run(command, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.returncode == 0, proc.stdout
+
+def parse_tests(output):
+    """
+    Returns the TestRuns reported in the output of a runtime process.
+    """
+    return [TestRun(m.group(2), m.group(3), m.group(4) or "", m.group(1) == "PASS",
+        int(m.group(5)), int(m.group(6)), int(m.group(7)))
+        for m in _test_line.finditer(output)]
+
+def run_file(path, tests=(), repeats=1, timeout=None, compiler=DEFAULT_COMPILER,
+        include_dirs=()):
+    """
+    Builds one converted file in a temporary directory and runs it,
+    returning a NativeRun. Only the named tests are run, if any are given.
+    """
+    with tempfile.TemporaryDirectory(prefix="ktf_native_") as directory:
+        binary = os.path.join(directory,
+            os.path.splitext(os.path.basename(path))[0])
+        start = time.perf_counter()
+        ok, output = build(path, binary, compiler, include_dirs)
+        build_seconds = time.perf_counter() - start
+        if not ok:
+            return NativeRun(path, False, [], output, build_seconds, 0.0)
+        start = time.perf_counter()
+        try:
+            proc = subprocess.run([binary, "-r", str(repeats)] + list(tests),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            output = e.stdout or ""
+            if isinstance(output, bytes):
+                output = output.decode('utf-8', errors='replace')
+            return NativeRun(path, False, parse_tests(output),
+                output + "Timed out after {}s\n".format(timeout), build_seconds,
+                time.perf_counter() - start)
+        run_seconds = time.perf_counter() - start
+    output = proc.stdout
+    if proc.returncode < 0:
+        output += "Killed by signal {}\n".format(-proc.returncode)
+    return NativeRun(path, proc.returncode == 0, parse_tests(output), output,
+        build_seconds, run_seconds)
+
+def run_files(paths, processes=None, tests=(), repeats=1, timeout=None,
+        compiler=DEFAULT_COMPILER, include_dirs=()):
+    """
+    Builds and runs all the files in parallel, and returns their NativeRuns
+    in the order of the paths.
+    """
+    # The work is done by the compiler and test processes, so threads are
+    # enough.
+    with ThreadPoolExecutor(processes or os.cpu_count()) as executor:
+        return list(executor.map(lambda path: run_file(path, tests, repeats,
+            timeout, compiler, include_dirs), paths))
+
+def unmatched_tests(names, runs):
+    """
+    Returns the test names (as given to "run_file") that match no test run
+    in any of the runs.
+    """
+    run_names = set()
+    for run in runs:
+        for test in run.tests:
+            run_names.add(test.test)
+            run_names.add("{}.{}".format(test.suite, test.test))
+    return [name for name in names if name not in run_names]
+
+def _duration(ns):
+    for unit, scale in [("s", 1e9), ("ms", 1e6), ("us", 1e3)]:
+        if ns >= scale:
+            return "{:.2f} {}".format(ns / scale, unit)
+    return "{} ns".format(ns)
+
+def format_runs(runs, verbose=False):
+    """
+    Returns a report with the time and outcome of every test, the output
+    of the files that failed (or of all of them, with verbose), and a
+    summary line.
+    """
+    lines = []
+    for run in runs:
+        lines.append("{} {} (build {:.2f}s, run {:.2f}s)".format(
+            "ok    " if run.ok else "FAILED", run.path, run.build_seconds,
+            run.run_seconds))
+        for test in run.tests:
+            name = "{}.{}".format(test.suite, test.test) + \
+                ("@" + test.context if test.context else "")
+            lines.append("  {} {:<56} {:>12} {:>8} asserts".format(
+                "PASS" if test.ok else "FAIL", name, _duration(test.nanoseconds),
+                test.asserts))
+        if verbose or not run.ok:
+            lines.append(run.output.rstrip())
+    tests = sum(len(run.tests) for run in runs)
+    failed = sum(1 for run in runs for test in run.tests if not test.ok)
+    lines.append("{} files run, {} failed; {} tests, {} failed".format(
+        len(runs), sum(1 for run in runs if not run.ok), tests, failed))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Builds converted files against the stub KTF and kernel '
+                    'headers and the userspace runtime in ktf_stub/, and runs '
+                    'their tests as a normal process, with the time of every '
+                    'test. Only suites that use nothing but the stub APIs '
+                    '(like test_sort and test_string) can be built.')
+    parser.add_argument('paths', nargs='+',
+        help='files to run, or directories to search for *_rewrite.c files')
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('-t', '--test', dest='tests', action='append', default=[],
+        help='only run this test ("test" or "suite.test"); can be repeated')
+    parser.add_argument('-r', '--repeats', type=int, default=1,
+        help='run every test this many times and report the fastest')
+    parser.add_argument('--timeout', type=float, default=None,
+        help='time limit per file in seconds')
+    parser.add_argument('--cc', default=DEFAULT_COMPILER)
+    parser.add_argument('-I', dest='include_dirs', action='append', default=[],
+        help='extra include directory, searched before the stub headers')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='show the output of every file')
+    args = parser.parse_args()
+
+    runs = run_files(find_generated_sources(args.paths), args.jobs, args.tests,
+        args.repeats, args.timeout, args.cc, args.include_dirs)
+    print(format_runs(runs, args.verbose))
+    unknown = unmatched_tests(args.tests, runs)
+    if unknown:
+        print("No test called " + ", ".join(unknown))
+    sys.exit(0 if all(run.ok for run in runs) and not unknown else 1)
@@ -0,0 +1,207 @@
+import os, re, sys, json, argparse
+from bisect import bisect_right
+
+
+
+class OffsetMap(object):
+    """
+    Maps offsets in a text that has been edited back to offsets in the
+    original text. The edited text is split into segments, each of which
+    is either copied from the original (and maps one to one) or has been
+    inserted by an edit (and maps to where the edit was made).
+    """
+
+    def __init__(self, length):
+        self._length = length
+        # The start of every segment in the edited text, the offset in the
+        # original text it maps to, and whether it was copied.
+        self._starts = [0]
+        self._origins = [0]
+        self._copied = [True]
+
+    def lookup(self, offset):
+        """
+        Returns the offset in the original text of the given offset.
+        """
+        i = bisect_right(self._starts, offset) - 1
+        if self._copied[i]:
+            return self._origins[i] + offset - self._starts[i]
+        return self._origins[i]
+
+    def apply_edits(self, edits):
+        """
+        Updates the map after the text has been edited. The edits are a
+        list of (start, end, length), meaning that the text in [start, end)
+        was replaced with length new characters, sorted by start and not
+        overlapping. The offsets are those of the text before the edits.
+        """
+        starts, origins, copied = [], [], []
+
+        def add(start, origin, is_copied):
+            if starts and starts[-1] == start:
+                # The previous segment turned out to be empty.
+                starts.pop(), origins.pop(), copied.pop()
+            if starts and copied[-1] == is_copied and origins[-1] + \
+                    ((start - starts[-1]) if is_copied else 0) == origin:
+                return
+            starts.append(start)
+            origins.append(origin)
+            copied.append(is_copied)
+
+        def copy(begin, end, delta):
+            i = bisect_right(self._starts, begin) - 1
+            while i < len(self._starts) and self._starts[i] < end:
+                start = max(self._starts[i], begin)
+                add(start + delta, self._origins[i] + (start - self._starts[i]
+                    if self._copied[i] else 0), self._copied[i])
+                i += 1
+
+        position = delta = 0
+        for start, end, length in edits:
+            if position < start:
+                copy(position, start, delta)
+            if length:
+                add(start + delta, self.lookup(start), False)
+            delta += length - (end - start)
+            position = end
+        if position < self._length:
+            copy(position, self._length, delta)
+        self._length += delta
+        if not starts:
+            starts, origins, copied = [0], [0], [False]
+        self._starts, self._origins, self._copied = starts, origins, copied
+
+
+def _line_starts(text):
+    return [0] + [m.end() for m in re.finditer("\n", text)]
+
+
+class SourceMap(object):
+    """
+    Maps the lines of a generated file to the lines of the file it was
+    converted from (both numbered from 1). It is stored as runs of
+    (generated line, original line, step): from that generated line on,
+    every line maps to the original line plus step times the distance,
+    until the next run. Copied code has a step of 1, and the lines added
+    by the converter a step of 0.
+    """
+
+    VERSION = 1
+
+    def __init__(self, source, generated, runs):
+        self.source = source
+        self.generated = generated
+        self._runs = runs
+        self._lines = [run[0] for run in runs]
+
+    @classmethod
+    def from_offsets(cls, source, generated, offset_map, original_text, text):
+        """
+        Builds the map of the edited text, given the OffsetMap kept while
+        it was edited.
+        """
+        original_starts = _line_starts(original_text)
+        runs = []
+        for number, start in enumerate(_line_starts(text), 1):
+            line = bisect_right(original_starts, offset_map.lookup(start))
+            if runs:
+                first, origin, step = runs[-1]
+                if step is None:
+                    # A run of a single line, which can go on either way.
+                    if line - origin in (0, 1):
+                        runs[-1] = (first, origin, line - origin)
+                        continue
+                elif origin + step * (number - first) == line:
+                    continue
+            runs.append((number, line, None))
+        runs = [(first, origin, 1 if step is None else step)
+            for first, origin, step in runs]
+        return cls(source, generated, runs)
+
+    def lookup(self, line):
+        """
+        Returns the line of the original file that the generated line came
+        from.
+        """
+        i = max(0, bisect_right(self._lines, line) - 1)
+        first, origin, step = self._runs[i]
+        return origin + step * (line - first)
+
+    def to_json(self):
+        return json.dumps({"version": self.VERSION, "source": self.source,
+            "generated": self.generated, "runs": self._runs})
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        return cls(data["source"], data["generated"],
+            [tuple(run) for run in data["runs"]])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_json(f.read())
+
+
+def map_path(output_file):
+    """
+    The name of the source map written next to an output file.
+    """
+    return output_file + ".map"
+
+
+# Rewriting compiler and KTF messages.
+# -------------------------------------------------------------------
+
+# A "file.c:line" location, as written by compilers and by KTF.
+location = re.compile(r"((?:[\w.+-]*/)*[\w.+-]+\.c):(\d+)")
+
+
+class MessageRewriter(object):
+    """
+    Rewrites the locations in generated files found in compiler or KTF
+    output to the locations in the original files. A source map is looked
+    for next to every generated file mentioned, unless maps are given
+    explicitly, in which case files are matched on their base name.
+    """
+
+    def __init__(self, maps=()):
+        self._given = dict((os.path.basename(m.generated), m) for m in maps)
+        self._found = {}
+
+    def _map_for(self, path):
+        if self._given:
+            return self._given.get(os.path.basename(path))
+        if path not in self._found:
+            self._found[path] = SourceMap.load(map_path(path)) \
+                if os.path.exists(map_path(path)) else None
+        return self._found[path]
+
+    def _rewrite(self, match):
+        source_map = self._map_for(match.group(1))
+        if source_map is None:
+            return match.group(0)
+        return "{}:{}".format(source_map.source,
+            source_map.lookup(int(match.group(2))))
+
+    def rewrite(self, line):
+        return location.sub(self._rewrite, line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Rewrites the locations in converted files found in '
+                    'compiler or KTF output (read from the given files or '
+                    'from stdin) to locations in the original files, using '
+                    'the source maps written next to the converted files.')
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-m', '--map', dest='maps', action='append', default=[],
+        help='source map to use, instead of looking for one next to every '
+             'converted file')
+    args = parser.parse_args()
+
+    rewriter = MessageRewriter([SourceMap.load(path) for path in args.maps])
+    streams = [open(path, 'r') for path in args.files] or [sys.stdin]
+    for stream in streams:
+        for line in stream:
+            sys.stdout.write(rewriter.rewrite(line))
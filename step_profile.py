@@ -0,0 +1,177 @@
+import io, sys, json, time, argparse, contextlib
+from collections import namedtuple
+
+from convert import Converter
+from batch import load_manifest, read_input
+
+
+
+# The time spent in one step of a conversion. "passes" is the number of
+# regex substitutions the step asked for, "skipped" the Pass records of
+# those that were not run because they could not match (see
+# "convert.required_literals"), and "plugins" the PluginTiming records of
+# the plugins the step ran (see "plugins.py"), and "reused" the number of 
+# calls that reused the dummy TEST function of an identical call.
+StepProfile = namedtuple('StepProfile', 'step seconds passes skipped plugins reused',
+    defaults=((), 0))
+
+# The time the analysis of a file takes when it is scanned and when its 
+# index is loaded instead (see "conversion_cache.IndexCache"): "scan" 
+# prepares a Converter from the text alone, "load" parses the index from 
+# JSON, and "prepare" prepares a Converter given the parsed index. 
+# "conversion" is the time of the whole conversion, so that the saving 
+# can be put in proportion.
+IndexProfile = namedtuple('IndexProfile', 'scan load prepare conversion')
+
+# Longest pattern shown in the report before it is cut.
+PATTERN_WIDTH = 60
+
+
+def profile_job(job, text=None, repeat=1):
+    """
+    Converts the job "repeat" times and returns a StepProfile for every step
+    (the construction of the Converter and its analysis of the file are
+    reported as "__init__"). The time
+    of a step is the best of the runs. The output of the Converter is
+    suppressed.
+    """
+    if text is None:
+        text = read_input(job)
+    best = {}
+    profiles = []
+    for _ in range(repeat):
+        profiles = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            converter = Converter(job.input_file, job.output_file, job.rules,
+                text=text).prepare()
+            seconds = time.perf_counter() - start
+            profiles.append(StepProfile("__init__", seconds,
+                len(converter.get_passes()),
+                [p for p in converter.get_passes() if p.skipped]))
+            for step in job.steps:
+                done = len(converter.get_passes())
+                plugins_done = len(converter.get_plugin_timings())
+                reused = converter.get_reused_dummy_functions()
+                start = time.perf_counter()
+                getattr(converter, step)()
+                seconds = time.perf_counter() - start
+                passes = converter.get_passes()[done:]
+                profiles.append(StepProfile(step, seconds, len(passes),
+                    [p for p in passes if p.skipped],
+                    converter.get_plugin_timings()[plugins_done:],
+                    converter.get_reused_dummy_functions() - reused))
+        for i, profile in enumerate(profiles):
+            best[i] = min(best.get(i, profile.seconds), profile.seconds)
+    return [p._replace(seconds=best[i]) for i, p in enumerate(profiles)]
+
+def profile_index(job, text=None, repeat=1):
+    """
+    Measures what the IndexCache saves on the job: the best time of 
+    "repeat" analyses of the file with and without its index, and of the 
+    whole conversion. Returns an IndexProfile.
+    """
+    if text is None:
+        text = read_input(job)
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = json.dumps(Converter(job.input_file, job.output_file, job.rules,
+            text=text).get_index())
+        scan = load = prepare = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            Converter(job.input_file, job.output_file, job.rules,
+                text=text).prepare()
+            scan = min(scan, time.perf_counter() - start)
+            start = time.perf_counter()
+            index = json.loads(data)
+            load = min(load, time.perf_counter() - start)
+            start = time.perf_counter()
+            Converter(job.input_file, job.output_file, job.rules, text=text,
+                index=index).prepare()
+            prepare = min(prepare, time.perf_counter() - start)
+    conversion = sum(p.seconds for p in profile_job(job, text, repeat))
+    return IndexProfile(scan, load, prepare, conversion)
+
+def format_index_profile(profile):
+    saved = profile.scan - profile.load - profile.prepare
+    return "  analysis: scanned {:.3f} ms, from index {:.3f} ms ({:.3f} ms " \
+        "JSON), saves {:.3f} ms = {:.1%} of the conversion".format(
+            profile.scan * 1000, (profile.load + profile.prepare) * 1000,
+            profile.load * 1000, saved * 1000,
+            saved / profile.conversion if profile.conversion else 0.0)
+
+def _short(pattern):
+    pattern = pattern.replace("\n", "\\n").replace("\t", "\\t")
+    if len(pattern) > PATTERN_WIDTH:
+        return pattern[:PATTERN_WIDTH - 3] + "..."
+    return pattern
+
+def format_profile(job, profiles):
+    """
+    Returns a report with one line per step, followed by the time of every
+    plugin the step ran, and the patterns of the passes the step skipped
+    and the text they were missing.
+    """
+    lines = [job.input_file]
+    lines.append("  {:<52} {:>10} {:>7} {:>8}".format(
+        "step", "ms", "passes", "skipped"))
+    for profile in profiles:
+        lines.append("  {:<52} {:>10.3f} {:>7} {:>8}".format(profile.step,
+            profile.seconds * 1000, profile.passes, len(profile.skipped)))
+        for plugin in profile.plugins:
+            lines.append("      plugin {:<41} {:>10.3f} {:>7} events, {} edits".format(
+                plugin.plugin, plugin.seconds * 1000, plugin.events, plugin.edits))
+        if profile.reused:
+            lines.append("      reused {} dummy TEST functions".format(
+                profile.reused))
+        for skipped in profile.skipped:
+            lines.append("      skipped {} (no {!r})".format(
+                _short(skipped.pattern), skipped.missing))
+    total = sum(p.seconds for p in profiles)
+    passes = sum(p.passes for p in profiles)
+    skipped = sum(len(p.skipped) for p in profiles)
+    lines.append("  {:<52} {:>10.3f} {:>7} {:>8}".format("total",
+        total * 1000, passes, skipped))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Times every step of the conversions listed in a JSON '
+                    'manifest (see batch.py), and lists the passes that were '
+                    'skipped because they could not match.')
+    parser.add_argument('manifest')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+        help='convert every file this many times and report the best times')
+    parser.add_argument('--index', action='store_true',
+        help='also report the time the analysis of every file takes when '
+             'it is scanned and when its index is loaded from the index '
+             'cache instead')
+    parser.add_argument('--memprofile', action='store_true',
+        help='report the memory allocated by every step instead of its time '
+             '(see memory_profile.py)')
+    parser.add_argument('--top', type=int, default=10,
+        help='with --memprofile, the number of allocation sites to list')
+    parser.add_argument('--budget', type=float, default=None,
+        help='with --memprofile, fail if a conversion allocates more than '
+             'this many times the size of its input')
+    args = parser.parse_args()
+
+    if not args.memprofile:
+        for job in load_manifest(args.manifest):
+            print(format_profile(job, profile_job(job, repeat=args.repeat)))
+            if args.index:
+                print(format_index_profile(profile_index(job,
+                    repeat=args.repeat)))
+        sys.exit(0)
+
+    from memory_profile import profile_memory, format_memory, MemoryBudgetExceeded
+    failed = 0
+    for job in load_manifest(args.manifest):
+        try:
+            print(format_memory(job, profile_memory(job, top=args.top,
+                budget=args.budget)))
+        except MemoryBudgetExceeded as e:
+            print(e)
+            failed += 1
+    sys.exit(1 if failed else 0)
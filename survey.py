@@ -0,0 +1,65 @@
+import os, sys, glob, json, argparse
+from multiprocessing import Pool
+
+from convert import Converter
+from batch import load_wrapper
+
+
+
+def find_sources(paths):
+    """
+    Returns the C files found in the given paths. Paths that are files are
+    used as they are; directories are searched recursively.
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(glob.glob(
+                os.path.join(path, "**", "*.c"), recursive=True)))
+        else:
+            sources.append(path)
+    return sources
+
+def inspect_file(path, rules=None):
+    """
+    Returns the report of "Converter.inspect" for one file. Nothing is
+    converted. Files that can't be read are reported with an "error".
+    """
+    try:
+        return Converter(path, None, rules or {}).inspect()
+    except (IOError, UnicodeDecodeError) as e:
+        return {"file": path, "error": str(e)}
+
+def _inspect_task(task):
+    return inspect_file(*task)
+
+def survey(paths, rules=None, processes=1):
+    """
+    Returns the reports of all the files, in order, inspecting them with
+    that many processes.
+    """
+    tasks = [(path, rules) for path in paths]
+    if processes == 1 or len(tasks) < 2:
+        return [_inspect_task(task) for task in tasks]
+    with Pool(processes) as pool:
+        return pool.map(_inspect_task, tasks, chunksize=8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Reports what the converter would work with in C files '
+                    '(module init and exit, candidate test functions, '
+                    'helpers, calls with extra arguments and assertion '
+                    'macros) as JSON, without converting them.')
+    parser.add_argument('paths', nargs='+',
+        help='files to inspect, or directories to search for *.c files')
+    parser.add_argument('-w', '--wrapper',
+        help='convert_wrapper_*.py file whose rules to inspect the files with')
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('--indent', type=int, default=None)
+    args = parser.parse_args()
+
+    rules = load_wrapper(args.wrapper)[0] if args.wrapper else None
+    reports = survey(find_sources(args.paths), rules, args.jobs)
+    json.dump(reports, sys.stdout, indent=args.indent)
+    sys.stdout.write("\n")
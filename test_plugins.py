@@ -0,0 +1,73 @@
+from plugins import ConverterPlugin, traverse
+
+
+SOURCE = """#include <linux/module.h>
+
+TEST(suite, check_err)
+{
+\tXA_BUG_ON(xa, xa_err(xa_store(xa, 0)) != 0);
+\tXA_BUG_ON(xa, xa_err(xa_erase(xa, 0)) != 0);
+}
+"""
+
+
+class LogStart(ConverterPlugin):
+    def on_function(self, event):
+        if event.text.startswith("TEST("):
+            brace = event.text.index("{") + 1
+            return event.text[:brace] + '\n\ttlog(T_INFO, "start");' + \
+                event.text[brace:]
+
+class BugToExpect(ConverterPlugin):
+    def on_macro(self, event):
+        if event.name == "XA_BUG_ON":
+            return "EXPECT_FALSE(" + ", ".join(event.args[1:]) + ")"
+
+class RenameStore(ConverterPlugin):
+    def on_call(self, event):
+        if event.name == "xa_store":
+            return "xa_store_index" + event.text[len(event.name):]
+
+
+def convert(text, plugins):
+    edits, timings = traverse(text, plugins)
+    pieces = []
+    position = 0
+    for start, end, replacement in edits:
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces), timings
+
+
+def test_function_and_macro_plugins():
+    text, timings = convert(SOURCE, [LogStart(), BugToExpect()])
+    assert text == """#include <linux/module.h>
+
+TEST(suite, check_err)
+{
+\ttlog(T_INFO, "start");
+\tEXPECT_FALSE(xa_err(xa_store(xa, 0)) != 0);
+\tEXPECT_FALSE(xa_err(xa_erase(xa, 0)) != 0);
+}
+"""
+    assert [t.edits for t in timings] == [1, 2]
+
+def test_call_inside_macro():
+    text, _ = convert(SOURCE, [BugToExpect(), RenameStore(), LogStart()])
+    assert "\tEXPECT_FALSE(xa_err(xa_store_index(xa, 0)) != 0);" in text
+    assert '{\n\ttlog(T_INFO, "start");\n' in text
+
+def test_plugins_of_the_same_event():
+    text, _ = convert(SOURCE, [LogStart(), LogStart()])
+    assert text.count('tlog(T_INFO, "start");') == 2
+
+def test_edits_only_cover_changes():
+    # The function is not replaced as a whole, only the new line is
+    # inserted.
+    edits, _ = traverse(SOURCE, [LogStart()])
+    assert len(edits) == 1
+    start, end, replacement = edits[0]
+    assert start == end
+    assert replacement.strip() == 'tlog(T_INFO, "start");'